@@ -1,14 +1,38 @@
+import asyncio
+import bisect
 import datetime
+import enum
+import errno
+import hashlib
+import hmac
+import itertools
 import json
+import os
+import random
 import select
+import selectors
 import socket
 import struct
+import sys
 import threading
-from typing import Optional, TypedDict
+import time
+from collections import OrderedDict, deque
+from operator import itemgetter
+from typing import Iterable, Optional
 
-from prompt_toolkit import prompt
+from prompt_toolkit import PromptSession
 from prompt_toolkit.patch_stdout import patch_stdout
 
+try:
+    import msgpack
+except ImportError:  # binary encoding is optional, text always works
+    msgpack = None
+
+try:
+    import sqlite3
+except ImportError:  # Python built without it: no /search
+    sqlite3 = None
+
 __ = """
         |             |     _ \\                       _ \\               |           |
    __|  __ \\    _` |  __|  |   | \\ \\   /  _ \\   __|  |   |  _` |   __|  |  /   _ \\  __|   __|
@@ -22,22 +46,121 @@ __ = """
 # <x> Transmission Control Protocol (TCP) :: establishes connection / handshake
 # ├─<!>─ +: ordered chat, sending files
 # ╰─<!>─ -: slow
-# < > User Datagram Protocol (UDP) :: no connection / broadcast away
+# <x> User Datagram Protocol (UDP) :: no connection / broadcast away
 # ├─<!>─ +: video/audio chat/mirror, fast
-# ╰─<!>─ -: disorderly
+# ├─<!>─ -: disorderly
+# ╰─<!>─ side channel: presence, typing, heartbeats; newest seq wins
 # <x> Application Layer Protocol (ALP) :: manual packing via struct |
 #     encode()/decode() | json
+# ├─<!>─ handshake: client '!16s16s' (username, version) header
+# ├─<!>─ framed (>= 26.10.18): '!BI' (type, length) header + payload
+# ├─<!>─ '+mp' version suffix: msgpack records, formatted client-side
+# ├─<!>─ RESUME '!Q' last-seen id: reconnects replay only what was missed
+# ├─<!>─ JOIN '!Q' + room: per-room member sets and history windows
+# ├─<!>─ UDP frame: '!H8s' (port, token) offer, datagrams '!BQ' + token
+# ├─<!>─ PING/PONG '!Q': liveness both ways, silent peers are reaped
+# ├─<!>─ FILE_*: resumable chunked uploads, sendfile() downloads
+# ├─<!>─ PEER/FEDERATE: server links, batched lines + origin id and path
+# ╰─<!>─ workers > 1: SO_REUSEPORT processes, RELAY frames over a unix bus
 # *Note: For simplicity, no encryption is used
 # Python 3.13.3
 # ─────────────────────────────────────
 
 
+# ────────── Wire Protocol ──────────
+class ProtocolError(ValueError):
+    """Peer sent bytes that can't be a valid frame."""
+
+
+class FrameType(enum.IntEnum):
+    CHAT = 1        # to server: utf-8 text, to client: '!Q' id + chat line
+    HISTORY = 2     # json list of chat logs, ends the framed handshake
+    CHAT_BIN = 3    # msgpack [msg id, ts, user id, text]
+    HISTORY_BIN = 4  # msgpack {'users': {id: name}, 'messages': [CHAT_BIN]}
+    USER = 5        # msgpack [user id, username], sent before first use
+    RESUME = 6      # '!Q' last-seen msg id (0 = fresh) [+ room], first frame
+    JOIN = 7        # '!Q' last-seen msg id in room + utf-8 room name
+    RELAY = 8       # worker bus only: json chat record (+ origin)
+    UDP = 9         # to server: empty ask, to client: '!H8s' port + token
+    PING = 10       # '!Q' opaque, answered with a PONG carrying it back
+    PONG = 11
+    FILE_OFFER = 12   # to server: json {key, name, size}
+    FILE_ACCEPT = 13  # to client: json {key, offset} (= size: stored) | error
+    FILE_CHUNK = 14   # '!16sQ' key + offset, then up to FILE_CHUNK_SIZE bytes
+    FILE_GET = 15     # to server: json {key, offset}
+    FILE_META = 16    # to client: json {key, name, size, offset} | error
+    SEARCH = 17       # to server: json {words, user, room, after, before,
+    #                   cursor}, every field optional
+    SEARCH_HITS = 18  # to client: json {hits: [records], next} | error
+    PEER = 19         # server link: json {node, secret}, first frame each way
+    FEDERATE = 20     # server link: json [[seq, room, user, text, path], ...]
+    #                   path: nodes it passed, path[0] + seq = origin id
+
+
+class DatagramType(enum.IntEnum):
+    """UDP side channel: loss-tolerant, only the newest state matters."""
+    HELLO = 1       # client: binds its address to the token
+    HEARTBEAT = 2   # client: '!Q' send time, echoed back; keeps the binding
+    PRESENCE = 3    # server: '!B' online/offline + username
+    TYPING = 4      # client: '!B' 1/0, server: '!B' 1/0 + username
+
+
+class FrameDecoder:
+    """Reassembles '!BI' frames from arbitrary partial reads."""
+    __slots__ = ('buf', 'max_size')
+
+    def __init__(self, max_size: int):
+        self.buf = bytearray()
+        self.max_size = max_size
+
+    def feed(self, data: bytes) -> list[tuple[int, bytes]]:
+        buf = self.buf
+        buf += data
+        frames = []
+        offset = 0
+        end = len(buf)
+        while end - offset >= ChoverBase.FRAME_HEADER_SIZE:
+            frame_type, length = struct.unpack_from(
+                ChoverBase.FRAME_HEADER_FORMAT, buf, offset)
+            if length > self.max_size:
+                raise ProtocolError(f"frame of {length} bytes exceeds "
+                                    f"limit of {self.max_size}")
+            start = offset + ChoverBase.FRAME_HEADER_SIZE
+            if end - start < length:
+                break
+            frames.append((frame_type, bytes(buf[start:start + length])))
+            offset = start + length
+        if offset:
+            del buf[:offset]  # one compaction per read, not per frame
+        return frames
+
+
 # ────────── For Future Use ──────────
 class ChoverBase:
     BUFFER_SIZE: int = 1024
+    RECV_SIZE: int = 65536          # framed reads, many frames per syscall
     HEADER_FORMAT: str = '!16s16s'  # 2 16-byte str
     HEADER_SIZE: int = 32
-    version: str = '25.6.16'
+    FRAME_HEADER_FORMAT: str = '!BI'  # 1-byte type + 4-byte length
+    FRAME_HEADER_SIZE: int = 5
+    MAX_FRAME_SIZE: int = 16 * 1024 * 1024
+    ID_FORMAT: str = '!Q'             # message ids on the wire
+    ID_SIZE: int = 8
+    DATAGRAM_FORMAT: str = '!BQ'      # 1-byte type + 8-byte sequence
+    DATAGRAM_SIZE: int = 9
+    UDP_TOKEN_SIZE: int = 8           # client datagrams: header+token+body
+    MAX_DATAGRAM_SIZE: int = 1200     # under common path MTUs
+    FILE_CHUNK_FORMAT: str = '!16sQ'  # transfer key + offset
+    FILE_CHUNK_HEADER: int = 24
+    FILE_CHUNK_SIZE: int = 64 * 1024  # a chat frame waits one chunk at most
+    PING_INTERVAL: float = 15.0       # silent this long -> PING the peer
+    IDLE_TIMEOUT: float = 45.0        # silent this long -> peer is gone
+    version: str = '26.10.18'
+    framed_version: str = '26.10.18'  # first version speaking frames
+    binary_suffix: str = '+mp'        # version suffix asking for msgpack
+    TIME_FORMAT: str = '%b %d [%I:%M %p]'
+    default_room: str = 'lobby'       # legacy clients never leave it
+    ROOM_NAME_MAX: int = 24           # utf-8 bytes
     unknown_version: str = '4.0.4'
     default_username: str = 'guest'
     socket: Optional[socket.socket]
@@ -47,6 +170,73 @@ class ChoverBase:
         self.PORT = PORT
         self.socket = None
 
+    # ────────── Framing ──────────
+    @classmethod
+    def pack_frame(cls, frame_type: int, payload: bytes) -> bytes:
+        return struct.pack(cls.FRAME_HEADER_FORMAT,
+                           frame_type, len(payload)) + payload
+
+    def new_decoder(self) -> FrameDecoder:
+        return FrameDecoder(self.MAX_FRAME_SIZE)
+
+    def recv_frames(self, sock: socket.socket,
+                    decoder: FrameDecoder) -> Optional[list[tuple[int, bytes]]]:
+        """One recv, every complete frame it finished; None on EOF."""
+        data = sock.recv(self.RECV_SIZE)
+        if not data:
+            return None
+        return decoder.feed(data)
+
+    def recv_exact(self, sock: socket.socket, size: int) -> bytes:
+        """Blocking read of exactly size bytes (fewer only on EOF)."""
+        data = bytearray()
+        while len(data) < size:
+            chunk = sock.recv(size - len(data))
+            if not chunk:
+                break
+            data += chunk
+        return bytes(data)
+
+    def speaks_frames(self, version: str) -> bool:
+        return (self.parse_version(version)
+                >= self.parse_version(self.framed_version))
+
+    def wants_binary(self, version: str) -> bool:
+        return (msgpack is not None and self.speaks_frames(version)
+                and version.endswith(self.binary_suffix))
+
+    def valid_room(self, name: str) -> bool:
+        return (0 < len(name.encode()) <= self.ROOM_NAME_MAX
+                and name.replace('-', '').replace('_', '').isalnum())
+
+    @staticmethod
+    def format_size(size: int) -> str:
+        for unit in ('B', 'KB', 'MB', 'GB'):
+            if size < 1024 or unit == 'GB':
+                break
+            size /= 1024
+        return f'{size:.0f} {unit}' if unit == 'B' else f'{size:.1f} {unit}'
+
+    def pack_ping(self, frame_type: int = FrameType.PING) -> bytes:
+        return self.pack_frame(frame_type, struct.pack(
+            '!Q', time.monotonic_ns()))
+
+    def pack_room(self, last_id: int, room: str) -> bytes:
+        """RESUME / JOIN payload."""
+        return struct.pack(self.ID_FORMAT, last_id) + room.encode()
+
+    def format_time(self, ts: int) -> str:
+        return datetime.datetime.fromtimestamp(ts).strftime(self.TIME_FORMAT)
+
+    @staticmethod
+    def parse_version(version: str) -> tuple[int, ...]:
+        parts = []
+        for part in version.split('+', 1)[0].split('.'):
+            if not part.isdigit():
+                break
+            parts.append(int(part))
+        return tuple(parts)
+
     def get_local_ip(self) -> str:
         s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         try:
@@ -59,13 +249,967 @@ class ChoverBase:
         return ip
 
 
+# ────────── History ──────────
+class ChatHistory:
+    """Bounded ring of recent chat records with cached wire snapshots.
+
+    Every record is serialized once, on append; a join only concatenates
+    the cached fragments, and joins between two messages share one buffer.
+    Records get increasing ids, so a reconnecting client that sends its
+    last-seen id is replayed only the records after it.
+    """
+
+    # what a 25.6.16 client knows: it reads history with one 1024-byte recv
+    LEGACY_KEYS: tuple[str, ...] = ('username', 'now', 'message')
+
+    def __init__(self, limit: int, first_id: int = 1):
+        self.records: deque[dict] = deque(maxlen=limit)
+        self._json: deque[bytes] = deque(maxlen=limit)
+        self._legacy: deque[bytes] = deque(maxlen=limit)
+        self._packed: deque[bytes] = deque(maxlen=limit)
+        self._user_ids: deque[int] = deque(maxlen=limit)
+        self._snapshots: dict[tuple, bytes] = {}
+        self.next_id = first_id
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(tuple(self.records))
+
+    def append(self, record: dict, user_id: int) -> dict:
+        """Store record, giving it the next id unless it already has one."""
+        with self.lock:  # ids in ring order, even across reader threads
+            if record.get('id') is None:
+                record['id'] = self.next_id
+            self.next_id = max(self.next_id, record['id'] + 1)
+            self.records.append(record)
+            self._json.append(json.dumps(record).encode())
+            self._legacy.append(json.dumps(
+                {key: record[key] for key in self.LEGACY_KEYS}).encode())
+            self._packed.append(msgpack.packb(
+                [record['id'], record['ts'], user_id, record['message']])
+                if msgpack is not None else b'')
+            self._user_ids.append(user_id)
+            self._snapshots.clear()
+        return record
+
+    def _resume_point(self, last_id: int) -> int:
+        """Ring index just past last_id; 0 (everything) when the ring no
+        longer reaches back to it or it isn't one of ours."""
+        records = self.records
+        if (not last_id or not records or last_id > records[-1]['id']
+                or last_id < records[0]['id'] - 1):
+            return 0
+        return bisect.bisect_right(records, last_id, key=itemgetter('id'))
+
+    def snapshot_legacy(self) -> bytes:
+        """The whole ring as the original server sent it, without the
+        id, ts and room keys a legacy client has no use for."""
+        with self.lock:
+            snapshot = self._snapshots.get(('legacy',))
+            if snapshot is None:
+                snapshot = b'[' + b', '.join(self._legacy) + b']'
+                self._snapshots[('legacy',)] = snapshot
+            return snapshot
+
+    def _json_since(self, start: int) -> bytes:
+        snapshot = self._snapshots.get(('json', start))
+        if snapshot is None:
+            snapshot = b'[' + b', '.join(
+                itertools.islice(self._json, start, None)) + b']'
+            self._snapshots[('json', start)] = snapshot
+        return snapshot
+
+    def snapshot_frame(self, last_id: int = 0) -> bytes:
+        # keyed by resume point: a reconnect storm shares a handful of deltas
+        with self.lock:
+            start = self._resume_point(last_id)
+            frame = self._snapshots.get(('frame', start))
+            if frame is None:
+                frame = ChoverBase.pack_frame(FrameType.HISTORY,
+                                              self._json_since(start))
+                self._snapshots[('frame', start)] = frame
+            return frame
+
+    def snapshot_binary_frame(self, usernames: list[str], last_id: int = 0
+                              ) -> tuple[bytes, frozenset[int]]:
+        """HISTORY_BIN frame, the msgpack array spliced from fragments,
+        and the user ids it names: only those its messages use."""
+        with self.lock:
+            start = self._resume_point(last_id)
+            key = ('binary', start)
+            snapshot = self._snapshots.get(key)
+            if snapshot is None:
+                user_ids = frozenset(
+                    itertools.islice(self._user_ids, start, None))
+                count = len(self._packed) - start
+                if count < 16:
+                    header = struct.pack('!B', 0x90 | count)
+                elif count < 1 << 16:
+                    header = struct.pack('!BH', 0xdc, count)
+                else:
+                    header = struct.pack('!BI', 0xdd, count)
+                payload = b''.join((
+                    b'\x82',  # fixmap, 2 entries
+                    msgpack.packb('users'), msgpack.packb(
+                        {user_id: usernames[user_id] for user_id in user_ids}),
+                    msgpack.packb('messages'), header,
+                    *itertools.islice(self._packed, start, None)))
+                snapshot = (ChoverBase.pack_frame(FrameType.HISTORY_BIN,
+                                                  payload), user_ids)
+                self._snapshots[key] = snapshot
+            return snapshot
+
+
+class SegmentedLog:
+    """Append-only JSON-lines chat log split into size-rotated segments."""
+    FSYNC_POLICIES: tuple[str, ...] = ('always', 'interval', 'never')
+    SEGMENT_FORMAT: str = 'chover-{:06d}.log'
+
+    def __init__(self, directory: str, segment_bytes: int, fsync: str,
+                 fsync_interval: float, keep_segments: int = 0):
+        if fsync not in self.FSYNC_POLICIES:
+            raise ValueError(f"unknown fsync policy {fsync!r}, "
+                             f"expected one of {self.FSYNC_POLICIES}")
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.keep_segments = keep_segments  # 0 keeps every segment
+        self.synced_at = time.monotonic()
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        segments = self.segments()
+        self.index = segments[-1][0] if segments else 1
+        self.file = open(self.path(self.index), 'ab')
+
+    def path(self, index: int) -> str:
+        return os.path.join(self.directory, self.SEGMENT_FORMAT.format(index))
+
+    def segments(self) -> list[tuple[int, str]]:
+        found = []
+        for name in os.listdir(self.directory):
+            if name.startswith('chover-') and name.endswith('.log'):
+                number = name[len('chover-'):-len('.log')]
+                if number.isdigit():
+                    found.append((int(number),
+                                  os.path.join(self.directory, name)))
+        return sorted(found)
+
+    def append(self, record: dict):
+        line = json.dumps({
+            "room": record['room'],
+            "id": record['id'],
+            "ts": record['ts'],
+            "username": record['username'],
+            "message": record['message'],
+        }).encode() + b'\n'
+        with self.lock:
+            if self.file.tell() + len(line) > self.segment_bytes \
+                    and self.file.tell():
+                self._rotate()
+            self.file.write(line)
+            self.file.flush()
+            now = time.monotonic()
+            if self.fsync == 'always' or (
+                    self.fsync == 'interval'
+                    and now - self.synced_at >= self.fsync_interval):
+                os.fsync(self.file.fileno())
+                self.synced_at = now
+
+    def _rotate(self):
+        if self.fsync != 'never':
+            os.fsync(self.file.fileno())
+        self.file.close()
+        self.index += 1
+        self.file = open(self.path(self.index), 'ab')
+        if self.keep_segments:
+            for _, path in self.segments()[:-self.keep_segments]:
+                os.remove(path)
+
+    def tail(self, count: int) -> list[dict]:
+        """Last count records, reading segments newest-first only as needed."""
+        records: list[dict] = []
+        for _, path in reversed(self.segments()):
+            with open(path, 'rb') as f:
+                lines = f.read().splitlines()
+            chunk = []
+            for line in lines:
+                try:
+                    chunk.append(json.loads(line))
+                except ValueError:
+                    continue  # torn write at a crash, skip it
+            records[:0] = chunk
+            if len(records) >= count:
+                break
+        return records[-count:] if count else []
+
+    def records(self):
+        """Every record, oldest segment first."""
+        for _, path in self.segments():
+            with open(path, 'rb') as f:
+                for line in f:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        continue
+
+    def close(self):
+        with self.lock:
+            if self.fsync != 'never':
+                os.fsync(self.file.fileno())
+            self.file.close()
+
+
+class ChatIndex:
+    """Searchable copy of the chat log in SQLite, full-text with FTS5.
+
+    Callers only append to a queue; one writer thread inserts a batch per
+    transaction. Searches run on the caller's thread over its own read
+    connection, WAL keeps them from blocking the writer. Worker processes
+    open the bus's file read-only."""
+    SCHEMA: tuple[str, ...] = (
+        'CREATE TABLE IF NOT EXISTS messages (seq INTEGER PRIMARY KEY, '
+        'room TEXT NOT NULL, id INTEGER, ts INTEGER NOT NULL, '
+        'username TEXT NOT NULL, message TEXT NOT NULL, UNIQUE (room, id))',
+        'CREATE INDEX IF NOT EXISTS messages_user '
+        'ON messages (username, seq)',
+        'CREATE INDEX IF NOT EXISTS messages_room ON messages (room, seq)',
+    )
+    FTS_SCHEMA: tuple[str, ...] = (
+        "CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5("
+        "message, content='messages', content_rowid='seq')",
+        'CREATE TRIGGER IF NOT EXISTS messages_ai AFTER INSERT ON messages '
+        'BEGIN INSERT INTO messages_fts (rowid, message) '
+        'VALUES (new.seq, new.message); END',
+    )
+    INSERT: str = ('INSERT OR IGNORE INTO messages '
+                   '(room, id, ts, username, message) VALUES (?, ?, ?, ?, ?)')
+
+    def __init__(self, path: str, batch: int = 512, interval: float = 0.5,
+                 limit: int = 100000, writable: bool = True):
+        self.path = path
+        self.batch = batch
+        self.interval = interval  # a burst gathers this long per commit
+        self.limit = limit
+        self.writable = writable
+        self.local = threading.local()  # one read connection per thread
+        self.queue: deque[tuple] = deque()
+        self.lock = threading.Lock()
+        self.ready = threading.Condition(self.lock)
+        self.dropped = 0
+        self.closed = False
+        self.thread: Optional[threading.Thread] = None
+        self.fts: Optional[bool] = None  # read-only: asked at first search
+        self.fresh = False  # no rows yet: backfill the whole log
+        if not writable:
+            return
+        db = sqlite3.connect(path)
+        try:
+            db.execute('PRAGMA journal_mode=WAL')
+            for statement in self.SCHEMA:
+                db.execute(statement)
+            try:
+                for statement in self.FTS_SCHEMA:
+                    db.execute(statement)
+                self.fts = True
+            except sqlite3.OperationalError:  # SQLite without FTS5
+                self.fts = False
+            db.commit()
+            self.fresh = db.execute(
+                'SELECT 1 FROM messages LIMIT 1').fetchone() is None
+        finally:
+            db.close()
+
+    def start(self, backfill=()):
+        """Start the writer; it inserts backfill (stored records) first."""
+        self.thread = threading.Thread(target=self.run, args=(backfill,),
+                                       daemon=True)
+        self.thread.start()
+
+    def append(self, record: dict):
+        row = (record['room'], record.get('id'), record['ts'],
+               record['username'], record['message'])
+        with self.lock:
+            if len(self.queue) >= self.limit:
+                self.dropped += 1  # still in the log, just not searchable
+                return
+            self.queue.append(row)
+            if len(self.queue) == 1 or len(self.queue) >= self.batch:
+                self.ready.notify()
+
+    def run(self, backfill):
+        db = sqlite3.connect(self.path)
+        db.execute('PRAGMA synchronous=NORMAL')  # the log is the record
+        rows = []
+        for stored in backfill:  # an older log, or the tail a crash lost
+            rows.append((stored.get('room', ChoverBase.default_room),
+                         stored.get('id'), stored['ts'], stored['username'],
+                         stored['message']))
+            if len(rows) >= self.batch:
+                self.insert(db, rows)
+                rows = []
+        self.insert(db, rows)
+        while True:
+            with self.lock:
+                while not self.queue and not self.closed:
+                    self.ready.wait()
+                if not self.closed and len(self.queue) < self.batch:
+                    self.ready.wait(self.interval)
+                rows = [self.queue.popleft() for _ in range(
+                    min(len(self.queue), self.batch))]
+                if not rows and self.closed:
+                    break
+            self.insert(db, rows)
+        db.close()
+
+    def insert(self, db, rows: list[tuple]):
+        if not rows:
+            return
+        try:
+            with db:  # one transaction a batch
+                db.executemany(self.INSERT, rows)
+        except sqlite3.Error:
+            self.dropped += len(rows)
+
+    def reader(self):
+        db = getattr(self.local, 'db', None)
+        if db is None:
+            db = sqlite3.connect(f'file:{self.path}?mode=ro', uri=True)
+            self.local.db = db
+        return db
+
+    def search(self, words: list[str], user: Optional[str] = None,
+               room: Optional[str] = None, after: Optional[int] = None,
+               before: Optional[int] = None, cursor: Optional[int] = None,
+               limit: int = 20) -> tuple[list[dict], Optional[int]]:
+        """Newest first; the second value is the cursor of the next page
+        (seq of the last hit), None when this was the last one."""
+        db = self.reader()
+        if self.fts is None:
+            self.fts = db.execute("SELECT 1 FROM sqlite_master WHERE name = "
+                                  "'messages_fts'").fetchone() is not None
+        where, args = [], []
+        table = 'messages m'
+        if words and self.fts:
+            # every word quoted: user text never parses as FTS5 syntax
+            table = 'messages_fts f JOIN messages m ON m.seq = f.rowid'
+            where.append('messages_fts MATCH ?')
+            args.append(' '.join('"' + word.replace('"', '""') + '"'
+                                 for word in words))
+        else:
+            for word in words:
+                where.append("m.message LIKE ? ESCAPE '\\'")
+                args.append('%' + word.replace('\\', '\\\\').replace(
+                    '%', '\\%').replace('_', '\\_') + '%')
+        for clause, value in (('m.username = ?', user), ('m.room = ?', room),
+                              ('m.ts >= ?', after), ('m.ts < ?', before),
+                              ('m.seq < ?', cursor)):
+            if value is not None:
+                where.append(clause)
+                args.append(value)
+        query = (f"SELECT m.seq, m.room, m.id, m.ts, m.username, m.message "
+                 f"FROM {table}"
+                 + (f" WHERE {' AND '.join(where)}" if where else '')
+                 + ' ORDER BY m.seq DESC LIMIT ?')
+        rows = db.execute(query, (*args, limit + 1)).fetchall()
+        hits = [{"room": hit_room, "id": msg_id, "ts": ts,
+                 "username": username, "message": message}
+                for _, hit_room, msg_id, ts, username, message in rows[:limit]]
+        return hits, rows[limit - 1][0] if len(rows) > limit else None
+
+    def close(self):
+        """Commit what is queued, then stop the writer."""
+        with self.lock:
+            self.closed = True
+            self.ready.notify()
+        if self.thread is not None:
+            self.thread.join()
+
+
+# ────────── Metrics ──────────
+class Histogram:
+    """Power-of-two buckets: observe() is a bit_length and two adds."""
+    __slots__ = ('counts', 'count', 'total', 'max')
+
+    def __init__(self):
+        self.counts = [0] * 65  # bucket i: values of bit_length i
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    def observe(self, value: int):
+        self.counts[value.bit_length()] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q: float) -> int:
+        """Upper bound of the bucket holding the q-th observation."""
+        target = q * self.count
+        seen = 0
+        for bits, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= target:
+                return min((1 << bits) - 1, self.max)
+        return self.max
+
+    def snapshot(self) -> dict:
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0,
+            "max": self.max,
+            "p50": self.quantile(0.50),
+            "p99": self.quantile(0.99),
+            "p999": self.quantile(0.999),
+            "buckets": {(1 << bits) - 1: count
+                        for bits, count in enumerate(self.counts) if count},
+        }
+
+
+class ServerMetrics:
+    """Plain counters, bumped inline on the hot path. Under the thread
+    engine concurrent bumps may race and undercount slightly."""
+    __slots__ = ('started', 'connections', 'disconnects', 'messages_in',
+                 'messages_out', 'dropped', 'evictions', 'reaped', 'bytes_in',
+                 'bytes_out', 'send_calls', 'datagrams_in', 'datagrams_out',
+                 'datagrams_dropped', 'federated_in', 'federated_out',
+                 'federated_dup', 'broadcast_us', 'handshake_us',
+                 'chat_path_us')
+
+    def __init__(self):
+        self.started = time.time()
+        self.connections = 0   # accepted, ever
+        self.disconnects = 0
+        self.messages_in = 0   # chat lines received
+        self.messages_out = 0  # chat lines queued to recipients
+        self.dropped = 0       # ...shed for slow consumers instead
+        self.evictions = 0
+        self.reaped = 0        # silent past IDLE_TIMEOUT
+        self.bytes_in = 0      # frames handled (header + payload), raw text
+        self.bytes_out = 0     # bytes the kernel accepted
+        self.send_calls = 0    # send/sendmsg/sendfile on client sockets
+        self.datagrams_in = 0
+        self.datagrams_out = 0
+        self.datagrams_dropped = 0  # stale, unknown token, or no buffer
+        self.federated_in = 0   # lines from other servers, delivered
+        self.federated_out = 0  # lines queued to server links
+        self.federated_dup = 0  # ...seen before or looped back, dropped
+        self.broadcast_us = Histogram()  # every fan-out
+        self.handshake_us = Histogram()  # accept -> chat stage
+        self.chat_path_us = Histogram()  # S3 -> S4, 1 in SAMPLE_EVERY
+
+
+# ────────── Logging ──────────
+class ServerLog:
+    """Background log writer: callers append to a bounded queue and go on,
+    one thread prints and writes JSON lines a batch at a time."""
+    DROP_POLICIES: tuple[str, ...] = ('drop', 'block')
+
+    def __init__(self, console: bool, path: Optional[str], file_bytes: int,
+                 keep_files: int, limit: int, batch: int, policy: str):
+        if policy not in self.DROP_POLICIES:
+            raise ValueError(f"unknown log drop policy {policy!r}, "
+                             f"expected one of {self.DROP_POLICIES}")
+        self.console = console
+        self.path = path
+        self.file_bytes = file_bytes
+        self.keep_files = keep_files
+        self.limit = limit
+        self.batch = batch
+        self.policy = policy
+        self.queue: deque[tuple] = deque()
+        self.lock = threading.Lock()
+        self.ready = threading.Condition(self.lock)  # writer waits here
+        self.space = threading.Condition(self.lock)  # 'block' callers here
+        self.dropped = 0
+        self.reported = 0  # drops already written as a warning
+        self.closed = False
+        self.file = open(path, 'ab') if path is not None else None
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def put(self, event: str, text: str, fields: Optional[dict] = None):
+        """Queue one event; the JSON is built on the writer thread."""
+        entry = (time.time(), event, text, fields)
+        with self.lock:
+            if self.closed:
+                return
+            if len(self.queue) >= self.limit:
+                if self.policy == 'drop':
+                    self.dropped += 1
+                    return
+                while len(self.queue) >= self.limit and not self.closed:
+                    self.space.wait()
+            self.queue.append(entry)
+            if len(self.queue) == 1:
+                self.ready.notify()
+
+    def run(self):
+        while True:
+            with self.lock:
+                while not self.queue and not self.closed:
+                    self.ready.wait()
+                if not self.queue:
+                    return  # closed and drained
+                batch = [self.queue.popleft()
+                         for _ in range(min(len(self.queue), self.batch))]
+                dropped, self.reported = (self.dropped - self.reported,
+                                          self.dropped)
+                self.space.notify_all()
+            if dropped:
+                batch.append((time.time(), 'warn', f'[!] Log: {dropped} '
+                              f'events dropped, queue full.', None))
+            self.write(batch)
+
+    def write(self, batch: list[tuple]):
+        if self.console:
+            try:  # one write per batch: lines from threads never interleave
+                sys.stdout.write(''.join(f'{text}\n'
+                                         for _, _, text, _ in batch))
+                sys.stdout.flush()
+            except (OSError, ValueError):
+                pass  # stdout gone, the file still gets them
+        if self.file is None:
+            return
+        try:
+            self.file.write(b''.join(json.dumps(
+                {"ts": ts, "event": event, "text": text, **(fields or {})}
+            ).encode() + b'\n' for ts, event, text, fields in batch))
+            self.file.flush()
+            if self.file.tell() >= self.file_bytes:
+                self.rotate()
+        except OSError:
+            pass
+
+    def rotate(self):
+        """path -> path.1 -> ... -> path.keep_files, oldest removed."""
+        self.file.close()
+        for index in range(self.keep_files, 0, -1):
+            source = f'{self.path}.{index - 1}' if index > 1 else self.path
+            if os.path.exists(source):
+                os.replace(source, f'{self.path}.{index}')
+        if not self.keep_files:
+            os.remove(self.path)
+        self.file = open(self.path, 'ab')
+
+    def close(self):
+        """Flush what is queued, then stop the writer."""
+        with self.lock:
+            self.closed = True
+            self.ready.notify()
+            self.space.notify_all()
+        self.thread.join()
+        if self.file is not None:
+            self.file.close()
+
+
+# ────────── Files ──────────
+class FileUpload:
+    """A file arriving in chunks, appended to its .part until complete."""
+    __slots__ = ('key', 'name', 'size', 'file')
+
+    def __init__(self, key: str, name: str, size: int, file):
+        self.key = key
+        self.name = name
+        self.size = size
+        self.file = file
+
+
+class FileSend:
+    """A stored file streamed to one connection. Only one chunk is queued
+    at a time, the next goes to the back of the queue once it is sent, so
+    chat queued meanwhile is never stuck behind the whole file."""
+    __slots__ = ('file', 'key', 'offset', 'size')
+
+    def __init__(self, file, key: str, offset: int, size: int):
+        self.file = file
+        self.key = key
+        self.offset = offset
+        self.size = size
+
+    def next_chunk(self) -> Optional['FileRegion']:
+        if self.offset >= self.size:
+            self.file.close()
+            return None
+        count = min(ChoverBase.FILE_CHUNK_SIZE, self.size - self.offset)
+        header = struct.pack(
+            ChoverBase.FRAME_HEADER_FORMAT, FrameType.FILE_CHUNK,
+            ChoverBase.FILE_CHUNK_HEADER + count) + struct.pack(
+            ChoverBase.FILE_CHUNK_FORMAT, bytes.fromhex(self.key), self.offset)
+        region = FileRegion(header, self, self.offset, count)
+        self.offset += count
+        return region
+
+
+class FileRegion:
+    """Outbound queue entry: a frame header, then count bytes of a file
+    that go socket-ward through sendfile() without entering Python."""
+    __slots__ = ('header', 'transfer', 'offset', 'count')
+    USE_SENDFILE: bool = hasattr(os, 'sendfile')
+    MSG_MORE: int = getattr(socket, 'MSG_MORE', 0)
+
+    def __init__(self, header: bytes, transfer: FileSend, offset: int,
+                 count: int):
+        self.header = header
+        self.transfer = transfer
+        self.offset = offset
+        self.count = count
+
+    def __len__(self) -> int:
+        return len(self.header) + self.count
+
+    def send(self, sock: socket.socket, done: int) -> int:
+        """One send of what is left after done bytes; works on blocking
+        and non-blocking sockets alike."""
+        if done < len(self.header):
+            # MSG_MORE: the header rides in the first data segment
+            return sock.send(memoryview(self.header)[done:], self.MSG_MORE)
+        done -= len(self.header)
+        file = self.transfer.file
+        if self.USE_SENDFILE:
+            sent = os.sendfile(sock.fileno(), file.fileno(),
+                               self.offset + done, self.count - done)
+        else:
+            file.seek(self.offset + done)
+            sent = sock.send(file.read(min(self.count - done, 65536)))
+        if not sent:
+            raise OSError('file shrank while being sent')
+        return sent
+
+
 # ────────── Server ──────────
+class ClientInfo:
+    """Who is on a connection; the handshake header fills in the rest."""
+    __slots__ = ('id', 'username', 'version', 'ip', 'port', 'connected_at')
+
+    def __init__(self, conn_id: int, ip: str, port: int, username: str,
+                 version: str):
+        self.id = conn_id  # unique for the server's lifetime, never reused
+        self.username = username
+        self.version = version
+        self.ip = ip
+        self.port = port
+        self.connected_at = datetime.datetime.now()
+
+
+class ConnectionRegistry:
+    """Connections by id: O(1) add and remove, and a snapshot tuple for
+    iteration that is rebuilt only after the membership changed."""
+    __slots__ = ('_conns', '_snapshot', '_lock')
+
+    def __init__(self):
+        self._conns: dict[int, ChoverConnection] = {}
+        self._snapshot: Optional[tuple[ChoverConnection, ...]] = ()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._conns)
+
+    def __iter__(self):
+        return iter(self.snapshot())
+
+    def add(self, conn: 'ChoverConnection'):
+        with self._lock:
+            self._conns[conn.info.id] = conn
+            self._snapshot = None
+
+    def discard(self, conn: 'ChoverConnection') -> bool:
+        """Remove conn; False if it was already gone."""
+        with self._lock:
+            if self._conns.pop(conn.info.id, None) is None:
+                return False
+            self._snapshot = None
+            return True
+
+    def get(self, conn_id: int) -> Optional['ChoverConnection']:
+        return self._conns.get(conn_id)
+
+    def snapshot(self) -> tuple['ChoverConnection', ...]:
+        """Safe to iterate while others add and remove; shared until the
+        next change, so a run of broadcasts copies nothing."""
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self._lock:
+                if self._snapshot is None:
+                    self._snapshot = tuple(self._conns.values())
+                snapshot = self._snapshot
+        return snapshot
+
+    def clear(self) -> tuple['ChoverConnection', ...]:
+        """Empty the registry, returning what was in it."""
+        with self._lock:
+            conns = tuple(self._conns.values())
+            self._conns.clear()
+            self._snapshot = ()
+        return conns
+
+
+class TimerWheel:
+    """Hashed timing wheel of connection deadlines. Scheduling and
+    cancelling are O(1), and a tick only visits the one slot that is due,
+    however many thousands of deadlines are pending."""
+
+    def __init__(self, tick: float, size: int):
+        self.tick = tick
+        self.slots: list[dict[int, list]] = [{} for _ in range(size)]
+        self.cursor = 0  # slot of the last tick expired
+        self.ticked_at = time.monotonic()
+        self.lock = threading.Lock()  # reader threads under the thread engine
+
+    def schedule(self, conn: 'ChoverConnection', delay: float):
+        """(Re)arm conn's deadline delay seconds from now, rounded up to
+        a tick; longer than a turn of the wheel counts whole rounds."""
+        ticks = max(1, -int(-delay // self.tick))
+        size = len(self.slots)
+        with self.lock:
+            self._cancel(conn)
+            slot = (self.cursor + ticks) % size
+            self.slots[slot][conn.info.id] = [(ticks - 1) // size, conn]
+            conn.timer_slot = slot
+
+    def cancel(self, conn: 'ChoverConnection'):
+        with self.lock:
+            self._cancel(conn)
+
+    def _cancel(self, conn: 'ChoverConnection'):
+        if conn.timer_slot is not None:
+            self.slots[conn.timer_slot].pop(conn.info.id, None)
+            conn.timer_slot = None
+
+    def advance(self, now: float) -> list['ChoverConnection']:
+        """Turn to now, returning the connections whose deadline passed."""
+        expired = []
+        ticks = int((now - self.ticked_at) // self.tick)
+        if ticks <= 0:
+            return expired
+        with self.lock:
+            self.ticked_at += ticks * self.tick
+            for _ in range(min(ticks, len(self.slots))):
+                self.cursor = (self.cursor + 1) % len(self.slots)
+                slot = self.slots[self.cursor]
+                for conn_id, entry in tuple(slot.items()):
+                    if entry[0]:
+                        entry[0] -= 1  # due on a later turn
+                        continue
+                    del slot[conn_id]
+                    entry[1].timer_slot = None
+                    expired.append(entry[1])
+        return expired
+
+    def next_tick(self) -> float:
+        return self.ticked_at + self.tick
+
+
+class ChatRoom:
+    """A named channel: its subscribers and its own history window."""
+    __slots__ = ('name', 'members', 'history')
+
+    def __init__(self, name: str, history: ChatHistory):
+        self.name = name
+        self.members = ConnectionRegistry()
+        self.history = history
+
+
+class ChoverConnection:
+    """Per-socket server state shared by both engines (no stack of its own)."""
+    __slots__ = ('sock', 'info', 'stage', 'deadline', 'framed', 'binary',
+                 'decoder', 'room', 'accepted_at', 'udp_token', 'udp_addr',
+                 'udp_seen', 'udp_last', 'last_seen', 'pings', 'timer_slot',
+                 'uploads', 'regions', 'flush_at', 'peer', 'dial',
+                 'inbuf', 'outq', 'offset', 'queued', 'congested',
+                 'congested_at', 'dropped', 'writing', 'wakeup',
+                 'known_users')
+
+    def __init__(self, sock: socket.socket, info: ClientInfo, deadline: float,
+                 decoder: FrameDecoder):
+        self.sock = sock
+        self.info = info
+        self.stage = 'probe'  # probe -> resume|handshake -> chat -> closed
+        self.deadline = deadline    # end of the current handshake window
+        self.framed = False         # negotiated from the header version
+        self.binary = False         # framed + msgpack records
+        self.decoder = decoder      # framed S3 reassembly
+        self.room: Optional[ChatRoom] = None  # set by the handshake
+        self.accepted_at = time.perf_counter_ns()
+        self.udp_token: Optional[bytes] = None  # side channel offered
+        self.udp_addr: Optional[tuple] = None   # ...and bound by a datagram
+        self.udp_seen = 0.0                     # last datagram, monotonic
+        self.udp_last: dict[int, int] = {}      # newest seq per type
+        self.last_seen = time.monotonic()  # last bytes from the peer
+        self.pings = False          # peer sent PING: it answers ours too
+        self.timer_slot: Optional[int] = None  # in the idle TimerWheel
+        self.uploads: dict[str, FileUpload] = {}  # by key, still arriving
+        self.regions = 0            # FileRegions in outq (no sendmsg batch)
+        self.inbuf = bytearray()    # partial '!16s16s' header
+        self.outq: deque[bytes] = deque()  # frames not yet sent in full
+        self.offset = 0             # bytes of outq[0] already sent
+        self.queued = 0             # bytes in outq (+ in flight, thread)
+        self.congested = False      # over high water, not yet under low
+        self.congested_at = 0.0
+        self.dropped = 0            # frames shed while congested
+        self.writing = False        # registered for EVENT_WRITE
+        self.flush_at = 0.0         # flush window end, 0 none, -1 now
+        self.peer: Optional[str] = None  # server link: its node, '' unknown
+        self.dial: Optional[tuple] = None  # address, if we dialed the link
+        self.wakeup: Optional[threading.Condition] = None  # thread engine
+        self.known_users: set[int] = set()  # user ids told to a binary client
+
+
+class ChatWire:
+    """One chat record, serialized once per wire format for all recipients.
+
+    Recipient queues hold references to the same immutable bytes, so a
+    fan-out to N clients costs one encode and no per-client copies.
+    """
+    __slots__ = ('record', 'user_id', '_raw', '_framed', '_binary', '_user')
+
+    def __init__(self, record: dict, user_id: int):
+        self.record = record
+        self.user_id = user_id
+        self._raw: Optional[bytes] = None
+        self._framed: Optional[bytes] = None
+        self._binary: Optional[bytes] = None
+        self._user: Optional[bytes] = None
+
+    @property
+    def raw(self) -> bytes:
+        if self._raw is None:
+            record = self.record
+            self._raw = (f"{record['username']} | {record['now']} "
+                         f"❯ {record['message']}").encode()
+        return self._raw
+
+    def for_conn(self, conn: ChoverConnection) -> bytes:
+        if not conn.framed:
+            return self.raw
+        if conn.binary:
+            if self._binary is None:
+                self._binary = ChoverBase.pack_frame(
+                    FrameType.CHAT_BIN, msgpack.packb(
+                        [self.record['id'], self.record['ts'], self.user_id,
+                         self.record['message']]))
+            return self._binary
+        if self._framed is None:
+            self._framed = ChoverBase.pack_frame(
+                FrameType.CHAT, struct.pack(ChoverBase.ID_FORMAT,
+                                            self.record['id']) + self.raw)
+        return self._framed
+
+    @property
+    def user(self) -> bytes:
+        """USER frame naming the sender, for binary clients new to it."""
+        if self._user is None:
+            self._user = ChoverBase.pack_frame(
+                FrameType.USER, msgpack.packb([self.user_id,
+                                               self.record['username']]))
+        return self._user
+
+
 class ChoverServer(ChoverBase):
+    ENGINES: tuple[str, ...] = ('selector', 'thread')
+    PROBE_TIMEOUT: float = 0.25     # framed clients send their header first
+    HANDSHAKE_TIMEOUT: float = 1.0  # legacy S2 window, after the history
+    ACCEPT_BATCH: int = 64          # accepts per readiness event
+    USE_SENDMSG: bool = hasattr(socket.socket, 'sendmsg')
+    SENDMSG_BATCH: int = 64         # iovecs per vectored write (<= IOV_MAX)
+    # ────── Flushing ──────
+    TCP_NODELAY: bool = True        # no Nagle: the server decides when
+    FLUSH_WINDOW: Optional[float] = 0.002  # coalesce a burst this long,
+    #                                 0 = until the end of the loop pass,
+    #                                 None = write every frame at once
+    # ────── Backpressure (override per instance before run_over_tcp) ──────
+    SEND_HIGH_WATER: int = 256 * 1024  # queued bytes that mark a slow client
+    SEND_LOW_WATER: int = 64 * 1024    # ...until it drains back below this
+    SLOW_CONSUMER_POLICIES: tuple[str, ...] = ('drop', 'disconnect')
+    SLOW_CONSUMER_POLICY: str = 'disconnect'
+    SLOW_CONSUMER_GRACE: float = 5.0   # congested this long -> evicted
+    # ────── History ──────
+    HISTORY_LIMIT: int = 500           # records kept in memory and replayed
+    HISTORY_DIR: Optional[str] = None  # segmented log on disk, None = off
+    HISTORY_SEGMENT_BYTES: int = 4 * 1024 * 1024
+    HISTORY_KEEP_SEGMENTS: int = 0     # oldest segments pruned, 0 = keep all
+    HISTORY_FSYNC: str = 'interval'    # 'always' | 'interval' | 'never'
+    HISTORY_FSYNC_INTERVAL: float = 1.0
+    HISTORY_INDEX: bool = True         # SQLite index in HISTORY_DIR: /search
+    INDEX_FILE: str = 'chover-index.sqlite3'
+    INDEX_BATCH: int = 512             # rows per insert transaction
+    INDEX_INTERVAL: float = 0.5        # a burst gathers this long, then one
+    SEARCH_PAGE: int = 20              # hits per SEARCH_HITS frame
+    # ────── Metrics ──────
+    STATS_PORT: Optional[int] = None  # admin socket on 127.0.0.1 (+ worker)
+    METRICS_FILE: Optional[str] = None  # JSON lines, appended periodically
+    METRICS_INTERVAL: float = 10.0
+    METRICS_SAMPLE_EVERY: int = 64     # chat lines per S3->S4 timing, 0 off
+    # ────── Liveness (PING_INTERVAL / IDLE_TIMEOUT on ChoverBase) ──────
+    TIMER_TICK: float = 1.0          # idle deadline resolution
+    TIMER_SLOTS: int = 512           # one turn = TIMER_SLOTS * TIMER_TICK
+    TCP_KEEPALIVE: bool = True       # kernel probes, for clients without PING
+    # ────── Files ──────
+    FILES_DIR: Optional[str] = None  # uploads stored here, None = off
+    FILE_MAX_SIZE: int = 1 << 30
+    # ────── Federation (selector engine, one worker) ──────
+    NODE_ID: Optional[str] = None    # name on server links, None = random
+    PEERS: tuple[tuple[str, int], ...] = ()  # servers this one dials
+    PEER_SECRET: Optional[str] = None  # shared by linked servers, None = off
+    PEER_BATCH: int = 256            # lines per FEDERATE frame
+    PEER_BATCH_WINDOW: float = 0.01  # a burst gathers this long per frame
+    PEER_RETRY: float = 1.0          # first redial, doubled per failure
+    PEER_RETRY_MAX: float = 30.0
+    PEER_SEEN_LIMIT: int = 65536     # origin ids remembered for dedupe
+    # ────── Logging ──────
+    LOG_CONSOLE: bool = True        # events to stdout
+    LOG_CHAT: bool = True           # one event per chat line, off = no echo
+    LOG_FILE: Optional[str] = None  # JSON lines (worker N: name-wN.ext)
+    LOG_FILE_BYTES: int = 16 * 1024 * 1024
+    LOG_FILE_KEEP: int = 3          # rotated files kept, .1 the newest
+    LOG_QUEUE_LIMIT: int = 10000    # events waiting for the writer
+    LOG_BATCH: int = 512            # events per write
+    LOG_DROP_POLICY: str = 'drop'   # 'drop' (counted) | 'block' the caller
+    # ────── Side Channel (UDP) ──────
+    UDP_PORT: Optional[int] = None  # None = off, 0 = any (+ worker index)
+    UDP_TIMEOUT: float = 10.0       # silent this long -> stop sending to it
+    UDP_PRESENCE_LIMIT: int = 100   # members announced to a joiner
+
     def __init__(self, HOST: str, PORT: int):
         super().__init__(HOST, PORT)
-        self.history: list[dict] = []
-        self.clients: list[socket.socket] = []
+        self.rooms: dict[str, ChatRoom] = {}  # room -> members + history
+        self.rooms_lock = threading.Lock()
+        self.history_log: Optional[SegmentedLog] = None
+        self.history_index: Optional[ChatIndex] = None
+        self.index_backfill = ()  # stored records the writer inserts first
+        self.clients = ConnectionRegistry()  # every live connection
+        self.conn_ids = itertools.count(1)
+        self.user_ids: dict[str, int] = {}  # interned for binary clients
+        self.usernames: list[str] = []
+        self.intern_lock = threading.Lock()
         self.socket: socket.socket
+        self.selector: Optional[selectors.BaseSelector] = None
+        self.worker: Optional[int] = None  # index, in a worker process
+        self.metrics = ServerMetrics()
+        self.logger: Optional[ServerLog] = None  # print() until started
+        self.wheel = TimerWheel(self.TIMER_TICK, self.TIMER_SLOTS)
+        self.metrics_stop = threading.Event()
+        self.stats_socket: Optional[socket.socket] = None
+        self.udp_socket: Optional[socket.socket] = None
+        self.udp_peers: dict[bytes, ChoverConnection] = {}  # token -> conn
+        self.udp_seq = itertools.count(1)  # next() is atomic in CPython
+        self.uploading: dict[str, ChoverConnection] = {}  # key -> uploader
+        self.bus: Optional[ChoverConnection] = None  # link to the sequencer
+        self.flushing: deque[ChoverConnection] = deque()  # by flush_at
+        self.flush_now: list[ChoverConnection] = []  # control frames
+        self.flush_deadline = 0.0  # flush_at for frames queued this pass
+        self.node = ''  # NODE_ID, or a random one, set by run_over_tcp
+        self.peer_links = ConnectionRegistry()  # dialed + accepted
+        self.peer_seq = itertools.count(time.time_ns() // 1000)  # origin ids
+        self.peer_seen: OrderedDict[tuple[str, int], None] = OrderedDict()
+        self.federating: list[tuple[list, Optional[ChoverConnection]]] = []
+        self.federate_at = 0.0  # when the pending batch goes out
+        self.redials: list[tuple[float, tuple]] = []  # (when, address)
+        self.peer_delay: dict[tuple, float] = {}  # next backoff per address
 
     def establish_tcp_server(self):
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
@@ -74,15 +1218,120 @@ class ChoverServer(ChoverBase):
             s.bind((self.HOST, self.PORT))
             s.listen()  # use system backlog size probably 128, alt 1
             hostname = self.get_local_ip()
-            print(f"[*] Server <{hostname}>: "
-                  f"listening on {self.HOST}:{self.PORT}...")
+            self.log('info', f"[*] Server <{hostname}>: "
+                             f"listening on {self.HOST}:{self.PORT}...")
+            if self.udp_socket is not None:
+                threading.Thread(target=self._udp_thread, daemon=True).start()
+            threading.Thread(target=self._timer_thread, daemon=True).start()
             while True:
                 sock, addr = s.accept()
-                self.clients.append(sock)
+                self.set_nodelay(sock)
+                self.set_keepalive(sock)
+                conn = ChoverConnection(sock, self.new_client_info(addr),
+                                        0.0, self.new_decoder())
+                conn.wakeup = threading.Condition()
+                self.clients.add(conn)
+                self.metrics.connections += 1
                 thread = threading.Thread(
-                    target=self.handle_client, args=(sock, addr)
+                    target=self.handle_client, args=(conn,)
                 )
                 thread.start()
+                threading.Thread(target=self._drain_thread, args=(conn,),
+                                 daemon=True).start()
+
+    def establish_selector_server(self):
+        """Single-threaded engine: every socket multiplexed on one selector."""
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s, \
+                selectors.DefaultSelector() as sel:
+            self.socket = s
+            self.selector = sel
+            s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if self.worker is not None:
+                # every worker listens on the port, the kernel spreads accepts
+                s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+                sel.register(self.bus.sock, selectors.EVENT_READ, self.bus)
+            s.bind((self.HOST, self.PORT))
+            s.listen(socket.SOMAXCONN)
+            s.setblocking(False)
+            sel.register(s, selectors.EVENT_READ, None)
+            if self.udp_socket is not None:
+                sel.register(self.udp_socket, selectors.EVENT_READ, None)
+            for address in self.PEERS:
+                self.dial(tuple(address))
+            hostname = self.get_local_ip()
+            mode = ('event loop' if self.worker is None
+                    else f'event loop, worker {self.worker}')
+            self.log('info', f"[*] Server <{hostname}>: "
+                             f"listening on {self.HOST}:{self.PORT} "
+                             f"({mode})...")
+            # constant timeouts -> FIFO order is deadline order
+            probing: deque[ChoverConnection] = deque()
+            pending: deque[ChoverConnection] = deque()
+            while True:
+                timeout = None
+                heads = [q[0].deadline for q in (probing, pending) if q]
+                heads.append(self.wheel.next_tick())
+                if self.flushing:
+                    heads.append(self.flushing[0].flush_at)
+                if self.federating:
+                    heads.append(self.federate_at)
+                if self.redials:
+                    heads.append(min(when for when, _ in self.redials))
+                if heads:
+                    timeout = max(0.0, min(heads) - time.monotonic())
+                events = sel.select(timeout)
+                self.flush_deadline = time.monotonic() + (self.FLUSH_WINDOW
+                                                          or 0.0)
+                for key, mask in events:
+                    if key.fileobj is self.udp_socket:
+                        self._datagrams_ready()
+                        continue
+                    if key.data is None:
+                        self._accept_ready(s, probing)
+                        continue
+                    conn: ChoverConnection = key.data
+                    try:
+                        if conn.stage == 'connecting':
+                            self._peer_connected(conn)
+                            continue
+                        if mask & selectors.EVENT_READ:
+                            self._read_ready(conn)
+                        if (mask & selectors.EVENT_WRITE
+                                and conn.stage != 'closed'):
+                            self._write_ready(conn)
+                    except Exception as e:
+                        if conn is self.bus:
+                            raise
+                        # one bad connection must not take the loop down
+                        self.log('warn', f"[!] Dropping "
+                                         f"{conn.info.ip}:{conn.info.port}"
+                                         f" username: {conn.info.username}"
+                                         f" after an error: {e!r}")
+                        self._drop_client(conn)
+                now = time.monotonic()
+                while probing and (probing[0].stage != 'probe'
+                                   or probing[0].deadline <= now):
+                    conn = probing.popleft()
+                    if conn.stage == 'probe':
+                        self._end_probe(conn, now)
+                        pending.append(conn)
+                    elif conn.stage == 'resume':
+                        conn.deadline = now + self.HANDSHAKE_TIMEOUT
+                        pending.append(conn)
+                while pending and (
+                        pending[0].stage not in ('handshake', 'resume')
+                        or pending[0].deadline <= now):
+                    conn = pending.popleft()
+                    if conn.stage == 'handshake':
+                        self._finish_handshake(conn)
+                    elif conn.stage == 'resume':
+                        # no RESUME frame: full replay of the lobby
+                        self._resume(conn, 0, self.default_room)
+                for conn in self.wheel.advance(now):
+                    self.check_idle(conn, now)
+                self._federate_due(now)
+                self._redial_due(now)
+                self._flush_due(now)
     # def establish_udp_server(self):
     #   print('Broadcasting connection...')
     #   with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
@@ -95,180 +1344,2183 @@ class ChoverServer(ChoverBase):
     #           s.sendto(data, addr)
 
     # ────────── Server > Client Handling Logic ──────────
-    def handle_client(self, sock: socket.socket, addr: tuple[str, int]):
-        class ClientInfo(TypedDict, total=False):
-            username: str
-            version: str
-            ip: str
-            port: int
-            connected_at: datetime.datetime
-        client_info: ClientInfo = {
-            "username": self.default_username,
-            "version": self.unknown_version,
-            "ip": addr[0],
-            "port": addr[1],
-            "connected_at": datetime.datetime.now(),
-        }
-        # ────── S1 Send (Conditional) ──────
-        if self.history:
-            history_json = json.dumps(self.history)
-            sock.sendall(history_json.encode())
-        # ────── S2 Receive (Optional) ──────
-        readable, _, _ = select.select([sock], [], [], 1.0)
-        if readable:
-            client_data = sock.recv(self.HEADER_SIZE)
-            if client_data:
-                unpacked_data = struct.unpack('!16s16s', client_data)
-                username_bytes, version_bytes = unpacked_data
-                client_info['username'] = username_bytes.rstrip(b'\x00').decode()
-                client_info['version'] = version_bytes.rstrip(b'\x00').decode()
-        print(f"[+] Connected: {client_info['ip']}:{client_info['port']}"
-              f" username: {client_info['username']}"
-              f" (ver. {client_info['version']}).")
+    def handle_client(self, conn: ChoverConnection):
+        sock = conn.sock
+        client_info = conn.info
+        try:
+            # ────── S0 Probe (framed clients speak first) ──────
+            readable, _, _ = select.select([sock], [], [], self.PROBE_TIMEOUT)
+            if readable:
+                client_data = self.recv_exact(sock, self.HEADER_SIZE)
+                if len(client_data) < self.HEADER_SIZE:
+                    return
+                self.apply_client_header(client_info, client_data)
+                conn.framed = self.speaks_frames(client_info.version)
+                conn.binary = self.wants_binary(client_info.version)
+            last_id, room = 0, self.default_room
+            frames: list[tuple[int, bytes]] = []
+            if conn.framed:
+                # ────── S0 Resume (last-seen id, framed only) ──────
+                while not frames and select.select(
+                        [sock], [], [], self.HANDSHAKE_TIMEOUT)[0]:
+                    frames = self.recv_frames(sock, conn.decoder)
+                    if frames is None:
+                        return
+                if frames and frames[0][0] == FrameType.RESUME:
+                    last_id, room = self.parse_room(frames.pop(0)[1])
+            # ────── S1 Send (Conditional) ──────
+            self.join_room(conn, room, last_id)
+            conn.stage = 'handshake'  # replayed: broadcasts reach it from here
+            # ────── S2 Receive (Optional) ──────
+            if not readable:
+                readable, _, _ = select.select([sock], [], [],
+                                               self.HANDSHAKE_TIMEOUT)
+                if readable:
+                    client_data = sock.recv(self.HEADER_SIZE)
+                    if client_data:
+                        self.apply_client_header(client_info, client_data)
+            conn.stage = 'chat'
+            self.metrics.handshake_us.observe(
+                (time.perf_counter_ns() - conn.accepted_at) // 1000)
+            self.print_connected(client_info)
+            for frame_type, payload in frames:  # sent right behind RESUME
+                self.handle_frame(conn, frame_type, payload)
+            while True:
+                # ────── S3... Receive ──────
+                if conn.framed:
+                    frames = self.recv_frames(sock, conn.decoder)
+                    if frames is None:
+                        break
+                    conn.last_seen = time.monotonic()
+                    for frame_type, payload in frames:
+                        self.handle_frame(conn, frame_type, payload)
+                else:
+                    message_data = sock.recv(self.BUFFER_SIZE)
+                    if not message_data:
+                        break
+                    self.metrics.bytes_in += len(message_data)
+                    self.handle_chat(conn, message_data)
+        except (OSError, ProtocolError):
+            pass  # peer reset / garbage, same outcome as a clean close
+        finally:
+            self._drop_client(conn)
+
+    def handle_frame(self, conn: ChoverConnection, frame_type: int,
+                     payload: bytes):
+        self.metrics.bytes_in += self.FRAME_HEADER_SIZE + len(payload)
+        if conn.peer is not None and frame_type not in (FrameType.PING,
+                                                        FrameType.PONG):
+            self.handle_link_frame(conn, frame_type, payload)
+        elif frame_type == FrameType.CHAT:
+            self.handle_chat(conn, payload)
+        elif frame_type == FrameType.RELAY and conn is self.bus:
+            self.relay_in(json.loads(payload.decode()))
+        elif frame_type == FrameType.JOIN:
+            last_id, room = self.parse_room(payload)
+            if room != conn.room.name:
+                self.log('join', f"[i] {conn.info.username} joined "
+                                 f"#{room}.",
+                         {"username": conn.info.username, "room": room})
+            self.join_room(conn, room, last_id)
+        elif frame_type == FrameType.UDP:
+            self.offer_udp(conn)
+        elif frame_type == FrameType.FILE_CHUNK:
+            self.file_chunk(conn, payload)
+        elif frame_type == FrameType.FILE_OFFER:
+            self.file_offer(conn, payload)
+        elif frame_type == FrameType.FILE_GET:
+            self.file_get(conn, payload)
+        elif frame_type == FrameType.SEARCH:
+            self.search(conn, payload)
+        elif frame_type == FrameType.PING and conn is not self.bus:
+            if not conn.pings:  # it answers PINGs: hold it to IDLE_TIMEOUT
+                conn.pings = True
+                self.wheel.schedule(conn, self.PING_INTERVAL)
+            self.send_to(conn, self.pack_frame(FrameType.PONG, payload),
+                         droppable=False)
+
+    def handle_chat(self, conn: ChoverConnection, message_data: bytes):
+        metrics = self.metrics
+        metrics.messages_in += 1
+        # one clock read pair per SAMPLE_EVERY lines, not per line
+        sampled = (self.METRICS_SAMPLE_EVERY
+                   and not metrics.messages_in % self.METRICS_SAMPLE_EVERY)
+        if sampled:
+            start = time.perf_counter_ns()
+        if self.bus is not None:
+            # ────── S4... Send Update (after the bus sequences it) ──────
+            self.publish(conn, message_data.decode(errors='replace'))
+        else:
+            record = self.record_chat(
+                conn.info.username, message_data.decode(errors='replace'),
+                conn.room.name)
+            # ────── S4... Send Update ──────
+            self.broadcast(conn, record)
+            if self.peer_links:
+                self.federate([next(self.peer_seq), record['room'],
+                               record['username'], record['message'],
+                               [self.node]])
+        if sampled:
+            metrics.chat_path_us.observe(
+                (time.perf_counter_ns() - start) // 1000)
+
+    def broadcast(self, sender: Optional[ChoverConnection], record: dict):
+        """Fan record out to its room only: cost follows the audience."""
+        start = time.perf_counter_ns()
+        wire = ChatWire(record, self.intern_username(record['username']))
+        recipients = 0
+        for client in self.get_room(record['room']).members.snapshot():
+            # probe/resume: not yet replayed, their history will include it
+            if client is sender or client.stage in ('probe', 'resume',
+                                                    'closed'):
+                continue
+            if client.binary and wire.user_id not in client.known_users:
+                self.tell_users(client, wire.user, (wire.user_id,))
+            self.send_to(client, wire.for_conn(client))
+            recipients += 1
+        self.metrics.messages_out += recipients
+        self.metrics.broadcast_us.observe(
+            (time.perf_counter_ns() - start) // 1000)
+
+    def intern_username(self, username: str) -> int:
+        """Id for username. A binary client is told an id with the history
+        that uses it, or just before the first line that does."""
+        user_id = self.user_ids.get(username)
+        if user_id is not None:
+            return user_id
+        with self.intern_lock:
+            user_id = self.user_ids.get(username)
+            if user_id is not None:
+                return user_id
+            user_id = len(self.usernames)
+            self.usernames.append(username)
+            self.user_ids[username] = user_id
+        return user_id
+
+    def tell_users(self, conn: ChoverConnection, frame: bytes,
+                   user_ids: Iterable[int]):
+        """Queue frame, which names user_ids, for a binary client. Under
+        the thread engine's lock, so no line using one of them is queued
+        ahead of it by another reader."""
+        if conn.wakeup is not None:
+            with conn.wakeup:
+                conn.known_users.update(user_ids)
+                self.send_to(conn, frame, droppable=False)
+        else:
+            conn.known_users.update(user_ids)
+            self.send_to(conn, frame, droppable=False)
+
+    def send_history(self, conn: ChoverConnection, last_id: int = 0):
+        history = conn.room.history
+        # snapshots are cached, a burst of joins encodes history once
+        if conn.binary:
+            self.tell_users(conn, *history.snapshot_binary_frame(
+                self.usernames, last_id))
+        elif conn.framed:
+            # always sent: an empty list still ends the framed handshake
+            self.send_to(conn, history.snapshot_frame(last_id),
+                         droppable=False)
+        elif history:
+            self.send_to(conn, history.snapshot_legacy(),
+                         droppable=False)
+
+    def get_room(self, name: str, first_id: Optional[int] = None) -> ChatRoom:
+        room = self.rooms.get(name)
+        if room is not None:
+            return room
+        with self.rooms_lock:
+            room = self.rooms.get(name)
+            if room is None:
+                if first_id is None:
+                    # ids seeded from the clock: a restarted server never
+                    # reuses an id a client has already seen
+                    first_id = time.time_ns() // 1000
+                room = ChatRoom(name,
+                                ChatHistory(self.HISTORY_LIMIT, first_id))
+                self.rooms[name] = room
+        return room
+
+    def join_room(self, conn: ChoverConnection, name: str, last_id: int = 0):
+        """Move conn into room name, replaying what it hasn't seen there."""
+        if conn.room is not None:
+            conn.room.members.discard(conn)
+            self.announce_presence(conn, False)
+        conn.room = self.get_room(name)
+        # member first: a message racing the join is in the history and
+        # its CHAT frame follows it, clients skip ids they already have
+        conn.room.members.add(conn)
+        self.send_history(conn, last_id)
+        if conn.udp_addr is not None:
+            self.announce_presence(conn, True)
+
+    def open_history(self):
+        """With HISTORY_DIR set, reload the log's tail into the rooms."""
+        self.rooms = {}
+        if self.HISTORY_DIR is None:
+            self.get_room(self.default_room)
+            return
+        self.history_log = SegmentedLog(
+            self.HISTORY_DIR, self.HISTORY_SEGMENT_BYTES, self.HISTORY_FSYNC,
+            self.HISTORY_FSYNC_INTERVAL, self.HISTORY_KEEP_SEGMENTS)
+        reloaded = []
+        # reader threads may log slightly out of id order
+        for stored in sorted(self.history_log.tail(self.HISTORY_LIMIT),
+                             key=lambda stored: stored.get('id', 0)):
+            record = {
+                "username": stored['username'],
+                "now": self.format_time(stored['ts']),
+                "message": stored['message'],
+                "ts": stored['ts'],
+                "room": stored.get('room', self.default_room),
+                "id": stored.get('id'),  # None: logged before ids, renumber
+            }
+            # logged rooms continue their own id sequence
+            reloaded.append(self.get_room(record['room'], 1).history.append(
+                record, self.intern_username(record['username'])))
+        self.get_room(self.default_room)
+        self.log('info', f"[i] History: {len(reloaded)} messages in "
+                         f"{len(self.rooms)} rooms reloaded from "
+                         f"{self.HISTORY_DIR}.")
+        if self.HISTORY_INDEX and sqlite3 is not None:
+            self.history_index = ChatIndex(
+                os.path.join(self.HISTORY_DIR, self.INDEX_FILE),
+                self.INDEX_BATCH, self.INDEX_INTERVAL)
+            # new index: the whole log, else the tail a crash may have lost
+            self.index_backfill = (self.history_log.records()
+                                   if self.history_index.fresh
+                                   else reloaded)
+
+    def start_index(self):
+        """Start the index writer; after any fork, a child must never
+        inherit its sqlite locks mid-transaction."""
+        if self.history_index is not None:
+            self.history_index.start(self.index_backfill)
+            self.index_backfill = ()
+
+    def send_to(self, conn: ChoverConnection, payload: bytes,
+                droppable: bool = True):
+        """Queue payload for conn; never blocks on the recipient."""
+        if conn.stage == 'closed':
+            return
+        if conn.wakeup is not None:
+            with conn.wakeup:
+                queued = self._admit(conn, payload, droppable)
+                if queued:
+                    if not droppable:
+                        conn.flush_at = -1.0  # no flush window for control
+                    conn.wakeup.notify()
+        else:
+            queued = self._admit(conn, payload, droppable)
+            if not queued or conn.writing:
+                pass  # the selector drains it
+            elif self.FLUSH_WINDOW is None:
+                if len(conn.outq) == 1:
+                    self._write_ready(conn)  # the kernel before the selector
+            elif not droppable:
+                self.flush_now.append(conn)  # handshake, PONG...: this pass
+            elif not conn.flush_at:
+                # chat: the rest of the burst joins it in one sendmsg()
+                conn.flush_at = self.flush_deadline
+                self.flushing.append(conn)
+        if (not queued and self.SLOW_CONSUMER_POLICY == 'disconnect'
+                and time.monotonic() - conn.congested_at
+                > self.SLOW_CONSUMER_GRACE):
+            self._evict(conn)
+
+    def _admit(self, conn: ChoverConnection, payload: bytes,
+               droppable: bool) -> bool:
+        if conn.congested and droppable:
+            conn.dropped += 1
+            self.metrics.dropped += 1
+            return False
+        conn.outq.append(payload)
+        conn.queued += len(payload)
+        if type(payload) is FileRegion:
+            conn.regions += 1
+        if not conn.congested and conn.queued >= self.SEND_HIGH_WATER:
+            if not conn.congested_at:  # first time only, floods flap
+                self.log('warn', f"[!] Slow consumer: "
+                                 f"{conn.info.ip}:{conn.info.port}"
+                                 f" username: {conn.info.username}"
+                                 f" ({conn.queued} bytes queued).")
+            conn.congested = True
+            conn.congested_at = time.monotonic()
+        return True
+
+    def _sent(self, conn: ChoverConnection, size: int):
+        conn.queued -= size
+        self.metrics.bytes_out += size
+        if conn.congested and conn.queued <= self.SEND_LOW_WATER:
+            conn.congested = False
+
+    def _evict(self, conn: ChoverConnection):
+        self.metrics.evictions += 1
+        self.log('warn', f"[!] Evicting slow consumer: "
+                         f"{conn.info.ip}:{conn.info.port}"
+                         f" username: {conn.info.username}"
+                         f" ({conn.dropped} messages dropped).")
+        try:
+            conn.sock.shutdown(socket.SHUT_RDWR)  # wakes thread engine I/O
+        except OSError:
+            pass
+        self._drop_client(conn)
+
+    # ────────── Server > Files ──────────
+    def file_offer(self, conn: ChoverConnection, payload: bytes):
+        """Start or resume an upload: the reply says how much we have."""
+        offer = self.parse_file_request(payload)
+        if offer is None:
+            return
+        key = offer['key']
+        name = os.path.basename(str(offer.get('name', '')))[:255] or key
+        size = offer.get('size')
+        if self.FILES_DIR is None:
+            return self.file_reply(conn, FrameType.FILE_ACCEPT, key,
+                                   error='file transfer is off')
+        if not isinstance(size, int) or not 0 <= size <= self.FILE_MAX_SIZE:
+            return self.file_reply(conn, FrameType.FILE_ACCEPT, key,
+                                   error=f'files are limited to '
+                                   f'{self.format_size(self.FILE_MAX_SIZE)}')
+        path = self.file_path(key)
+        if os.path.exists(path):  # sent before: announce it again
+            self.file_reply(conn, FrameType.FILE_ACCEPT, key, offset=size)
+            self.announce_file(conn, key, name, size)
+            return
+        if self.uploading.setdefault(key, conn) is not conn:
+            return self.file_reply(conn, FrameType.FILE_ACCEPT, key,
+                                   error='already being uploaded')
+        if key in conn.uploads:
+            conn.uploads.pop(key).file.close()
+        try:
+            file = open(path + '.part', 'ab')
+        except OSError as e:
+            return self.upload_failed(conn, key, 'could not store the file',
+                                      e)
+        conn.uploads[key] = FileUpload(key, name, size, file)
+        try:
+            if file.tell() > size:
+                file.truncate(0)  # a different file under the same key
+                file.seek(0)  # truncate() leaves the position at the old end
+        except OSError as e:
+            return self.upload_failed(conn, key, 'could not store the file',
+                                      e)
+        self.file_reply(conn, FrameType.FILE_ACCEPT, key, offset=file.tell())
+        if file.tell() == size:
+            self.finish_upload(conn, conn.uploads[key])
+
+    def file_chunk(self, conn: ChoverConnection, payload: bytes):
+        if len(payload) < self.FILE_CHUNK_HEADER:
+            return
+        key, offset = struct.unpack_from(self.FILE_CHUNK_FORMAT, payload)
+        upload = conn.uploads.get(key.hex())
+        # chunks are in order; one from before a resume is already written
+        if upload is None or offset != upload.file.tell():
+            return
+        data = memoryview(payload)[self.FILE_CHUNK_HEADER:]
+        if offset + len(data) > upload.size:
+            return self.upload_failed(conn, upload.key,
+                                      'more data than offered')
+        try:
+            upload.file.write(data)
+        except OSError as e:  # disk full, the directory gone...
+            return self.upload_failed(conn, upload.key,
+                                      'could not store the file', e)
+        if upload.file.tell() == upload.size:
+            self.finish_upload(conn, upload)
+
+    def finish_upload(self, conn: ChoverConnection, upload: FileUpload):
+        path = self.file_path(upload.key)
+        try:
+            upload.file.close()  # the last flush: a full disk shows here too
+            with open(path + '.json', 'w') as f:
+                json.dump({"name": upload.name, "size": upload.size,
+                           "username": conn.info.username,
+                           "ts": int(time.time())}, f)
+            os.replace(path + '.part', path)  # last: stored means it has meta
+        except OSError as e:
+            return self.upload_failed(conn, upload.key,
+                                      'could not store the file', e)
+        del conn.uploads[upload.key]
+        self.uploading.pop(upload.key, None)
+        self.file_reply(conn, FrameType.FILE_ACCEPT, upload.key,
+                        offset=upload.size)
+        self.log('file', f"[i] {conn.info.username} uploaded {upload.name} "
+                         f"({self.format_size(upload.size)}).",
+                 {"username": conn.info.username, "key": upload.key,
+                  "name": upload.name, "size": upload.size})
+        self.announce_file(conn, upload.key, upload.name, upload.size)
+
+    def upload_failed(self, conn: ChoverConnection, key: str, error: str,
+                      cause: Optional[OSError] = None):
+        """Drop this one transfer, not the connection; the .part stays,
+        so the client can resume it once the server can write again."""
+        upload = conn.uploads.pop(key, None)
+        self.uploading.pop(key, None)
+        if upload is not None:
+            try:
+                upload.file.close()
+            except OSError:
+                pass  # what's unflushed is lost; the resume offset says so
+        if cause is not None:
+            self.log('warn', f"[!] Upload {key} from "
+                             f"{conn.info.username} failed: {cause}")
+        self.file_reply(conn, FrameType.FILE_ACCEPT, key, error=error)
+
+    def announce_file(self, conn: ChoverConnection, key: str, name: str,
+                      size: int):
+        """A chat line in the uploader's room, so it lands in history."""
+        self.handle_chat(conn, f"[file] {name} ({self.format_size(size)}) "
+                               f"/get {key}".encode())
+
+    def file_get(self, conn: ChoverConnection, payload: bytes):
+        """Stream a stored file from the offset the client already has."""
+        request = self.parse_file_request(payload)
+        if request is None:
+            return
+        key = request['key']
+        path = self.file_path(key) if self.FILES_DIR is not None else None
+        try:
+            with open(path + '.json') as f:
+                meta = json.load(f)
+            file = open(path, 'rb')
+        except (TypeError, OSError, ValueError):
+            return self.file_reply(conn, FrameType.FILE_META, key,
+                                   error='no such file')
+        offset = request.get('offset', 0)
+        if not isinstance(offset, int) or not 0 <= offset <= meta['size']:
+            offset = 0
+        self.file_reply(conn, FrameType.FILE_META, key, name=meta['name'],
+                        size=meta['size'], offset=offset)
+        region = FileSend(file, key, offset, meta['size']).next_chunk()
+        if region is not None:
+            self.send_to(conn, region, droppable=False)
+
+    def _region_sent(self, conn: ChoverConnection, region: FileRegion):
+        """Queue the next chunk behind whatever arrived meanwhile. Only
+        called by the writer, which goes on draining, so no send_to():
+        its eager write would re-enter _write_ready mid-pop."""
+        region = region.transfer.next_chunk()
+        if conn.wakeup is not None:
+            with conn.wakeup:
+                conn.regions -= 1
+                if region is not None:
+                    self._admit(conn, region, droppable=False)
+        else:
+            conn.regions -= 1
+            if region is not None:
+                self._admit(conn, region, droppable=False)
+
+    def parse_file_request(self, payload: bytes) -> Optional[dict]:
+        try:
+            request = json.loads(payload.decode())
+            bytes.fromhex(request['key'])
+        except (ValueError, KeyError, TypeError):
+            return None
+        if len(request['key']) != 32:
+            return None
+        request['key'] = request['key'].lower()
+        return request
+
+    def file_path(self, key: str) -> str:
+        return os.path.join(self.FILES_DIR, key)
+
+    def file_reply(self, conn: ChoverConnection, frame_type: int, key: str,
+                   **fields):
+        self.send_to(conn, self.pack_frame(frame_type, json.dumps(
+            {"key": key, **fields}).encode()), droppable=False)
+
+    # ────────── Server > Search ──────────
+    def search(self, conn: ChoverConnection, payload: bytes):
+        """One page of the history index, newest first."""
+        try:
+            query = json.loads(payload.decode())
+            words = [str(word) for word in query.get('words', [])][:16]
+            user, room = query.get('user'), query.get('room')
+            bounds = [query.get(field)
+                      for field in ('after', 'before', 'cursor')]
+        except (ValueError, AttributeError, TypeError):
+            return
+        if (not all(value is None or isinstance(value, str)
+                    for value in (user, room))
+                or not all(value is None or (isinstance(value, int)
+                                             and 0 <= value < 1 << 63)
+                           for value in bounds)):  # SQLite INTEGER range
+            return self.search_reply(conn, error='bad search')
+        if self.history_index is None:
+            return self.search_reply(conn, error='search is off')
+        try:
+            hits, cursor = self.history_index.search(
+                words, user, room, *bounds, limit=self.SEARCH_PAGE)
+        except (sqlite3.Error, OverflowError) as e:
+            self.log('warn', f'[!] Search failed: {e}')
+            return self.search_reply(conn, error='search failed')
+        self.search_reply(conn, hits=hits, next=cursor)
+
+    def search_reply(self, conn: ChoverConnection, **fields):
+        self.send_to(conn, self.pack_frame(FrameType.SEARCH_HITS, json.dumps(
+            fields).encode()), droppable=False)
+
+    # ────────── Server > Liveness ──────────
+    def set_nodelay(self, sock: socket.socket):
+        """Frames leave when the flush scheduler says, not when Nagle
+        has seen an ACK."""
+        if self.TCP_NODELAY:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def set_keepalive(self, sock: socket.socket):
+        """Kernel probes after IDLE_TIMEOUT: catches half-open sockets of
+        legacy clients, which can't answer a PING."""
+        if not self.TCP_KEEPALIVE:
+            return
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        if hasattr(socket, 'TCP_KEEPIDLE'):  # Linux, recent BSD/macOS
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE,
+                            int(self.IDLE_TIMEOUT))
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL,
+                            int(self.PING_INTERVAL))
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 3)
+
+    def check_idle(self, conn: ChoverConnection, now: float):
+        """A deadline fired: PING a quiet peer, reap a silent one, or just
+        re-arm. Reads only stamp last_seen, they never touch the wheel."""
+        if conn.stage == 'closed':
+            return
+        idle = now - conn.last_seen
+        if idle >= self.IDLE_TIMEOUT:
+            self._reap(conn, idle)
+        elif idle >= self.PING_INTERVAL:
+            self.send_to(conn, self.pack_ping(), droppable=False)
+            self.wheel.schedule(conn, min(self.PING_INTERVAL,
+                                          self.IDLE_TIMEOUT - idle))
+        else:
+            self.wheel.schedule(conn, self.PING_INTERVAL - idle)
+
+    def _timer_thread(self):
+        """Thread engine: turns the wheel once a tick."""
         while True:
-            # ────── S3... Receive ──────
-            message_data = sock.recv(self.BUFFER_SIZE)
-            if not message_data:
-                print(f"[-] Disconnected: "
-                      f"{client_info['ip']}:{client_info['port']} "
-                      f"username: {client_info['username']} "
-                      f"(ver. {client_info['version']}).")
+            time.sleep(self.TIMER_TICK)
+            now = time.monotonic()
+            for conn in self.wheel.advance(now):
+                self.check_idle(conn, now)
+
+    def _reap(self, conn: ChoverConnection, idle: float):
+        self.metrics.reaped += 1
+        self.log('warn', f"[!] Reaping silent connection: "
+                         f"{conn.info.ip}:{conn.info.port}"
+                         f" username: {conn.info.username}"
+                         f" ({idle:.0f}s without a word).")
+        try:
+            conn.sock.shutdown(socket.SHUT_RDWR)  # wakes thread engine I/O
+        except OSError:
+            pass
+        self._drop_client(conn)
+
+    def queue_stats(self) -> list[dict]:
+        """Outbound queue depth of every connection, for inspection."""
+        return [{
+            "id": conn.info.id,
+            "username": conn.info.username,
+            "addr": f"{conn.info.ip}:{conn.info.port}",
+            "room": conn.room.name if conn.room is not None else None,
+            "frames": len(conn.outq),
+            "bytes": conn.queued,
+            "dropped": conn.dropped,
+            "congested": conn.congested,
+        } for conn in self.clients.snapshot()]
+
+    def _drain_thread(self, conn: ChoverConnection):
+        """Thread engine writer: only this thread blocks on a slow peer."""
+        try:
+            while True:
+                with conn.wakeup:
+                    if not conn.outq and self.FLUSH_WINDOW:
+                        while not conn.outq and conn.stage != 'closed':
+                            conn.wakeup.wait()
+                        # the first chat frame of a burst waits for the rest
+                        if not conn.flush_at:
+                            conn.flush_at = (time.monotonic()
+                                             + self.FLUSH_WINDOW)
+                        while (conn.flush_at > 0 and conn.stage != 'closed'
+                               and len(conn.outq) < self.SENDMSG_BATCH
+                               and conn.queued < self.SEND_LOW_WATER):
+                            left = conn.flush_at - time.monotonic()
+                            if left <= 0:
+                                break
+                            conn.wakeup.wait(left)
+                    while not conn.outq and conn.stage != 'closed':
+                        conn.wakeup.wait()
+                    if conn.stage == 'closed':
+                        return
+                    batch = [conn.outq.popleft() for _ in range(
+                        min(len(conn.outq), self.SENDMSG_BATCH))]
+                    conn.flush_at = 0.0
+                if conn.regions:
+                    self._send_regions(conn, batch)
+                else:
+                    self._send_all(conn.sock, batch)
+                with conn.wakeup:
+                    self._sent(conn, sum(map(len, batch)))
+        except OSError:
+            pass  # the reader thread sees the dead socket and drops it
+
+    # ────────── Server > Event Loop Handling Logic ──────────
+    def _accept_ready(self, s: socket.socket,
+                      probing: deque[ChoverConnection]):
+        for _ in range(self.ACCEPT_BATCH):
+            try:
+                sock, addr = s.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            sock.setblocking(False)
+            self.set_nodelay(sock)
+            self.set_keepalive(sock)
+            conn = ChoverConnection(
+                sock, self.new_client_info(addr),
+                time.monotonic() + self.PROBE_TIMEOUT, self.new_decoder())
+            self.clients.add(conn)
+            self.metrics.connections += 1
+            self.selector.register(sock, selectors.EVENT_READ, conn)
+            probing.append(conn)
+
+    def _read_ready(self, conn: ChoverConnection):
+        if conn.stage in ('probe', 'handshake'):
+            want = self.HEADER_SIZE - len(conn.inbuf)
+        elif conn.framed:
+            want = self.RECV_SIZE
+        else:
+            want = self.BUFFER_SIZE
+        try:
+            data = conn.sock.recv(want)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b''
+        if not data:
+            if conn.stage in ('probe', 'handshake'):
+                self._finish_handshake(conn)
+            self._drop_client(conn)
+            return
+        conn.last_seen = time.monotonic()
+        if conn.stage in ('probe', 'handshake'):
+            # ────── S0 Probe / S2 Receive (Optional) ──────
+            conn.inbuf += data
+            if len(conn.inbuf) < self.HEADER_SIZE:
+                return
+            self.apply_client_header(conn.info, bytes(conn.inbuf))
+            if conn.stage == 'probe':
+                conn.framed = self.speaks_frames(conn.info.version)
+                conn.binary = self.wants_binary(conn.info.version)
+                if conn.framed:
+                    # ────── S0 Resume (last-seen id, framed only) ──────
+                    conn.stage = 'resume'  # the loop moves it to pending
+                    conn.inbuf = bytearray()
+                    return
+                # ────── S1 Send (Conditional) ──────
+                self.join_room(conn, self.default_room)
+            self._finish_handshake(conn)
+            return
+        # ────── S3... Receive ──────
+        if not conn.framed:
+            self.metrics.bytes_in += len(data)
+            self.handle_chat(conn, data)
+            return
+        try:
+            frames = conn.decoder.feed(data)
+        except ProtocolError:
+            self._drop_client(conn)
+            return
+        if conn.stage == 'resume' and frames:
+            if frames[0][0] == FrameType.PEER:
+                # another server linking up, not a client
+                if not self.link_accepted(conn, frames.pop(0)[1]):
+                    return
+            else:
+                last_id, room = 0, self.default_room
+                if frames[0][0] == FrameType.RESUME:
+                    last_id, room = self.parse_room(frames.pop(0)[1])
+                self._resume(conn, last_id, room)
+        for frame_type, payload in frames:
+            self.handle_frame(conn, frame_type, payload)
+
+    def _write_ready(self, conn: ChoverConnection):
+        """Drain conn.outq until empty or the kernel buffer is full."""
+        outq = conn.outq
+        while outq:
+            self.metrics.send_calls += 1
+            try:
+                if type(outq[0]) is FileRegion:
+                    sent = outq[0].send(conn.sock, conn.offset)
+                elif self.USE_SENDMSG and len(outq) > 1:
+                    # one syscall for every pending frame, no join copy
+                    tail = itertools.islice(outq, 1, self.SENDMSG_BATCH)
+                    if conn.regions:
+                        tail = itertools.takewhile(
+                            lambda payload: type(payload) is not FileRegion,
+                            tail)
+                    sent = conn.sock.sendmsg(
+                        [memoryview(outq[0])[conn.offset:], *tail])
+                else:
+                    sent = conn.sock.send(memoryview(outq[0])[conn.offset:])
+            except (BlockingIOError, InterruptedError):
                 break
-            today = datetime.datetime.now().strftime('%b %d [%I:%M %p]')
-            chat_log = (f"{client_info['username']} | {today} "
-                        f"❯ {message_data.decode()}")
-            print(chat_log)
-            self.enqueue_chat_log(client_info['username'], today,
-                                  message_data.decode())
-            # ────── S4... Send Update ──────
-            for client in self.clients:
-                if client != sock:
-                    client.sendall(chat_log.encode())
+            except OSError:
+                self._drop_client(conn)
+                return
+            self._sent(conn, sent)
+            sent += conn.offset
+            while outq and sent >= len(outq[0]):
+                payload = outq.popleft()
+                sent -= len(payload)
+                if type(payload) is FileRegion:
+                    self._region_sent(conn, payload)  # queues the next one
+            conn.offset = sent
+            if sent and type(outq[0]) is not FileRegion:
+                break  # partial frame: the kernel buffer is full
+        if bool(outq) != conn.writing:
+            conn.writing = bool(outq)
+            events = selectors.EVENT_READ
+            if conn.writing:
+                events |= selectors.EVENT_WRITE
+            self.selector.modify(conn.sock, events, conn)
+
+    def _flush_due(self, now: float):
+        """Write out control frames queued this pass, then connections
+        whose flush window has closed."""
+        flush_now, self.flush_now = self.flush_now, []
+        for conn in flush_now:
+            if conn.outq and not conn.writing and conn.stage != 'closed':
+                self._write_ready(conn)
+        flushing = self.flushing
+        while flushing and flushing[0].flush_at <= now:
+            conn = flushing.popleft()
+            conn.flush_at = 0.0
+            if conn.outq and not conn.writing and conn.stage != 'closed':
+                self._write_ready(conn)
+
+    def _send_regions(self, conn: ChoverConnection, batch: list):
+        """Thread engine: a batch holding FileRegions, in queue order."""
+        start = 0
+        for i, payload in enumerate(batch):
+            if type(payload) is not FileRegion:
+                continue
+            self._send_all(conn.sock, batch[start:i])
+            start = i + 1
+            done = 0
+            while done < len(payload):
+                self.metrics.send_calls += 1
+                done += payload.send(conn.sock, done)
+            self._region_sent(conn, payload)
+        self._send_all(conn.sock, batch[start:])
+
+    def _send_all(self, sock: socket.socket, batch: list[bytes]):
+        """Blocking vectored sendall for the thread engine writers."""
+        if not self.USE_SENDMSG:
+            for payload in batch:
+                self.metrics.send_calls += 1
+                sock.sendall(payload)
+            return
+        views = [memoryview(payload) for payload in batch]
+        while views:
+            self.metrics.send_calls += 1
+            sent = sock.sendmsg(views)
+            while views and sent >= len(views[0]):
+                sent -= len(views.pop(0))
+            if sent:
+                views[0] = views[0][sent:]
+
+    def _end_probe(self, conn: ChoverConnection, now: float):
+        """No header in the probe window: a legacy client, replay as before."""
+        conn.stage = 'handshake'
+        conn.deadline = now + self.HANDSHAKE_TIMEOUT
+        # ────── S1 Send (Conditional) ──────
+        self.join_room(conn, self.default_room)
+
+    def _resume(self, conn: ChoverConnection, last_id: int, room: str):
+        # ────── S1 Send (only what the client missed) ──────
+        self.join_room(conn, room, last_id)
+        self._finish_handshake(conn)
+
+    def _finish_handshake(self, conn: ChoverConnection):
+        conn.stage = 'chat'
+        self.metrics.handshake_us.observe(
+            (time.perf_counter_ns() - conn.accepted_at) // 1000)
+        conn.inbuf = bytearray()
+        self.print_connected(conn.info)
+
+    def _drop_client(self, conn: ChoverConnection):
+        if conn is self.bus:
+            raise ConnectionError('message bus closed')  # worker exits
+        if not self.clients.discard(conn):
+            return  # already dropped: exactly one caller gets past this
+        conn.stage = 'closed'
+        self.metrics.disconnects += 1
+        if conn.peer is None:
+            self.print_disconnected(conn.info)
+        else:
+            self.unlink(conn)
+        if conn.room is not None:
+            conn.room.members.discard(conn)
+        if conn.udp_token is not None:
+            self.udp_peers.pop(conn.udp_token, None)
+            self.announce_presence(conn, False)
+        self.wheel.cancel(conn)
+        for upload in conn.uploads.values():
+            upload.file.close()  # the .part stays, for a resume
+            self.uploading.pop(upload.key, None)
+        for payload in tuple(conn.outq):
+            if type(payload) is FileRegion:
+                payload.transfer.file.close()
+        if conn.wakeup is not None:
+            with conn.wakeup:
+                conn.wakeup.notify()  # lets its writer thread exit
+        if self.selector is not None:
+            try:
+                self.selector.unregister(conn.sock)
+            except (KeyError, ValueError):
+                pass
+        conn.sock.close()
+
+    # ────────── Server > Worker Processes ──────────
+    def run_workers(self, workers: int):
+        """Fork workers that share the port; this process becomes the bus."""
+        links: list[socket.socket] = []
+        pids: list[int] = []
+        for index in range(workers):
+            # unix socketpair per worker: ordered, and no path to clean up
+            hub_end, worker_end = socket.socketpair()
+            pid = os.fork()
+            if pid == 0:
+                hub_end.close()
+                for link in links:
+                    link.close()
+                self.run_worker(index, worker_end)  # never returns
+            worker_end.close()
+            links.append(hub_end)
+            pids.append(pid)
+        self.start_index()
+        try:
+            self.run_bus(links)
+        finally:
+            for link in links:
+                link.close()  # EOF on the bus stops every worker
+            for pid in pids:
+                os.waitpid(pid, 0)
+
+    def run_worker(self, index: int, link: socket.socket):
+        self.worker = index
+        self.history_log = None  # the bus process owns the log
+        if self.history_index is not None:  # ...and the index writer
+            self.history_index = ChatIndex(self.history_index.path,
+                                           writable=False)
+        self.start_logging()
+        link.setblocking(False)
+        self.bus = ChoverConnection(link, self.new_client_info(('bus', 0)),
+                                    0.0, self.new_decoder())
+        self.bus.stage = 'chat'
+        self.bus.framed = True
+        self.start_metrics()
+        self.open_udp()
+        try:
+            self.establish_selector_server()
+        except (KeyboardInterrupt, ConnectionError):
+            self.bus = None  # shutdown must not touch it
+            self.shutdown_tcp_server()
+        finally:
+            sys.stdout.flush()
+            os._exit(0)  # never unwind into the parent's stack
+
+    def run_bus(self, links: list[socket.socket]):
+        """Sequencer: every chat record gets its room id here, then goes
+        back to all workers over the same ordered links, so every client
+        sees a room's messages in one order whichever worker it is on."""
+        with selectors.DefaultSelector() as sel:
+            for link in links:
+                sel.register(link, selectors.EVENT_READ, self.new_decoder())
+            live = len(links)
+            while live:
+                for key, _ in sel.select():
+                    try:
+                        frames = self.recv_frames(key.fileobj, key.data)
+                    except (OSError, ProtocolError):
+                        frames = None
+                    if frames is None:
+                        sel.unregister(key.fileobj)
+                        live -= 1
+                        continue
+                    for frame_type, payload in frames:
+                        if frame_type != FrameType.RELAY:
+                            continue
+                        published = json.loads(payload.decode())
+                        record = self.record_chat(
+                            published['username'], published['message'],
+                            published['room'])
+                        frame = self.pack_frame(FrameType.RELAY, json.dumps(
+                            {**record, "origin": published['origin']}
+                        ).encode())
+                        for link in links:
+                            try:
+                                link.sendall(frame)
+                            except OSError:
+                                pass  # worker gone, its EOF follows
+
+    def publish(self, conn: ChoverConnection, message: str):
+        """Worker side: hand a chat line to the bus to be sequenced."""
+        self.send_to(self.bus, self.pack_frame(FrameType.RELAY, json.dumps({
+            "username": conn.info.username,
+            "message": message,
+            "room": conn.room.name,
+            "origin": [self.worker, conn.info.id],
+        }).encode()), droppable=False)
+
+    def relay_in(self, record: dict):
+        """Worker side: a sequenced record, delivered to local members."""
+        worker, conn_id = record.pop('origin')
+        room = self.get_room(record['room'])
+        room.history.append(record, self.intern_username(record['username']))
+        sender = self.clients.get(conn_id) if worker == self.worker else None
+        self.broadcast(sender, record)
+
+    # ────────── Server > Federation ──────────
+    def dial(self, address: tuple):
+        """Start a non-blocking connect to another server; the loop
+        finishes it in _peer_connected."""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setblocking(False)
+        self.set_nodelay(sock)
+        self.set_keepalive(sock)
+        err = sock.connect_ex(address)
+        if err not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+            sock.close()
+            self._redial_later(address, os.strerror(err))
+            return
+        conn = ChoverConnection(sock, self.new_client_info(address), 0.0,
+                                self.new_decoder())
+        conn.stage = 'connecting'
+        conn.framed = True
+        conn.peer = ''  # named by its PEER reply
+        conn.dial = address
+        self.clients.add(conn)
+        self.selector.register(sock, selectors.EVENT_WRITE, conn)
+
+    def _peer_connected(self, conn: ChoverConnection):
+        err = conn.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if err:
+            self.clients.discard(conn)
+            self.selector.unregister(conn.sock)
+            conn.sock.close()
+            self._redial_later(conn.dial, os.strerror(err))
+            return
+        conn.stage = 'chat'
+        conn.last_seen = time.monotonic()
+        conn.pings = True  # a server answers PINGs
+        self.wheel.schedule(conn, self.PING_INTERVAL)
+        self.peer_links.add(conn)
+        self.selector.modify(conn.sock, selectors.EVENT_READ, conn)
+        header = struct.pack(self.HEADER_FORMAT, self.node.encode()[:16],
+                             self.version.encode())
+        # PING: the other side holds the link to IDLE_TIMEOUT too
+        self.send_to(conn, header + self.peer_hello() + self.pack_ping(),
+                     droppable=False)
+
+    def _redial_later(self, address: tuple, reason: str):
+        delay = self.peer_delay.get(address, self.PEER_RETRY)
+        self.peer_delay[address] = min(delay * 2, self.PEER_RETRY_MAX)
+        wait = random.uniform(delay / 2, delay)
+        self.log('warn', f"[!] Peer {address[0]}:{address[1]}: {reason}, "
+                         f"retrying in {wait:.1f}s.")
+        self.redials.append((time.monotonic() + wait, address))
+
+    def _redial_due(self, now: float):
+        if not self.redials:
+            return
+        due = [address for when, address in self.redials if when <= now]
+        self.redials = [(when, address) for when, address in self.redials
+                        if when > now]
+        for address in due:
+            self.dial(address)
+
+    def peer_hello(self) -> bytes:
+        return self.pack_frame(FrameType.PEER, json.dumps(
+            {"node": self.node, "secret": self.PEER_SECRET or ''}).encode())
+
+    def check_hello(self, conn: ChoverConnection, payload: bytes) -> bool:
+        """Name the link after a valid PEER frame, else drop it."""
+        try:
+            hello = json.loads(payload.decode())
+            node, secret = str(hello['node']), str(hello['secret'])
+        except (ValueError, KeyError, TypeError):
+            node = secret = ''
+        if (not self.PEER_SECRET or not self.valid_room(node)
+                or node == self.node
+                or not hmac.compare_digest(secret.encode(),
+                                           self.PEER_SECRET.encode())):
+            self.log('warn', f"[!] Peer refused: "
+                             f"{conn.info.ip}:{conn.info.port} "
+                             f"(node {node!r}).")
+            self._drop_client(conn)
+            return False
+        conn.peer = node
+        conn.info.username = node
+        if conn.dial is not None:
+            self.peer_delay.pop(conn.dial, None)  # linked: backoff resets
+        self.log('peer', f"[+] Peer linked: {node} "
+                         f"({conn.info.ip}:{conn.info.port}).",
+                 {"node": node, "ip": conn.info.ip, "port": conn.info.port})
+        return True
+
+    def link_accepted(self, conn: ChoverConnection, payload: bytes) -> bool:
+        """A connection opened with PEER instead of RESUME."""
+        if not self.check_hello(conn, payload):
+            return False
+        conn.stage = 'chat'
+        self.peer_links.add(conn)
+        self.send_to(conn, self.peer_hello(), droppable=False)
+        return True
+
+    def unlink(self, conn: ChoverConnection):
+        self.peer_links.discard(conn)
+        self.log('peer', f"[-] Peer unlinked: {conn.peer or '?'} "
+                         f"({conn.info.ip}:{conn.info.port}).",
+                 {"node": conn.peer, "ip": conn.info.ip,
+                  "port": conn.info.port})
+        if conn.dial is not None:
+            self._redial_later(conn.dial, 'link lost')
+
+    def handle_link_frame(self, conn: ChoverConnection, frame_type: int,
+                          payload: bytes):
+        if frame_type == FrameType.FEDERATE and conn.peer:
+            self.federate_in(conn, payload)
+        elif frame_type == FrameType.PEER and conn.peer == '':
+            self.check_hello(conn, payload)  # the reply to our dial
+
+    def federate(self, item: list,
+                 source: Optional[ChoverConnection] = None):
+        """Queue a line for the other servers. Lines leave in batches, a
+        FEDERATE frame per link every PEER_BATCH_WINDOW, through the same
+        non-blocking queues as chat, so a slow link never holds up the
+        local room."""
+        if not self.federating:
+            self.federate_at = time.monotonic() + self.PEER_BATCH_WINDOW
+        self.federating.append((item, source))
+        if len(self.federating) >= self.PEER_BATCH:
+            self.federate_at = 0.0  # full: at the end of this pass
+
+    def _federate_due(self, now: float):
+        if not self.federating or self.federate_at > now:
+            return
+        batch, self.federating = self.federating, []
+        for link in self.peer_links.snapshot():
+            # not back where it came from, nor to a node it passed
+            items = [item for item, source in batch
+                     if source is not link and link.peer not in item[-1]]
+            for start in range(0, len(items), self.PEER_BATCH):
+                self.send_to(link, self.pack_frame(
+                    FrameType.FEDERATE,
+                    json.dumps(items[start:start + self.PEER_BATCH]).encode()))
+            self.metrics.federated_out += len(items)
+
+    def federate_in(self, conn: ChoverConnection, payload: bytes):
+        """Deliver a batch from another server, once per origin id, and
+        pass it on to the links it has not been through."""
+        try:
+            items = json.loads(payload.decode())
+        except ValueError:
+            items = None
+        if not isinstance(items, list):
+            self.log('warn', f"[!] Peer {conn.peer}: bad FEDERATE frame.")
+            return
+        seen = self.peer_seen
+        for item in items:
+            try:
+                seq, room, username, message, path = item
+                valid = (type(seq) is int and self.valid_room(room)
+                         and isinstance(username, str)
+                         and isinstance(message, str) and path
+                         and all(isinstance(node, str) for node in path))
+            except (TypeError, ValueError):
+                valid = False
+            if not valid:
+                continue
+            origin = (path[0], seq)
+            if self.node in path or origin in seen:
+                self.metrics.federated_dup += 1
+                continue
+            seen[origin] = None
+            if len(seen) > self.PEER_SEEN_LIMIT:
+                seen.popitem(last=False)
+            self.metrics.federated_in += 1
+            record = self.record_chat(f'{username}@{path[0]}', message, room)
+            self.broadcast(None, record)
+            self.federate([seq, room, username, message, [*path, self.node]],
+                          conn)
+
+    # ────────── Server > Side Channel (UDP) ──────────
+    def open_udp(self):
+        if self.UDP_PORT is None:
+            return
+        port = self.UDP_PORT + (self.worker or 0) if self.UDP_PORT else 0
+        self.udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.udp_socket.bind((self.HOST, port))
+        self.udp_socket.setblocking(False)  # sends drop, they never wait
+        self.log('info', f"[*] Side channel: udp {self.HOST}:"
+                         f"{self.udp_socket.getsockname()[1]}.")
+
+    def offer_udp(self, conn: ChoverConnection):
+        """Answer a client's UDP ask with our port and its token. Servers
+        without a side channel never answer; the client just goes without."""
+        if self.udp_socket is None or conn.udp_token is not None:
+            return
+        conn.udp_token = os.urandom(self.UDP_TOKEN_SIZE)
+        self.udp_peers[conn.udp_token] = conn
+        self.send_to(conn, self.pack_frame(FrameType.UDP, struct.pack(
+            '!H', self.udp_socket.getsockname()[1]) + conn.udp_token),
+            droppable=False)
+
+    def _datagrams_ready(self):
+        for _ in range(self.ACCEPT_BATCH):
+            try:
+                data, addr = self.udp_socket.recvfrom(self.MAX_DATAGRAM_SIZE)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                return  # e.g. ICMP unreachable from a client that left
+            self.handle_datagram(data, addr)
+
+    def _udp_thread(self):
+        """Thread engine: one blocking reader for every client's datagrams."""
+        while True:
+            try:
+                select.select([self.udp_socket], [], [])
+                data, addr = self.udp_socket.recvfrom(self.MAX_DATAGRAM_SIZE)
+            except (BlockingIOError, InterruptedError, ConnectionError):
+                continue
+            except (OSError, ValueError):
+                return  # closed by shutdown
+            self.handle_datagram(data, addr)
+
+    def handle_datagram(self, data: bytes, addr: tuple):
+        metrics = self.metrics
+        metrics.datagrams_in += 1
+        body_at = self.DATAGRAM_SIZE + self.UDP_TOKEN_SIZE
+        if len(data) < body_at:
+            metrics.datagrams_dropped += 1
+            return
+        kind, seq = struct.unpack_from(self.DATAGRAM_FORMAT, data)
+        conn = self.udp_peers.get(data[self.DATAGRAM_SIZE:body_at])
+        # drop-stale: a reordered datagram is older state, never replayed
+        if (conn is None or conn.stage != 'chat'
+                or seq <= conn.udp_last.get(kind, 0)):
+            metrics.datagrams_dropped += 1
+            return
+        conn.udp_last[kind] = seq
+        conn.udp_seen = time.monotonic()
+        bound, conn.udp_addr = conn.udp_addr, addr  # follows NAT rebinding
+        if bound is None:
+            self.announce_presence(conn, True)
+        body = data[body_at:]
+        if kind == DatagramType.HEARTBEAT:
+            self.send_datagram(conn, self.pack_datagram(kind, body))
+        elif kind == DatagramType.TYPING and body:
+            self.room_datagram(conn, self.pack_datagram(
+                kind, body[:1] + conn.info.username.encode()))
+
+    def announce_presence(self, conn: ChoverConnection, online: bool):
+        """Tell conn's room it came or went; a newcomer also hears who is
+        already there."""
+        if conn.udp_addr is None or conn.room is None:
+            return
+        self.room_datagram(conn, self.pack_datagram(
+            DatagramType.PRESENCE,
+            bytes((online,)) + conn.info.username.encode()))
+        if not online:
+            return
+        for member in itertools.islice(
+                (member for member in conn.room.members.snapshot()
+                 if member is not conn and member.udp_addr is not None),
+                self.UDP_PRESENCE_LIMIT):
+            self.send_datagram(conn, self.pack_datagram(
+                DatagramType.PRESENCE,
+                b'\x01' + member.info.username.encode()))
+
+    def room_datagram(self, sender: ChoverConnection, datagram: bytes):
+        for member in sender.room.members.snapshot():
+            if member is not sender:
+                self.send_datagram(member, datagram)
+
+    def pack_datagram(self, kind: int, body: bytes) -> bytes:
+        # server-wide sequence: per (type, user) it still only grows
+        return struct.pack(self.DATAGRAM_FORMAT, kind,
+                           next(self.udp_seq)) + body
+
+    def send_datagram(self, conn: ChoverConnection, datagram: bytes):
+        """Best effort: never queued, never blocks, never retried."""
+        if (conn.udp_addr is None
+                or time.monotonic() - conn.udp_seen > self.UDP_TIMEOUT):
+            return
+        try:
+            self.udp_socket.sendto(datagram, conn.udp_addr)
+            self.metrics.datagrams_out += 1
+        except OSError:
+            self.metrics.datagrams_dropped += 1  # full buffer: newer follows
+
+    # ────────── Server > Metrics ──────────
+    def start_metrics(self):
+        """Admin socket and periodic dump, each on a small daemon thread."""
+        if self.STATS_PORT is not None:
+            port = self.STATS_PORT + (self.worker or 0)
+            self.stats_socket = socket.create_server(('127.0.0.1', port))
+            threading.Thread(target=self.serve_stats, daemon=True).start()
+            self.log('info', f"[*] Stats: 127.0.0.1:{port} "
+                             f"(send 'clients' for per-client queues).")
+        if self.METRICS_FILE is not None:
+            threading.Thread(target=self.dump_metrics, daemon=True).start()
+
+    def serve_stats(self):
+        """One JSON document per connection, e.g. `nc 127.0.0.1 PORT`."""
+        while True:
+            try:
+                sock, _ = self.stats_socket.accept()
+            except OSError:
+                return  # closed by shutdown
+            with sock:
+                sock.settimeout(0.2)
+                try:
+                    command = sock.recv(64).strip().decode(errors='replace')
+                except OSError:
+                    command = ''  # nothing sent: the default report
+                body = (self.queue_stats() if command == 'clients'
+                        else self.metrics_snapshot())
+                try:
+                    sock.sendall(json.dumps(body).encode() + b'\n')
+                except OSError:
+                    pass
+
+    def dump_metrics(self):
+        while not self.metrics_stop.wait(self.METRICS_INTERVAL):
+            line = json.dumps(self.metrics_snapshot()).encode() + b'\n'
+            try:
+                with open(self.METRICS_FILE, 'ab') as f:  # one write a line
+                    f.write(line)
+            except OSError as e:
+                self.log('warn', f'[!] Metrics dump failed: {e}')
+
+    def metrics_snapshot(self) -> dict:
+        """Counters and histograms; queue depths are read at call time."""
+        metrics = self.metrics
+        clients = self.clients.snapshot()
+        queue_bytes = Histogram()
+        for conn in clients:
+            queue_bytes.observe(max(conn.queued, 0))
+        return {
+            "ts": time.time(),
+            "uptime": time.time() - metrics.started,
+            "worker": self.worker,
+            "pid": os.getpid(),
+            "connections": {"open": len(clients),
+                            "total": metrics.connections,
+                            "closed": metrics.disconnects},
+            "messages": {"in": metrics.messages_in,
+                         "out": metrics.messages_out,
+                         "dropped": metrics.dropped},
+            "bytes": {"in": metrics.bytes_in, "out": metrics.bytes_out},
+            "send_calls": metrics.send_calls,
+            "datagrams": {"in": metrics.datagrams_in,
+                          "out": metrics.datagrams_out,
+                          "dropped": metrics.datagrams_dropped},
+            "federation": {"links": len(self.peer_links),
+                           "in": metrics.federated_in,
+                           "out": metrics.federated_out,
+                           "duplicates": metrics.federated_dup},
+            "evictions": metrics.evictions,
+            "reaped": metrics.reaped,
+            "log": {"queued": len(self.logger.queue) if self.logger else 0,
+                    "dropped": self.logger.dropped if self.logger else 0},
+            "rooms": len(self.rooms),
+            "congested": sum(conn.congested for conn in clients),
+            "queue_bytes": queue_bytes.snapshot(),
+            "broadcast_us": metrics.broadcast_us.snapshot(),
+            "handshake_us": metrics.handshake_us.snapshot(),
+            "chat_path_us": metrics.chat_path_us.snapshot(),
+        }
 
     # ────────── Execution Logic ──────────
-    def run_over_tcp(self, banner: bool = False):
+    def run_over_tcp(self, banner: bool = False, engine: str = 'selector',
+                     workers: int = 1):
+        if engine not in self.ENGINES:
+            raise ValueError(f"unknown engine {engine!r}, "
+                             f"expected one of {self.ENGINES}")
+        if self.SLOW_CONSUMER_POLICY not in self.SLOW_CONSUMER_POLICIES:
+            raise ValueError(f"unknown slow consumer policy "
+                             f"{self.SLOW_CONSUMER_POLICY!r}, expected one "
+                             f"of {self.SLOW_CONSUMER_POLICIES}")
+        if not 0 <= self.SEND_LOW_WATER < self.SEND_HIGH_WATER:
+            raise ValueError("expected 0 <= SEND_LOW_WATER < SEND_HIGH_WATER")
+        if workers > 1 and (engine != 'selector'
+                            or not hasattr(socket, 'SO_REUSEPORT')
+                            or not hasattr(os, 'fork')):
+            raise ValueError("workers > 1 needs the selector engine, "
+                             "SO_REUSEPORT and fork (Linux, BSD)")
+        if (self.PEERS or self.PEER_SECRET) and (engine != 'selector'
+                                                 or workers > 1):
+            raise ValueError("federation needs the selector engine and "
+                             "one worker")
+        self.node = self.NODE_ID or os.urandom(4).hex()
+        if not self.valid_room(self.node):
+            raise ValueError(f"NODE_ID {self.NODE_ID!r} must be a valid "
+                             f"room name")
         if banner:
             print(__, f"\nver.{self.version}")
         else:
             print(f"chover ver.{self.version}")
         print("(c) 2025 ljzh04")
+        self.start_logging()
+        self.open_history()
+        self.wheel = TimerWheel(self.TIMER_TICK, self.TIMER_SLOTS)
+        if self.FILES_DIR is not None:
+            os.makedirs(self.FILES_DIR, exist_ok=True)
+        if workers <= 1:
+            self.start_metrics()  # workers start their own after the fork
+            self.open_udp()
+            self.start_index()
         try:
-            self.establish_tcp_server()
+            if workers > 1:
+                self.run_workers(workers)
+            elif engine == 'selector':
+                self.establish_selector_server()
+            else:
+                self.establish_tcp_server()
         except KeyboardInterrupt:
             self.shutdown_tcp_server()
 
     def shutdown_tcp_server(self):
+        self.stop_logging()  # flush queued events first
         print('\n\r[!] Server shutting down...')
-        for client in self.clients:
-            if client:
+        self.metrics_stop.set()
+        if self.stats_socket is not None:
+            self.stats_socket.close()
+        if self.udp_socket is not None:
+            self.udp_socket.close()
+            self.udp_peers.clear()
+        self.flushing.clear()
+        self.flush_now.clear()
+        self.federating.clear()
+        self.redials.clear()
+        self.peer_links.clear()
+        for client in self.clients.clear():
+            client.stage = 'closed'
+            try:
                 try:
-                    try:
-                        client.shutdown(socket.SHUT_RDWR)
-                    except OSError:
-                        pass  # ignore err, if already closed
-                    client.close()
-                except Exception as e:
-                    print(f'[!] Error shutting down client: {e}')
-        self.clients.clear()
+                    client.sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass  # ignore err, if already closed
+                client.sock.close()
+            except Exception as e:
+                print(f'[!] Error shutting down client: {e}')
+        for room in tuple(self.rooms.values()):
+            room.members.clear()
+        if self.history_log is not None:
+            self.history_log.close()
+            self.history_log = None
+        if self.history_index is not None:
+            self.history_index.close()
+            self.history_index = None
         try:
-            self.socket.close()
+            if self.socket is not None:  # the bus process never listens
+                self.socket.close()
             print('[i] Done.')
         except Exception as e:
             print(f'[!] Error shutting down server: {e}')
 
     # ────────── Utilities ──────────
-    def enqueue_chat_log(self, username: str, now: str, message: str):
-        self.history.append({
+    def new_client_info(self, addr: tuple[str, int]) -> ClientInfo:
+        return ClientInfo(next(self.conn_ids), addr[0], addr[1],
+                          self.default_username, self.unknown_version)
+
+    def apply_client_header(self, client_info: ClientInfo, header: bytes):
+        unpacked_data = struct.unpack(self.HEADER_FORMAT,
+                                      header[:self.HEADER_SIZE])
+        username_bytes, version_bytes = unpacked_data
+        # '16s' can cut a multi-byte name mid-character; never trust the rest
+        client_info.username = username_bytes.rstrip(b'\x00').decode(
+            errors='replace')
+        client_info.version = version_bytes.rstrip(b'\x00').decode(
+            errors='replace')
+
+    def parse_room(self, payload: bytes) -> tuple[int, str]:
+        """(last-seen id, room) of a RESUME / JOIN frame; a malformed one
+        means a full replay, an invalid or missing room the lobby."""
+        if len(payload) < self.ID_SIZE:
+            return 0, self.default_room
+        last_id, = struct.unpack_from(self.ID_FORMAT, payload)
+        room = payload[self.ID_SIZE:].decode(errors='replace')
+        if not self.valid_room(room):
+            return (0 if room else last_id), self.default_room
+        return last_id, room
+
+    def print_connected(self, client_info: ClientInfo):
+        self.log('connect', f"[+] Connected: "
+                            f"{client_info.ip}:{client_info.port}"
+                            f" username: {client_info.username}"
+                            f" (ver. {client_info.version}).",
+                 self.log_fields(client_info))
+
+    def print_disconnected(self, client_info: ClientInfo):
+        self.log('disconnect', f"[-] Disconnected: "
+                               f"{client_info.ip}:{client_info.port} "
+                               f"username: {client_info.username} "
+                               f"(ver. {client_info.version}).",
+                 self.log_fields(client_info))
+
+    def log_fields(self, client_info: ClientInfo) -> dict:
+        return {"id": client_info.id, "username": client_info.username,
+                "version": client_info.version,
+                "ip": client_info.ip, "port": client_info.port}
+
+    def log(self, event: str, text: str, fields: Optional[dict] = None):
+        """Hand an event to the background writer; never waits on I/O
+        (unless LOG_DROP_POLICY is 'block' and the queue is full)."""
+        if self.logger is None:
+            print(text)
+        else:
+            self.logger.put(event, text, fields)
+
+    def start_logging(self):
+        """A fresh writer for this process; a forked one has no thread."""
+        path = self.LOG_FILE
+        if path is not None and self.worker is not None:
+            base, ext = os.path.splitext(path)
+            path = f'{base}-w{self.worker}{ext}'
+        self.logger = ServerLog(
+            self.LOG_CONSOLE, path, self.LOG_FILE_BYTES, self.LOG_FILE_KEEP,
+            self.LOG_QUEUE_LIMIT, self.LOG_BATCH, self.LOG_DROP_POLICY)
+
+    def stop_logging(self):
+        if self.logger is not None:
+            self.logger.close()
+            self.logger = None
+
+    def record_chat(self, username: str, message: str,
+                    room: Optional[str] = None) -> dict:
+        """Log + store one chat line, return its record for broadcast."""
+        ts = int(time.time())
+        today = self.format_time(ts)
+        if self.LOG_CHAT:
+            where = f"#{room} " if room and room != self.default_room else ''
+            self.log('chat', f"{where}{username} | {today} ❯ {message}",
+                     {"username": username,
+                      "room": room or self.default_room})
+        return self.enqueue_chat_log(username, today, message, ts, room)
+
+    def enqueue_chat_log(self, username: str, now: str, message: str,
+                         ts: Optional[int] = None,
+                         room: Optional[str] = None) -> dict:
+        record = {
             "username": username,
             "now": now,
-            "message": message
-        })
+            "message": message,
+            "ts": int(time.time()) if ts is None else ts,
+            "room": room or self.default_room,
+        }
+        self.get_room(record['room']).history.append(
+            record, self.intern_username(username))
+        if self.history_log is not None:
+            self.history_log.append(record)
+        if self.history_index is not None:
+            self.history_index.append(record)
+        return record
 
 
 # ────────── Client ──────────
 class ChoverClient(ChoverBase):
+    HISTORY_TIMEOUT: float = 5.0  # per read while waiting for HISTORY
+    RENDER_INTERVAL: float = 1 / 30  # incoming lines drawn once a frame
+    # ────── Reconnect (exponential backoff with jitter) ──────
+    RECONNECT_DELAY: float = 0.5     # first retry, doubled per failure
+    RECONNECT_MAX_DELAY: float = 30.0
+    RECONNECT_ATTEMPTS: int = 0      # consecutive failures, 0 = forever
+    OUTBOX_LIMIT: int = 100          # messages typed while disconnected
+    # ────── Side Channel (UDP) ──────
+    USE_UDP: bool = True             # ask for it; old servers just don't offer
+    UDP_HEARTBEAT_INTERVAL: float = 2.0
+    TYPING_INTERVAL: float = 2.0     # resend 'typing' at most this often
+    TYPING_TIMEOUT: float = 5.0      # ...and forget it this long after
+    # ────── Files ──────
+    DOWNLOAD_DIR: str = '.'          # /get saves here (.part while partial)
+    PROGRESS_INTERVAL: float = 1.0   # seconds between progress lines
+
     def __init__(self, HOST: str, PORT: int):
         super().__init__(HOST, PORT)
         self.username = 'guest'
-        self.server_receive_alive = threading.Event()
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.connected = False  # reading a live socket, else reconnecting
+        self.gave_up = False
+        self.heard_at = 0.0  # last bytes from the server, monotonic
+        self.pending: list[str] = []  # lines waiting for the next render
+        self.render_handle: Optional[asyncio.TimerHandle] = None
+        self.decoder = self.new_decoder()
+        self.backlog: list[tuple[int, bytes]] = []  # frames behind HISTORY
+        self.usernames: dict[int, str] = {}  # server's ids, binary only
+        self.last_id = 0  # newest message id seen, sent back on reconnect
+        self.outbox: deque[str] = deque(maxlen=self.OUTBOX_LIMIT)
+        self.room = self.default_room
+        self.seen: dict[str, int] = {}  # last_id of rooms we've left
+        self.joining = False  # JOIN sent, its HISTORY not back yet
+        self.session: Optional[PromptSession] = None
+        self.udp: Optional[socket.socket] = None  # side channel, if offered
+        self.udp_token = b''
+        self.udp_seq = itertools.count(1)
+        self.udp_last: dict[tuple[int, str], int] = {}  # newest seq seen
+        self.present: set[str] = set()     # room members, from PRESENCE
+        self.typing: dict[str, float] = {}  # username -> last TYPING
+        self.typing_sent = 0.0
+        self.rtt_ms: Optional[float] = None
+        self.send_lock = threading.Lock()  # loop and upload threads write
+        self.server_pongs = False  # server answered our PING: watch it
+        self.uploads: dict[str, str] = {}     # key -> path, until stored
+        self.downloads: dict[str, Optional[dict]] = {}  # key -> progress
+        self.search_query: Optional[dict] = None  # last /search, for /more
+        self.search_next: Optional[int] = None    # its next page cursor
 
     def establish_tcp_client(self):
+        asyncio.run(self.chat_loop())
+
+    async def chat_loop(self):
+        """One asyncio loop for the prompt, the sockets and the timers."""
+        self.loop = asyncio.get_running_loop()
+        self.connect_tcp()
+        # ────── S3... Send ──────
+        with patch_stdout():  # once: every print lands above the prompt
+            while not self.gave_up:
+                await self.get_msg()
+            self.render()
+
+    def connect_tcp(self):
+        """Connect and resume from last_id; needs the running loop."""
+        resumed_from = self.last_id
+        self.attach(*self.handshake(resumed_from), resumed_from)
+
+    def handshake(self, resumed_from: int
+                  ) -> tuple[socket.socket, list[dict]]:
+        """Blocking S0/S1: connect, send the header, wait for HISTORY.
+        Reconnects run it in an executor thread, the prompt stays live."""
         # ────── Client Info ──────
         # 16s=16-byte padded string
         username_bytes = self.username.encode().ljust(16, b'\x00')
-        version_bytes = self.version.encode().ljust(16, b'\x00')
-        packed_data = struct.pack('!16s16s', username_bytes, version_bytes)
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            self.socket = s
+        version_bytes = self.wire_version().encode().ljust(16, b'\x00')
+        packed_data = struct.pack(self.HEADER_FORMAT,
+                                  username_bytes, version_bytes)
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            s.settimeout(self.HISTORY_TIMEOUT)
             s.connect((self.HOST, self.PORT))
-            # ────── S1 Receive (Conditional) ──────
-            readable, _, _ = select.select([s], [], [], 1.0)
-            if readable:
-                chat_data = s.recv(self.BUFFER_SIZE)
-                chat_history = json.loads(chat_data.decode())
-                for chat in chat_history:
-                    if (self.username != "guest" and
-                       self.username == chat["username"]):
-                        print(f"You | {chat['now']} ❯ {chat['message']}")
-                    else:
-                        print(f"{chat['username']} | {chat['now']}"
-                              f" ❯ {chat['message']}")
+            # a line typed right after another shouldn't wait for an ACK
+            s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            # ────── S0 Send (framed servers wait for it) ──────
+            s.sendall(packed_data + self.pack_frame(
+                FrameType.RESUME, self.pack_room(resumed_from, self.room))
+                + (self.pack_frame(FrameType.UDP, b'') if self.USE_UDP
+                   else b'')
+                + self.pack_ping())  # a PONG back means it reaps and pings
+            # ────── S1 Receive ──────
+            self.decoder = self.new_decoder()
+            self.backlog = []
+            chat_history = self.await_history(s)
+            s.settimeout(None)  # blocking, for socket.sendfile() uploads
+        except BaseException:
+            s.close()
+            raise
+        return s, chat_history
+
+    def attach(self, s: socket.socket, chat_history: list[dict],
+               resumed_from: int):
+        """Make s the live connection: reads become loop callbacks."""
+        lines = self.render_history(chat_history, resumed_from)
+        if self.socket is not None:
+            self.unwatch(self.socket)
+            self.socket.close()
+            self.close_udp()  # its token died with the old connection
+            lines.insert(0, f'[i] Reconnected to #{self.room}.')
+        self.socket = s
+        self.joining = False
+        self.server_pongs = False
+        self.connected = True
+        self.heard_at = time.monotonic()
+        # ────── S4... Handle Background Updates ──────
+        lines.extend(self.render_frames(self.backlog))
+        self.backlog = []
+        self.show(lines)
+        self.loop.add_reader(s, self.handle_server_receive, s)
+        self.loop.create_task(self.watchdog(s))
+        while self.outbox:
+            self.cmd_parse(s, self.outbox.popleft())
+        # ────── Resume Transfers (the server says where to go on) ──────
+        for key in tuple(self.uploads):
+            self.offer_file(s, key)
+        for key in tuple(self.downloads):
+            self.request_file(s, key)
+
+    async def reconnect(self):
+        """Retry the handshake with exponential backoff while the prompt
+        keeps taking input; what is typed meanwhile waits in the outbox."""
+        delay = self.RECONNECT_DELAY
+        attempt = 0
+        while not self.RECONNECT_ATTEMPTS or attempt < self.RECONNECT_ATTEMPTS:
+            attempt += 1
+            # jitter: a dropped office doesn't reconnect in lockstep
+            wait = random.uniform(delay / 2, delay)
+            self.show([f'[i] Reconnecting to {self.HOST}:{self.PORT} '
+                       f'in {wait:.1f}s (attempt {attempt})...'])
+            await asyncio.sleep(wait)
+            resumed_from = self.last_id
+            try:
+                s, chat_history = await self.loop.run_in_executor(
+                    None, self.handshake, resumed_from)
+            except (OSError, ProtocolError):
+                delay = min(delay * 2, self.RECONNECT_MAX_DELAY)
+                continue
+            self.attach(s, chat_history, resumed_from)
+            return
+        self.show(['[x] Giving up, server unreachable.'])
+        self.gave_up = True
+        if self.session is not None and self.session.app.is_running:
+            self.session.app.exit(result='')
+
+    def lost(self, sock: socket.socket, reason: str):
+        """The connection is gone: stop reading it and start over."""
+        if sock is not self.socket or not self.connected:
+            return  # already handled
+        self.connected = False
+        self.unwatch(sock)
+        self.show([reason])
+        self.loop.create_task(self.reconnect())
+
+    # ────────── Client > Side Channel (UDP) ──────────
+    def open_udp(self, payload: bytes):
+        """Bind the offered side channel; replaces the last connection's."""
+        port, = struct.unpack_from('!H', payload)
+        udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            udp.connect((self.socket.getpeername()[0], port))
+        except OSError:
+            udp.close()
+            return  # chat works without it
+        self.close_udp()
+        udp.setblocking(False)
+        self.udp, self.udp_token = udp, payload[2:]
+        # a new server (or worker) counts its datagrams from 1 again
+        self.udp_last.clear()
+        self.send_datagram(DatagramType.HELLO)
+        self.loop.add_reader(udp, self.handle_udp_receive, udp)
+        self.loop.create_task(self.heartbeat(udp))
+
+    def close_udp(self):
+        if self.udp is not None:
+            self.unwatch(self.udp)
+            self.udp.close()
+        self.udp = None
+        self.present.clear()
+        self.typing.clear()
+
+    def send_datagram(self, kind: int, body: bytes = b''):
+        udp = self.udp
+        if udp is None:
+            return
+        try:
+            udp.send(struct.pack(self.DATAGRAM_FORMAT, kind,
+                                 next(self.udp_seq)) + self.udp_token + body)
+        except OSError:
+            pass  # lost like any datagram; the next one carries newer state
+
+    async def heartbeat(self, udp: socket.socket):
+        """Heartbeats out, until the channel is replaced."""
+        while self.udp is udp:
+            self.send_datagram(DatagramType.HEARTBEAT, struct.pack(
+                '!Q', time.perf_counter_ns()))
+            await asyncio.sleep(self.UDP_HEARTBEAT_INTERVAL)
+
+    def handle_udp_receive(self, udp: socket.socket):
+        """Loop reader: presence/typing in, every datagram queued."""
+        while True:
+            try:
+                self.handle_datagram(udp.recv(self.MAX_DATAGRAM_SIZE))
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError:
+                return  # ICMP unreachable while the server restarts
+
+    def handle_datagram(self, data: bytes):
+        if len(data) < self.DATAGRAM_SIZE:
+            return
+        kind, seq = struct.unpack_from(self.DATAGRAM_FORMAT, data)
+        body = data[self.DATAGRAM_SIZE:]
+        if kind == DatagramType.HEARTBEAT and len(body) == 8:
+            sent, = struct.unpack('!Q', body)
+            self.rtt_ms = (time.perf_counter_ns() - sent) / 1e6
+            return
+        if kind not in (DatagramType.PRESENCE, DatagramType.TYPING) or not body:
+            return
+        username = body[1:].decode(errors='replace')
+        # drop-stale per sender: reordered datagrams carry older state
+        if seq <= self.udp_last.get((kind, username), 0):
+            return
+        self.udp_last[kind, username] = seq
+        if kind == DatagramType.PRESENCE:
+            if body[0]:
+                self.present.add(username)
             else:
-                print('Welcome, begin a new conversation.')
-            # ────── S2 Send (Optional) ──────
-            if self.username != 'guest':
-                s.sendall(packed_data)
-            # ────── S4... Handle Background Updates ──────
-            receive_thread = threading.Thread(
-                target=self.handle_server_receive, args=(s,), daemon=True)
-            receive_thread.start()
-            # ────── S3... Send ──────
-            while self.server_receive_alive.is_set():
-                self.get_msg(s)
-
-    # def establish_udp_client(self):
-    #   with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
-    #       s.sendto(b'Hello, world', (self.HOST, self.PORT))
-    #       data, server_addr = s.recvfrom(1024)
-    #   print(f"Received '{repr(data)}' from {server_addr}")
+                self.present.discard(username)
+                self.typing.pop(username, None)
+        elif body[0]:
+            self.typing[username] = time.monotonic()
+        else:
+            self.typing.pop(username, None)
+
+    def on_text_changed(self, buffer):
+        now = time.monotonic()
+        if buffer.text and now - self.typing_sent >= self.TYPING_INTERVAL:
+            self.typing_sent = now
+            self.send_datagram(DatagramType.TYPING, b'\x01')
+
+    def toolbar(self) -> str:
+        now = time.monotonic()
+        typing = [username for username, at in tuple(self.typing.items())
+                  if now - at < self.TYPING_TIMEOUT]
+        parts = [f'#{self.room}: {len(self.present) + 1} here']
+        if typing:
+            parts.append(f"{', '.join(typing[:3])} "
+                         f"{'is' if len(typing) == 1 else 'are'} typing...")
+        if self.rtt_ms is not None:
+            parts.append(f'rtt {self.rtt_ms:.1f} ms')
+        return ' | '.join(parts)
 
     # ────────── Client > Server Handling Logic ──────────
+    def await_history(self, sock: socket.socket) -> list[dict]:
+        """Read frames until HISTORY, however many reads it spans."""
+        while True:
+            frames = self.recv_frames(sock, self.decoder)
+            if frames is None:
+                raise ConnectionResetError('server closed during handshake')
+            for i, (frame_type, payload) in enumerate(frames):
+                if frame_type in (FrameType.HISTORY, FrameType.HISTORY_BIN):
+                    self.backlog.extend(frames[i + 1:])
+                    return self.decode_history(frame_type, payload)
+
+    def decode_history(self, frame_type: int, payload: bytes) -> list[dict]:
+        if frame_type == FrameType.HISTORY:
+            return json.loads(payload.decode())
+        history = msgpack.unpackb(payload, strict_map_key=False)
+        # only the names this history uses; USER frames bring the rest
+        self.usernames.update(history['users'])
+        return [{"username": self.lookup_username(user_id),
+                 "now": self.format_time(ts),
+                 "message": message,
+                 "id": msg_id}
+                for msg_id, ts, user_id, message in history['messages']]
+
+    def render_history(self, chat_history: list[dict],
+                       resumed_from: int) -> list[str]:
+        """Lines for a HISTORY reply, noting what a resume skipped."""
+        lines = []
+        if not resumed_from:
+            if not chat_history:
+                lines.append('Welcome, begin a new conversation.')
+        elif chat_history and chat_history[0]['id'] != resumed_from + 1:
+            lines.append(f'[i] Too far behind to resume: replaying the '
+                         f'last {len(chat_history)} messages.')
+        else:
+            lines.append(f'[i] {len(chat_history)} missed messages.')
+        for chat in chat_history:
+            if (self.username != "guest" and
+               self.username == chat["username"]):
+                lines.append(f"You | {chat['now']} ❯ {chat['message']}")
+            else:
+                lines.append(f"{chat['username']} | {chat['now']}"
+                             f" ❯ {chat['message']}")
+        if chat_history:
+            self.last_id = chat_history[-1]['id']
+        return lines
+
+    def render_frames(self, frames: list[tuple[int, bytes]]) -> list[str]:
+        """Chat lines to print for frames; binary ones formatted here."""
+        lines = []
+        for frame_type, payload in frames:
+            if frame_type == FrameType.USER:
+                user_id, username = msgpack.unpackb(payload)
+                self.usernames[user_id] = username
+            elif frame_type == FrameType.UDP:
+                self.open_udp(payload)
+            elif frame_type == FrameType.PING:
+                try:
+                    self.send_frame(self.socket, self.pack_frame(
+                        FrameType.PONG, payload))
+                except OSError:
+                    pass  # the read side notices the drop
+            elif frame_type == FrameType.PONG:
+                self.server_pongs = True
+            elif frame_type == FrameType.FILE_CHUNK:
+                lines.extend(self.file_chunk(payload))
+            elif frame_type == FrameType.FILE_ACCEPT:
+                lines.extend(self.file_accepted(json.loads(payload.decode())))
+            elif frame_type == FrameType.FILE_META:
+                lines.extend(self.file_meta(json.loads(payload.decode())))
+            elif frame_type == FrameType.SEARCH_HITS:
+                lines.extend(self.search_hits(json.loads(payload.decode())))
+            elif frame_type in (FrameType.HISTORY, FrameType.HISTORY_BIN):
+                # ────── /join reply ──────
+                self.joining = False
+                lines.append(f'[i] Joined #{self.room}.')
+                lines.extend(self.render_history(
+                    self.decode_history(frame_type, payload), self.last_id))
+            elif self.joining:
+                continue  # the old room's tail, or in the history anyway
+            elif frame_type == FrameType.CHAT:
+                msg_id, = struct.unpack_from(self.ID_FORMAT, payload)
+                if msg_id <= self.last_id:
+                    continue  # raced the join, already in its history
+                self.last_id = msg_id
+                lines.append(payload[self.ID_SIZE:].decode(errors='replace'))
+            elif frame_type == FrameType.CHAT_BIN:
+                msg_id, ts, user_id, message = msgpack.unpackb(payload)
+                if msg_id <= self.last_id:
+                    continue
+                self.last_id = msg_id
+                lines.append(f"{self.lookup_username(user_id)} | "
+                             f"{self.format_time(ts)} ❯ {message}")
+        return lines
+
+    def lookup_username(self, user_id: int) -> str:
+        return self.usernames.get(user_id, '?')
+
     def handle_server_receive(self, sock: socket.socket):
-        self.server_receive_alive.set()
+        """Loop reader: one recv per readiness event, so keystrokes are
+        handled between reads even while a busy room floods in."""
+        # ────── S4... Optional Updates ──────
         try:
-            while True:
-                # ────── S4... Optional Updates ──────
-                readable, _, _ = select.select([sock], [], [], 1.0)
-                if readable:
-                    new_msg_data = sock.recv(self.BUFFER_SIZE)
-                    if not new_msg_data:
-                        print("\n\r[!] Server disconnected.")
-                        self.unblock_prompt()
-                        break
-                    with patch_stdout():
-                        print(new_msg_data.decode())
-        finally:
-            self.server_receive_alive.clear()
+            frames = self.recv_frames(sock, self.decoder)
+        except (OSError, ProtocolError):
+            return self.lost(sock, '[!] Connection lost.')
+        if frames is None:
+            return self.lost(sock, '[!] Server disconnected.')
+        self.heard_at = time.monotonic()
+        self.show(self.render_frames(frames))
+
+    async def watchdog(self, sock: socket.socket):
+        """Liveness: a half-open socket never reads EOF."""
+        pinged_at = time.monotonic()
+        while sock is self.socket and self.connected:
+            await asyncio.sleep(1.0)
+            if not self.server_pongs or not self.connected:
+                continue
+            now = time.monotonic()
+            if now - self.heard_at >= self.IDLE_TIMEOUT:
+                return self.lost(sock, '[!] Server stopped answering.')
+            if (now - self.heard_at >= self.PING_INTERVAL
+                    and now - pinged_at >= self.PING_INTERVAL):
+                pinged_at = now
+                try:
+                    self.send_frame(sock, self.pack_ping())
+                except OSError:
+                    return self.lost(sock, '[!] Connection lost.')
+
+    # ────── Rendering ──────
+    def show(self, lines: list[str]):
+        """Queue lines for the next render frame. A flood of hundreds
+        of messages costs one redraw of the prompt, not one each."""
+        if not lines:
+            return
+        if self.loop is None:
+            print('\n'.join(lines))
+            return
+        self.pending.extend(lines)
+        if self.render_handle is None:
+            self.render_handle = self.loop.call_later(self.RENDER_INTERVAL,
+                                                      self.render)
+
+    def show_threadsafe(self, line: str):
+        """show() for the upload threads."""
+        try:
+            self.loop.call_soon_threadsafe(self.show, [line])
+        except (AttributeError, RuntimeError):  # no loop, or it has ended
+            print(line)
+
+    def render(self):
+        self.render_handle = None
+        lines, self.pending = self.pending, []
+        if lines:
+            print('\n'.join(lines))
+
+    # ────────── Client > File Transfer ──────────
+    def send_file(self, sock: socket.socket, path: str):
+        path = os.path.expanduser(path)
+        try:
+            st = os.stat(path)
+        except OSError as e:
+            print(f'[!] {path}: {e.strerror}.')
+            return
+        if not os.path.isfile(path):
+            print(f'[!] {path}: not a regular file.')
+            return
+        # same file, same key: a later /send (or reconnect) resumes it
+        key = hashlib.sha256(f'{self.username}\0{os.path.abspath(path)}\0'
+                             f'{st.st_size}\0{st.st_mtime_ns}'.encode()
+                             ).hexdigest()[:32]
+        self.uploads[key] = path
+        print(f'[i] Offering {os.path.basename(path)} '
+              f'({self.format_size(st.st_size)})...')
+        self.offer_file(sock, key)
+
+    def offer_file(self, sock: socket.socket, key: str):
+        path = self.uploads[key]
+        try:
+            self.send_frame(sock, self.pack_frame(FrameType.FILE_OFFER, json.dumps({
+                "key": key, "name": os.path.basename(path),
+                "size": os.path.getsize(path)}).encode()))
+        except OSError:
+            pass  # offered again after the reconnect
+
+    def file_accepted(self, reply: dict) -> list[str]:
+        path = self.uploads.get(reply['key'])
+        if path is None:
+            return []
+        name = os.path.basename(path)
+        if 'error' in reply:
+            del self.uploads[reply['key']]
+            return [f"[!] {name}: {reply['error']}."]
+        if reply['offset'] >= os.path.getsize(path):
+            del self.uploads[reply['key']]
+            return [f'[+] Sent {name}.']
+        threading.Thread(target=self.upload, args=(
+            self.socket, reply['key'], path, reply['offset']),
+            daemon=True).start()
+        if reply['offset']:
+            return [f"[i] Resuming {name} at "
+                    f"{self.format_size(reply['offset'])}."]
+        return []
+
+    def upload(self, sock: socket.socket, key: str, path: str, offset: int):
+        """Stream path in FILE_CHUNK frames. The send lock is taken per
+        chunk, so chat typed meanwhile goes out between two chunks."""
+        name, size = os.path.basename(path), os.path.getsize(path)
+        shown = time.monotonic()
+        try:
+            with open(path, 'rb') as f:
+                while offset < size and self.uploads.get(key) == path:
+                    count = min(self.FILE_CHUNK_SIZE, size - offset)
+                    header = struct.pack(
+                        self.FRAME_HEADER_FORMAT, FrameType.FILE_CHUNK,
+                        self.FILE_CHUNK_HEADER + count) + struct.pack(
+                        self.FILE_CHUNK_FORMAT, bytes.fromhex(key), offset)
+                    with self.send_lock:
+                        sock.sendall(header, FileRegion.MSG_MORE)
+                        # zero-copy where the OS has sendfile()
+                        if sock.sendfile(f, offset, count) != count:
+                            raise OSError('file shrank while being sent')
+                    offset += count
+                    if time.monotonic() - shown >= self.PROGRESS_INTERVAL:
+                        shown = time.monotonic()
+                        self.show_threadsafe(self.progress(name, offset, size))
+        except OSError:
+            self.show_threadsafe(f'[!] {name}: paused at '
+                                 f'{offset * 100 // size}%, resumes after '
+                                 f'the reconnect.')
+
+    def get_file(self, sock: socket.socket, key: str):
+        key = key.lower()
+        if len(key) != 32 or not all(c in '0123456789abcdef' for c in key):
+            print('[!] Usage: /get <32 hex digit key>, as announced.')
+            return
+        self.downloads[key] = None  # FILE_META fills it in
+        self.request_file(sock, key)
+
+    def request_file(self, sock: socket.socket, key: str):
+        part = os.path.join(self.DOWNLOAD_DIR, key + '.part')
+        offset = os.path.getsize(part) if os.path.exists(part) else 0
+        try:
+            self.send_frame(sock, self.pack_frame(FrameType.FILE_GET, json.dumps(
+                {"key": key, "offset": offset}).encode()))
+        except OSError:
+            pass  # requested again after the reconnect
+
+    def file_meta(self, reply: dict) -> list[str]:
+        key = reply['key']
+        if key not in self.downloads:
+            return []
+        if 'error' in reply:
+            del self.downloads[key]
+            return [f"[!] {key}: {reply['error']}."]
+        file = open(os.path.join(self.DOWNLOAD_DIR, key + '.part'), 'ab')
+        if file.tell() != reply['offset']:
+            file.truncate(reply['offset'])  # the server starts over
+            file.seek(reply['offset'])
+        self.downloads[key] = {"file": file, "name": reply['name'],
+                               "size": reply['size'],
+                               "shown": time.monotonic()}
+        lines = [f"[i] Downloading {reply['name']} "
+                 f"({self.format_size(reply['size'])})..."]
+        if reply['offset'] >= reply['size']:
+            lines.append(self.finish_download(key))
+        return lines
+
+    def file_chunk(self, payload: bytes) -> list[str]:
+        key, offset = struct.unpack_from(self.FILE_CHUNK_FORMAT, payload)
+        key = key.hex()
+        download = self.downloads.get(key)
+        if download is None or offset != download['file'].tell():
+            return []
+        download['file'].write(
+            memoryview(payload)[self.FILE_CHUNK_HEADER:])
+        done = download['file'].tell()
+        if done >= download['size']:
+            return [self.finish_download(key)]
+        if time.monotonic() - download['shown'] >= self.PROGRESS_INTERVAL:
+            download['shown'] = time.monotonic()
+            return [self.progress(download['name'], done, download['size'])]
+        return []
+
+    def finish_download(self, key: str) -> str:
+        download = self.downloads.pop(key)
+        download['file'].close()
+        stem, ext = os.path.splitext(os.path.basename(download['name']))
+        path = os.path.join(self.DOWNLOAD_DIR, stem + ext)
+        copy = 0
+        while os.path.exists(path):  # never overwrite
+            copy += 1
+            path = os.path.join(self.DOWNLOAD_DIR, f'{stem} ({copy}){ext}')
+        os.replace(os.path.join(self.DOWNLOAD_DIR, key + '.part'), path)
+        return f'[+] Saved {path}.'
+
+    def progress(self, name: str, done: int, size: int) -> str:
+        return (f'[i] {name}: {done * 100 // max(size, 1)}% '
+                f'({self.format_size(done)} of {self.format_size(size)})')
+
+    # ────────── Client > Search ──────────
+    def search(self, sock: socket.socket, args: str):
+        """/search words [from:user] [in:room|*] [after:date] [before:date]"""
+        query: dict = {"words": [], "room": self.room}
+        for token in args.split():
+            field, _, value = token.partition(':')
+            try:
+                if field == 'from' and value:
+                    query['user'] = value
+                elif field == 'in' and value:
+                    query['room'] = None if value == '*' else value.lstrip('#')
+                elif field in ('after', 'before') and value:
+                    # local time, as shown in the chat: 2026-10-18[T21:30]
+                    query[field] = int(datetime.datetime.fromisoformat(
+                        value).timestamp())
+                else:
+                    query['words'].append(token)
+            except ValueError:
+                print(f'[!] {token}: dates are YYYY-MM-DD or '
+                      f'YYYY-MM-DDTHH:MM.')
+                return
+        self.search_query = query
+        self.request_search(sock)
+
+    def request_search(self, sock: socket.socket, cursor: Optional[int] = None):
+        try:
+            self.send_frame(sock, self.pack_frame(FrameType.SEARCH, json.dumps(
+                {**self.search_query, "cursor": cursor}).encode()))
+        except OSError:
+            print('[!] Not connected, search again after the reconnect.')
+
+    def search_hits(self, reply: dict) -> list[str]:
+        if 'error' in reply:
+            return [f"[!] Search: {reply['error']}."]
+        if not reply['hits']:
+            return ['[i] No matches.']
+        lines = [f"#{hit['room']} {hit['username']} | "
+                 f"{self.format_time(hit['ts'])} ❯ {hit['message']}"
+                 for hit in reversed(reply['hits'])]  # oldest on top
+        self.search_next = reply['next']
+        if reply['next'] is not None:
+            lines.append('[i] /more for older matches.')
+        return lines
 
     # ────────── Input Handling Logic ──────────
-    def get_msg(self, sock: socket.socket) -> bool:
+    async def get_msg(self) -> bool:
         now = datetime.datetime.now().strftime("%b %d %y [%I:%M %p]")
-        msg = prompt(f"You | {now} ❯ ")
-        return self.cmd_parse(sock, str(msg))
+        where = f" #{self.room}" if self.room != self.default_room else ''
+        if self.session is None:
+            self.session = PromptSession(refresh_interval=0.5)
+            self.session.default_buffer.on_text_changed += self.on_text_changed
+        msg = await self.session.prompt_async(
+            f"You{where} | {now} ❯ ",
+            bottom_toolbar=self.toolbar if self.udp is not None else None)
+        if self.typing_sent:
+            self.typing_sent = 0.0
+            self.send_datagram(DatagramType.TYPING, b'\x00')
+        # the socket of now: a reconnect may have replaced it while we waited
+        return self.cmd_parse(self.socket, str(msg))
 
     def cmd_parse(self, sock: socket.socket, cmd: str) -> bool:
         msg = cmd
         if cmd in ['/?', '/h', '/help']:
             print("/q | /quit | /exit - exit chatOverSockets\n"
                   "/? | /help | /h    - print this help message\n"
+                  "/join <room>       - switch to room, created on first use\n"
+                  f"/leave             - back to #{self.default_room}\n"
+                  "/send <path>       - upload a file to this room\n"
+                  "/get <key>         - download a file announced here\n"
+                  "/search <words>    - search history; from:<user>, "
+                  "in:<room|*>,\n"
+                  "                     after:/before:<YYYY-MM-DD>\n"
+                  "/more              - next page of the last search\n"
                   "default            - send as message")
             return True
         elif cmd in ['/q', '/quit', '/exit']:
             raise KeyboardInterrupt
-        else:
-            sock.sendall(msg.encode())
+        elif cmd.startswith('/send '):
+            self.send_file(sock, cmd[len('/send '):].strip())
+            return True
+        elif cmd.startswith('/get '):
+            self.get_file(sock, cmd[len('/get '):].strip())
+            return True
+        elif cmd.startswith('/search '):
+            self.search(sock, cmd[len('/search '):])
+            return True
+        elif cmd == '/more':
+            if self.search_next is None:
+                print('[i] No more matches.')
+            else:
+                self.request_search(sock, self.search_next)
+            return True
+        elif cmd.startswith('/join ') or cmd == '/leave':
+            if cmd == '/leave':
+                self.join(sock, self.default_room)
+            else:
+                self.join(sock, cmd[len('/join '):].strip())
+            return True
+        elif msg:
+            try:
+                if not self.connected:
+                    raise ConnectionError('reconnecting')
+                self.send_frame(sock, self.pack_frame(FrameType.CHAT,
+                                                      msg.encode()))
+            except OSError:
+                # delivered after the reconnect, if it comes in time
+                self.outbox.append(msg)
+                print('[!] Not connected, message queued.')
         return False
 
+    def join(self, sock: socket.socket, room: str):
+        if not self.valid_room(room):
+            print(f'[!] Room names are 1-{self.ROOM_NAME_MAX} letters, '
+                  f'digits, - or _.')
+            return
+        if room == self.room:
+            return
+        self.joining = True
+        self.present.clear()  # the new room's members are announced
+        self.typing.clear()
+        self.seen[self.room] = self.last_id
+        self.room, self.last_id = room, self.seen.get(room, 0)
+        try:
+            self.send_frame(sock, self.pack_frame(
+                FrameType.JOIN, self.pack_room(self.last_id, room)))
+        except OSError:
+            pass  # the reconnect resumes straight into the new room
+
     # ────────── Execution Logic ──────────
     def run_over_tcp(self, banner: bool = False):
         if banner:
@@ -282,9 +3534,13 @@ class ChoverClient(ChoverBase):
             self.shutdown_tcp_client()
         except ConnectionRefusedError:
             print(f'[x] Failed to connect to {self.HOST}:{self.PORT}.')
+        except (socket.timeout, ProtocolError):
+            print(f'[x] {self.HOST}:{self.PORT} did not answer the framed '
+                  f'handshake (server older than {self.framed_version}?).')
 
     def shutdown_tcp_client(self):
         print('\n\r[!] Client shutting down...')
+        self.close_udp()
         try:
             if self.socket:
                 try:
@@ -297,16 +3553,24 @@ class ChoverClient(ChoverBase):
             print(f'[i] Error during shutdown: {e}')
 
     # ────────── Utilities ──────────
+    def wire_version(self) -> str:
+        """Header version, asking for msgpack when we can decode it."""
+        if msgpack is not None:
+            return self.version + self.binary_suffix
+        return self.version
+
+    def send_frame(self, sock: socket.socket, frame: bytes):
+        """sendall under a lock: a PONG never lands inside a chat frame."""
+        with self.send_lock:
+            sock.sendall(frame)
+
     def set_username(self, username: str):
         self.username = username
 
-    def unblock_prompt(self):
-        import os
-        import sys
-        try:
-            os.write(sys.stdin.fileno(), b'\n')
-        except Exception:
-            pass
+    def unwatch(self, sock: socket.socket):
+        """Remove a loop reader; a no-op once the loop has closed."""
+        if self.loop is not None and not self.loop.is_closed():
+            self.loop.remove_reader(sock)
 
 
 # ────────────────────────────── APP ──────────────────────────────
@@ -329,6 +3593,10 @@ if __name__ == "__main__":
     print('Ctrl C to EXIT')
     if conn == 0:
         server = ChoverServer(HOST, PORT)
+        server.HISTORY_DIR = 'chover_history'
+        server.STATS_PORT = PORT + 1
+        server.UDP_PORT = PORT
+        server.FILES_DIR = 'chover_files'
         server.run_over_tcp()
     elif conn == 1:
         client = ChoverClient(HOST, PORT)
@@ -0,0 +1,353 @@
+""" Load generator: throughput, connect rate and fan-out latency. """
+import argparse
+import contextlib
+import datetime
+import json
+import math
+import multiprocessing
+import os
+import selectors
+import socket
+import struct
+import sys
+import time
+from typing import Optional
+
+from chatOverSockets import (ChoverBase, ChoverServer, FrameDecoder,
+                             FrameType, msgpack)
+
+# ────────── Usage ──────────
+# python chover_bench.py                      # 10, 100, 1000 clients
+# python chover_bench.py -c 100 -m 5000 --no-sendmsg
+# python chover_bench.py -c 1000 -r 200      # 200 rooms of 5
+# python chover_bench.py -c 1000 -r 200 -w 4 # 4 SO_REUSEPORT workers
+# python chover_bench.py -P steady --rate 500 --json results.json
+# python chover_bench.py --no-coalesce --no-nodelay  # write per frame
+# One client per room sends, every other member receives; a message
+# counts as delivered once the last receiver has read it. Every message
+# carries its send time, so each delivery is one latency sample.
+# The server's send syscalls (from its stats socket) and the TCP segments
+# the receivers got (TCP_INFO, Linux) are reported per delivery.
+# ─────────────────────────────────────
+PATTERNS: tuple[str, ...] = ('burst', 'steady', 'ramp')
+STATS_OFFSET: int = 1000  # server stats socket on port + this (+ worker)
+TCPI_SEGS_IN: int = 140   # offset of tcpi_segs_in in Linux struct tcp_info
+
+
+# ────────── Server Process ──────────
+def serve(port: int, engine: str, sendmsg: bool, high_water: int,
+          workers: int = 1, log_chat: bool = True,
+          flush_window: Optional[float] = ChoverServer.FLUSH_WINDOW,
+          nodelay: bool = True):
+    server = ChoverServer('127.0.0.1', port)
+    server.USE_SENDMSG = sendmsg
+    server.LOG_CHAT = log_chat
+    server.FLUSH_WINDOW = flush_window
+    server.TCP_NODELAY = nodelay
+    server.STATS_PORT = port + STATS_OFFSET
+    server.SEND_HIGH_WATER = high_water
+    server.SEND_LOW_WATER = high_water // 4
+    with open(os.devnull, 'w') as devnull, \
+            contextlib.redirect_stdout(devnull):
+        server.run_over_tcp(engine=engine, workers=workers)
+
+
+def wait_for_port(port: int, timeout: float = 10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), 0.5).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise TimeoutError(f'server on port {port} never came up')
+
+
+def send_calls(port: int, workers: int) -> int:
+    """Send syscalls so far, summed over the workers' stats sockets."""
+    total = 0
+    for worker in range(workers):
+        with socket.create_connection(
+                ('127.0.0.1', port + STATS_OFFSET + worker)) as sock:
+            sock.shutdown(socket.SHUT_WR)  # no command: the metrics
+            report = b''
+            while chunk := sock.recv(65536):
+                report += chunk
+        total += json.loads(report)['send_calls']
+    return total
+
+
+def segments_in(socks: list[socket.socket]) -> Optional[int]:
+    """TCP segments received on socks, None where TCP_INFO is missing."""
+    if not hasattr(socket, 'TCP_INFO'):
+        return None
+    total = 0
+    for sock in socks:
+        info = sock.getsockopt(socket.IPPROTO_TCP, socket.TCP_INFO, 256)
+        if len(info) < TCPI_SEGS_IN + 4:
+            return None  # kernel older than 4.2
+        total += struct.unpack_from('I', info, TCPI_SEGS_IN)[0]
+    return total
+
+
+def raise_fd_limit():
+    """Thousands of clients need more than the usual 1024 descriptors."""
+    try:
+        import resource
+    except ImportError:  # not on Windows
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+# ────────── Headless Clients ──────────
+def connect(port: int, name: str, binary: bool = False,
+            room: str = ChoverBase.default_room) -> socket.socket:
+    """Real framed handshake: header + RESUME, then wait for HISTORY."""
+    version = ChoverBase.version
+    if binary:
+        version += ChoverBase.binary_suffix
+    sock = socket.create_connection(('127.0.0.1', port))
+    sock.sendall(struct.pack(ChoverBase.HEADER_FORMAT, name.encode(),
+                             version.encode())
+                 + ChoverBase.pack_frame(FrameType.RESUME, bytes(
+                     ChoverBase.ID_SIZE) + room.encode()))
+    decoder = FrameDecoder(ChoverBase.MAX_FRAME_SIZE)
+    while not any(frame_type in (FrameType.HISTORY, FrameType.HISTORY_BIN)
+                  for frame_type, _ in decoder.feed(sock.recv(65536))):
+        pass
+    sock.setblocking(False)
+    return sock
+
+
+def stamped(seq: int, size: int) -> bytes:
+    """CHAT frame whose text starts with its sequence and send time."""
+    text = f'{seq}:{time.perf_counter_ns()}:'.encode()
+    return ChoverBase.pack_frame(FrameType.CHAT, text.ljust(size, b'x'))
+
+
+def sent_at(frame_type: int, payload: bytes) -> int:
+    """Send time stamped into a delivered chat message."""
+    if frame_type == FrameType.CHAT_BIN:
+        text = msgpack.unpackb(payload)[3]
+    else:  # '!Q' id + 'user | time ❯ text'
+        text = payload[ChoverBase.ID_SIZE:].decode().rsplit('❯ ', 1)[1]
+    return int(text.split(':', 2)[1])
+
+
+def schedule(pattern: str, messages: int, rate: float) -> list[float]:
+    """Offset in seconds at which each message is due."""
+    if pattern == 'burst':
+        return [0.0] * messages
+    if pattern == 'steady':
+        return [i / rate for i in range(messages)]
+    # ramp: the rate climbs linearly from 0 to rate, so n(t) = rate t²/2T
+    ramp = 2 * messages / rate
+    return [math.sqrt(2 * i * ramp / rate) for i in range(messages)]
+
+
+def percentile(ordered: list[int], q: float) -> float:
+    """Nearest-rank percentile of sorted ns samples, in ms."""
+    if not ordered:
+        return 0.0
+    rank = max(math.ceil(q * len(ordered)) - 1, 0)
+    return ordered[rank] / 1e6
+
+
+def run(clients: int, messages: int, size: int, port: int, engine: str,
+        sendmsg: bool, high_water: int, binary: bool = False,
+        rooms: int = 1, workers: int = 1, pattern: str = 'burst',
+        rate: float = 1000.0, log_chat: bool = True,
+        flush_window: Optional[float] = ChoverServer.FLUSH_WINDOW,
+        nodelay: bool = True) -> dict:
+    proc = multiprocessing.Process(
+        target=serve, args=(port, engine, sendmsg, high_water, workers,
+                            log_chat, flush_window, nodelay),
+        daemon=True)
+    proc.start()
+    try:
+        wait_for_port(port)
+        # client i joins room i % rooms; the first member of each sends
+        connect_start = time.perf_counter()
+        socks = [connect(port, f'bench{i}', binary,
+                         f'bench{i % rooms}' if rooms > 1
+                         else ChoverBase.default_room)
+                 for i in range(clients)]
+        connect_secs = time.perf_counter() - connect_start
+        senders, receivers = socks[:rooms], socks[rooms:]
+        for sender in senders:
+            sender.setblocking(True)
+        # chat frames each receiver still has to read
+        remaining = {sock: messages for sock in receivers}
+        decoders = {sock: FrameDecoder(ChoverBase.MAX_FRAME_SIZE)
+                    for sock in receivers}
+        latencies: list[int] = []
+        sel = selectors.DefaultSelector()
+        for sock in receivers:
+            sel.register(sock, selectors.EVENT_READ)
+        due = schedule(pattern, messages, rate)
+        calls_before = send_calls(port, workers)
+        segments_before = segments_in(receivers)
+        seq = 0
+        start = time.perf_counter()
+        deadline = time.monotonic() + 120 + due[-1]
+        while remaining and time.monotonic() < deadline:
+            # ────── Send whatever the pattern says is due ──────
+            elapsed = time.perf_counter() - start
+            if seq < messages and due[seq] <= elapsed:
+                end = seq
+                while end < messages and due[end] <= elapsed:
+                    end += 1
+                for sender in senders:
+                    sender.sendall(b''.join(stamped(i, size)
+                                            for i in range(seq, end)))
+                seq = end
+            timeout = 1.0
+            if seq < messages:
+                timeout = max(0.0, due[seq] - (time.perf_counter() - start))
+            # ────── Receive, one latency sample per delivery ──────
+            for key, _ in sel.select(timeout):
+                sock = key.fileobj
+                frames = decoders[sock].feed(sock.recv(1 << 20))
+                now = time.perf_counter_ns()
+                for frame_type, payload in frames:
+                    if frame_type in (FrameType.CHAT, FrameType.CHAT_BIN):
+                        latencies.append(now - sent_at(frame_type, payload))
+                        remaining[sock] -= 1
+                if remaining[sock] <= 0:
+                    sel.unregister(sock)
+                    del remaining[sock]
+        elapsed = time.perf_counter() - start
+        delivered = len(receivers) - len(remaining)
+        deliveries = max(len(latencies), 1)
+        calls = send_calls(port, workers) - calls_before
+        segments = segments_in(receivers)
+        if segments is not None:
+            segments -= segments_before
+        for sock in socks:
+            sock.close()
+        latencies.sort()
+        return {
+            'clients': clients,
+            'rooms': rooms,
+            'workers': workers,
+            'pattern': pattern,
+            'messages': messages,
+            'connect_seconds': connect_secs,
+            'connects_per_sec': clients / connect_secs,
+            'seconds': elapsed,
+            'msgs_per_sec': messages * rooms / elapsed,
+            'deliveries_per_sec': len(latencies) / elapsed,
+            'send_calls_per_delivery': calls / deliveries,
+            'packets_per_delivery': (segments / deliveries
+                                     if segments is not None else None),
+            'complete_receivers': delivered,
+            'receivers': len(receivers),
+            'latency_ms': {
+                'p50': percentile(latencies, 0.50),
+                'p99': percentile(latencies, 0.99),
+                'p999': percentile(latencies, 0.999),
+                'max': latencies[-1] / 1e6 if latencies else 0.0,
+            },
+        }
+    finally:
+        proc.terminate()
+        proc.join()
+
+
+# ────────────────────────────── APP ──────────────────────────────
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-c', '--clients', type=int, nargs='*',
+                        default=[10, 100, 1000])
+    parser.add_argument('-m', '--messages', type=int, default=1000,
+                        help='messages per sender (default: 1000)')
+    parser.add_argument('-s', '--size', type=int, default=64,
+                        help='chat text bytes per message (default: 64)')
+    parser.add_argument('-P', '--pattern', default='burst', choices=PATTERNS,
+                        help='burst: all at once, steady: --rate msgs/s, '
+                             'ramp: 0 up to --rate msgs/s (default: burst)')
+    parser.add_argument('--rate', type=float, default=1000.0,
+                        help='msgs/s per sender for steady/ramp')
+    parser.add_argument('-r', '--rooms', type=int, default=1,
+                        help='split clients over this many rooms, one '
+                             'sender each (default: 1)')
+    parser.add_argument('-w', '--workers', type=int, default=1,
+                        help='server worker processes (default: 1)')
+    parser.add_argument('-p', '--port', type=int, default=56555)
+    parser.add_argument('-e', '--engine', default='selector',
+                        choices=ChoverServer.ENGINES)
+    parser.add_argument('--no-sendmsg', action='store_true',
+                        help='one send() per frame instead of vectored')
+    parser.add_argument('--flush-window', type=float,
+                        default=ChoverServer.FLUSH_WINDOW,
+                        help='server FLUSH_WINDOW in seconds (default: '
+                             f'{ChoverServer.FLUSH_WINDOW})')
+    parser.add_argument('--no-coalesce', action='store_true',
+                        help='FLUSH_WINDOW None: write every frame at once')
+    parser.add_argument('--no-nodelay', action='store_true',
+                        help='server TCP_NODELAY off: leave it to Nagle')
+    parser.add_argument('--no-log-chat', action='store_true',
+                        help='server LOG_CHAT off: no per-message echo')
+    parser.add_argument('-b', '--binary', action='store_true',
+                        help='clients ask for msgpack records')
+    parser.add_argument('--high-water', type=int, default=8 * 1024 * 1024,
+                        help='server SEND_HIGH_WATER, large so nothing drops')
+    parser.add_argument('--json', nargs='?', const='-', metavar='FILE',
+                        help="write results as JSON to FILE ('-': stdout)")
+    args = parser.parse_args()
+    if args.binary and msgpack is None:
+        parser.error('--binary needs msgpack installed')
+    raise_fd_limit()
+    flush_window = None if args.no_coalesce else args.flush_window
+    table = args.json != '-'
+    if table:
+        print(f"{'clients':>8} {'rooms':>6} {'msgs':>6} {'conn/s':>8} "
+              f"{'msgs/s':>9} {'deliveries/s':>13} {'p50 ms':>8} "
+              f"{'p99 ms':>8} {'p999 ms':>8} {'sends/msg':>10} "
+              f"{'pkts/msg':>9} {'complete':>9}")
+    results = []
+    for i, clients in enumerate(args.clients):
+        rooms = min(args.rooms, clients // 2) or 1  # >= 1 receiver a room
+        r = run(clients, args.messages, args.size, args.port + i,
+                args.engine, not args.no_sendmsg, args.high_water,
+                args.binary, rooms, args.workers, args.pattern, args.rate,
+                not args.no_log_chat, flush_window, not args.no_nodelay)
+        results.append(r)
+        if table:
+            latency = r['latency_ms']
+            print(f"{r['clients']:>8} {r['rooms']:>6} {r['messages']:>6} "
+                  f"{r['connects_per_sec']:>8.0f} {r['msgs_per_sec']:>9.0f} "
+                  f"{r['deliveries_per_sec']:>13.0f} "
+                  f"{latency['p50']:>8.2f} {latency['p99']:>8.2f} "
+                  f"{latency['p999']:>8.2f} "
+                  f"{r['send_calls_per_delivery']:>10.3f} "
+                  + (f"{r['packets_per_delivery']:>9.3f} "
+                     if r['packets_per_delivery'] is not None
+                     else f"{'-':>9} ")
+                  + f"{r['complete_receivers']:>5}/{r['receivers']}")
+    if args.json:
+        report = {
+            'version': ChoverBase.version,
+            'date': datetime.datetime.now().isoformat(timespec='seconds'),
+            'engine': args.engine,
+            'sendmsg': not args.no_sendmsg,
+            'binary': args.binary,
+            'log_chat': not args.no_log_chat,
+            'flush_window': flush_window,
+            'nodelay': not args.no_nodelay,
+            'size': args.size,
+            'rate': args.rate,
+            'results': results,
+        }
+        if args.json == '-':
+            json.dump(report, sys.stdout, indent=2)
+            print()
+        else:
+            with open(args.json, 'w') as f:
+                json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
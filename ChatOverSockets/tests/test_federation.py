@@ -0,0 +1,165 @@
+""" Federation: several servers linked over loopback in one process. """
+import contextlib
+import json
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from chatOverSockets import ChoverBase, ChoverServer, FrameType  # noqa: E402
+
+# ────────── Usage ──────────
+# python -m unittest discover ChatOverSockets/tests   (or pytest)
+# Three nodes dial each other in a triangle, a -> b -> c -> a, so every
+# line reaches a node both directly and around the loop.
+# ─────────────────────────────────────
+SECRET: str = 'federation-test'
+WAIT: float = 5.0  # seconds for links and deliveries
+
+
+def free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def wait_for(condition, timeout: float = WAIT) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return condition()
+
+
+def start_node(node: str, port: int,
+               peers: tuple[tuple[str, int], ...]) -> ChoverServer:
+    server = ChoverServer('127.0.0.1', port)
+    server.NODE_ID = node
+    server.PEERS = peers
+    server.PEER_SECRET = SECRET
+    server.LOG_CONSOLE = False
+    with open(os.devnull, 'w') as devnull, \
+            contextlib.redirect_stdout(devnull):  # the banner
+        threading.Thread(target=server.run_over_tcp, daemon=True).start()
+        wait_for(lambda: server.selector is not None)
+    return server
+
+
+def connect(port: int, username: str) -> socket.socket:
+    """A framed client past its handshake, in the lobby."""
+    sock = socket.create_connection(('127.0.0.1', port), timeout=WAIT)
+    sock.sendall(struct.pack(ChoverBase.HEADER_FORMAT, username.encode(),
+                             ChoverBase.version.encode())
+                 + ChoverBase.pack_frame(FrameType.RESUME, bytes(8)))
+    return sock
+
+
+def link(port: int, node: str) -> socket.socket:
+    """A hand-driven peer link, as another server would dial it."""
+    sock = socket.create_connection(('127.0.0.1', port), timeout=WAIT)
+    sock.sendall(struct.pack(ChoverBase.HEADER_FORMAT, node.encode(),
+                             ChoverBase.version.encode())
+                 + ChoverBase.pack_frame(FrameType.PEER, json.dumps(
+                     {"node": node, "secret": SECRET}).encode()))
+    return sock
+
+
+def lines(server: ChoverServer, message: str) -> list[str]:
+    """Usernames of the lobby's history records carrying message."""
+    room = server.rooms.get(server.default_room)
+    if room is None:
+        return []
+    return [record['username'] for record in room.history
+            if record['message'] == message]
+
+
+class FederationTest(unittest.TestCase):
+    def setUp(self):
+        ports = {node: free_port() for node in 'abc'}
+        dials = {'a': 'b', 'b': 'c', 'c': 'a'}
+        self.nodes = {node: start_node(node, port,
+                                       (('127.0.0.1', ports[dials[node]]),))
+                      for node, port in ports.items()}
+        self.ports = ports
+        for server in self.nodes.values():
+            self.addCleanup(self.stop, server)
+        linked = lambda: all(  # noqa: E731
+            sorted(link.peer for link in server.peer_links.snapshot())
+            == sorted(set('abc') - {node})
+            for node, server in self.nodes.items())
+        self.assertTrue(wait_for(linked), 'servers never linked')
+
+    @staticmethod
+    def stop(server: ChoverServer):
+        with open(os.devnull, 'w') as devnull, \
+                contextlib.redirect_stdout(devnull):
+            server.shutdown_tcp_server()
+
+    def test_line_arrives_once_with_origin(self):
+        sock = connect(self.ports['a'], 'alice')
+        self.addCleanup(sock.close)
+        time.sleep(0.2)  # past the handshake
+        sock.sendall(ChoverBase.pack_frame(FrameType.CHAT, b'hello, world'))
+        for node in 'bc':
+            self.assertTrue(wait_for(
+                lambda: lines(self.nodes[node], 'hello, world')),
+                f'node {node} never got the line')
+        # the loop has had time to bring it around again
+        time.sleep(self.nodes['a'].PEER_BATCH_WINDOW * 20 + 0.2)
+        self.assertEqual(lines(self.nodes['a'], 'hello, world'), ['alice'])
+        self.assertEqual(lines(self.nodes['b'], 'hello, world'), ['alice@a'])
+        self.assertEqual(lines(self.nodes['c'], 'hello, world'), ['alice@a'])
+        # c had it from a, then from b: the second copy was the duplicate
+        self.assertGreaterEqual(self.nodes['c'].metrics.federated_dup, 1)
+
+    def test_line_is_delivered_to_clients_once(self):
+        listener = connect(self.ports['c'], 'carol')
+        sender = connect(self.ports['b'], 'bob')
+        for sock in (listener, sender):
+            self.addCleanup(sock.close)
+        time.sleep(0.2)
+        listener.settimeout(0.2)
+        with contextlib.suppress(socket.timeout):
+            while listener.recv(65536):  # history and the like
+                pass
+        sender.sendall(ChoverBase.pack_frame(FrameType.CHAT, b'to carol'))
+        received = b''
+        deadline = time.monotonic() + 1.0
+        while time.monotonic() < deadline:
+            with contextlib.suppress(socket.timeout):
+                received += listener.recv(65536)
+        self.assertEqual(received.count(b'to carol'), 1)
+        self.assertIn(b'bob@b', received)
+
+    def test_loop_is_deduplicated(self):
+        # a fourth node, z, linked to a by hand
+        server = self.nodes['a']
+        sock = link(self.ports['a'], 'z')
+        self.addCleanup(sock.close)
+        self.assertTrue(wait_for(lambda: 'z' in [
+            peer.peer for peer in server.peer_links.snapshot()]))
+        before = server.metrics.federated_dup
+        # a's own line, back after going around; then z's line, twice
+        items = [[1, 'lobby', 'alice', 'came back', ['a', 'b', 'z']],
+                 [7, 'lobby', 'zed', 'twice', ['z']]]
+        sock.sendall(ChoverBase.pack_frame(FrameType.FEDERATE,
+                                           json.dumps(items).encode())
+                     + ChoverBase.pack_frame(FrameType.FEDERATE,
+                                             json.dumps(items[1:]).encode()))
+        self.assertTrue(wait_for(
+            lambda: server.metrics.federated_dup - before == 2))
+        self.assertEqual(lines(server, 'came back'), [])
+        self.assertEqual(lines(server, 'twice'), ['zed@z'])
+        # passed on once, to b and c
+        for node in 'bc':
+            self.assertTrue(wait_for(
+                lambda: lines(self.nodes[node], 'twice') == ['zed@z']))
+
+
+if __name__ == '__main__':
+    unittest.main()
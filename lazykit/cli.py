@@ -6,7 +6,7 @@
 # Command dispatching
 import argparse
 
-from lazykit.commands import gen_license, gen_readme, tree
+from lazykit.commands import diff, gen_license, gen_readme, tree
 
 # from lazykit.plugins import load_plugins
 
@@ -19,6 +19,7 @@ def main():
     gen_readme.register(subparsers)
     gen_license.register(subparsers)
     tree.register(subparsers)
+    diff.register(subparsers)
 
     # ───── Plugin Commands ─────
     # load_plugins(subparsers)
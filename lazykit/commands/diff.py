@@ -0,0 +1,93 @@
+"""usage: `lazykit diff [-h] [-x [DIR ...]] [-X [FILE ...]] [-j N] [-g] OLD [NEW]`"""
+import os
+
+from lazykit import utils
+from lazykit.core import context, snapshot
+
+
+def register(subparsers):
+    parser = subparsers.add_parser(
+        "diff",
+        help="Show what changed between two snapshots",
+        formatter_class=lambda prog: utils.CustomFormatter(prog, max_help_position=36)
+    )
+
+    parser.add_argument(
+        "old",
+        metavar="OLD",
+        help="Snapshot file (from `lazykit tree --snapshot`) or directory"
+    )
+    parser.add_argument(
+        "new",
+        metavar="NEW",
+        nargs="?",
+        help="Snapshot file or directory (default: current directory)",
+        default="."
+    )
+    parser.add_argument(
+        "-x", "--exclude-dir",
+        metavar="DIR",
+        nargs="*",
+        help="Additional directories to exclude when crawling",
+        default=[],
+        dest='exclude_dir'
+    )
+    parser.add_argument(
+        "-X", "--exclude-file",
+        metavar="FILE",
+        nargs="*",
+        help="Additional files to exclude when crawling",
+        default=[],
+        dest='exclude_file'
+    )
+    parser.add_argument(
+        "-j", "--jobs",
+        metavar="N",
+        type=int,
+        help="Crawl directories with N threads (default: 1, serial)",
+        default=1,
+        dest='jobs'
+    )
+    parser.add_argument(
+        "-g", "--gitignore",
+        action="store_true",
+        help="Also apply .gitignore files when crawling",
+        dest='gitignore'
+    )
+
+    parser.set_defaults(func=handle)
+
+
+def handle(args):
+    extra_ignore = utils.exclude_patterns(args.exclude_dir, args.exclude_file)
+    gitignore = args.gitignore
+    trees = {}
+
+    # Snapshots first: a directory is crawled with their ignore options too, or what they left out shows up as added
+    for source in (args.old, args.new):
+        if os.path.isdir(source): continue
+        try:
+            trees[source], ignore, snapshot_gitignore = snapshot.load(source)
+        except (OSError, ValueError) as e:
+            print(f"[!] Could not load snapshot '{source}': {e}")
+            return
+        extra_ignore += [pattern for pattern in ignore if pattern not in extra_ignore]
+        gitignore = gitignore or snapshot_gitignore
+
+    for source in (args.old, args.new):
+        if source in trees: continue
+        # A live directory: the extraction cache makes this mostly stat calls
+        trees[source] = context.crawl_project_context(source, extra_ignore_patterns=extra_ignore, workers=args.jobs,
+                                                      gitignore=gitignore, cache=True, merkle=True)
+        if not trees[source]:
+            print(f"[!] Could not crawl project context at '{source}'.")
+            return
+
+    changes = snapshot.diff(trees[args.old], trees[args.new])
+    for op, path in changes:
+        print(f"{op} {path}")
+    if not changes:
+        print("[i] No changes.")
+        return
+    counts = {op: sum(1 for change, _ in changes if change == op) for op in "+-~"}
+    print(f"[i] {counts['+']} added, {counts['-']} removed, {counts['~']} changed")
@@ -1,6 +1,6 @@
-"""usage: `lazykit tree [-h] [-c DIR] [-x [DIR ...]] [-X [FILE ...]] [-n] [-l]`"""
+"""usage: `lazykit tree [-h] [-c DIR] [-x [DIR ...]] [-X [FILE ...]] [-n] [-l] [-j N] [-P N] [-g] [--no-cache] [--snapshot FILE]`"""
 from lazykit import utils
-from lazykit.core import context
+from lazykit.core import context, snapshot
 
 
 def register(subparsers):
@@ -50,25 +50,57 @@ def register(subparsers):
         action="store_true",
         help="Show file preview",
         dest='content')
+    parser.add_argument(
+        "-j", "--jobs",
+        metavar="N",
+        type=int,
+        help="Crawl with N threads (default: 1, serial)",
+        default=1,
+        dest='jobs'
+    )
+    parser.add_argument(
+        "-P", "--processes",
+        metavar="N",
+        type=int,
+        help="Parse Python files in N processes (default: 0, off)",
+        default=0,
+        dest='processes'
+    )
+    parser.add_argument(
+        "-g", "--gitignore",
+        action="store_true",
+        help="Also apply .gitignore files",
+        dest='gitignore'
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_false",
+        help="Don't read or write .lazykit/cache",
+        dest='cache'
+    )
+    parser.add_argument(
+        "--snapshot",
+        metavar="FILE",
+        help="Also save the tree, with hashes, for `lazykit diff`",
+        default=None,
+        dest='snapshot'
+    )
 
     parser.set_defaults(func=handle)
 
 
 def handle(args):
     crawl = context.crawl_project_context
-    display = utils.display_project_context if args.long else utils.display_file_tree
-
-    extra_ignore = []
-
-    # Process each exclude directory to match both the directory itself and its contents.
-    for pattern in args.exclude_dir:
-        normalized = pattern.rstrip("/")
-        extra_ignore.append(normalized)         # Matches the directory node (e.g., "__TestProjDir__")
-        extra_ignore.append(f"{normalized}/*")    # Matches all items inside
 
-    # Process exclude files similarly (if needed)
-    for pattern in args.exclude_file:
-        extra_ignore.append(pattern)
+    extra_ignore = utils.exclude_patterns(args.exclude_dir, args.exclude_file)
 
-    tree = crawl(args.context, extra_ignore_patterns=extra_ignore)
-    display(tree, show_content=args.content)
+    tree = crawl(args.context, extra_ignore_patterns=extra_ignore, workers=args.jobs, processes=args.processes,
+                 gitignore=args.gitignore, cache=args.cache, merkle=args.snapshot is not None)
+    # Saved first: the snapshot is kept even if the tree can't be displayed
+    saved = args.snapshot is not None and tree
+    if saved: snapshot.save(tree, args.snapshot, extra_ignore, args.gitignore)
+    if args.long:
+        utils.display_project_context(tree, show_content=args.content)
+    else:
+        utils.display_file_tree(tree)
+    if saved: print(f"[i] Saved snapshot to {args.snapshot}")
@@ -0,0 +1,132 @@
+""" On-disk cache of per-file extraction results. """
+import hashlib
+import marshal
+import os
+import struct
+import sys
+import zlib
+
+CACHE_DIR = os.path.join(".lazykit", "cache")
+CACHE_FILE = "extract.bin"
+MAX_BYTES = 32 * 1024 * 1024
+
+# --- File format ---
+# header: magic, format version, python major/minor (marshal), run stamp
+# record: path length, size, mtime_ns, inode, digest, stamp, payload length; path; payload
+# The payload is zlib(marshal({summary, metadata, content})), decoded only on a hit.
+MAGIC = b"LKXC"
+VERSION = 1
+HEADER = struct.Struct("<4sBBBI")
+RECORD = struct.Struct("<IQqQ16sII")
+NO_DIGEST = bytes(16)
+CACHED_KEYS = ("summary", "metadata", "content")
+
+
+# --- Public API ---
+class ExtractionCache:
+    """Extraction results keyed by relative path, valid while the file keeps its
+    (size, mtime_ns, inode); when only mtime or inode changed (a checkout, a
+    copy), a hash of the content decides.
+
+    Lookups only read, so they can run on worker threads; keep() and put()
+    belong to the crawling thread. save() writes the file only if an entry
+    changed, evicting the entries used longest ago beyond max_bytes.
+    """
+
+    def __init__(self, root: str | os.PathLike, max_bytes: int = MAX_BYTES):
+        self.path = os.path.join(root, CACHE_DIR, CACHE_FILE)
+        self.max_bytes = max_bytes
+        self.entries: dict[str, list] = {} # path -> [size, mtime_ns, inode, digest, stamp, payload]
+        self.stamp = 0
+        self.dirty = False
+        self._load()
+        self.stamp += 1 # this run
+
+    def get(self, key: str, stat: os.stat_result, path: str) -> dict | None:
+        """The cached result for the file at path (with its 'digest', if known), or None."""
+        entry = self.entries.get(key)
+        if entry is None: return None
+        size, mtime_ns, inode, digest, _, payload = entry
+        if (size, mtime_ns, inode) != (stat.st_size, stat.st_mtime_ns, stat.st_ino):
+            if size != stat.st_size or digest == NO_DIGEST: return None
+            try:
+                with open(path, encoding="utf-8") as f:
+                    if content_digest(f.read()) != digest: return None
+            except (UnicodeDecodeError, OSError):
+                return None
+        try:
+            result = marshal.loads(zlib.decompress(payload))
+        except (ValueError, EOFError, TypeError, zlib.error):
+            return None
+        if digest != NO_DIGEST: result["digest"] = digest
+        return result
+
+    def keep(self, key: str, stat: os.stat_result):
+        """Marks a hit as used by this run; only a moved identity makes the cache dirty."""
+        entry = self.entries[key]
+        entry[4] = self.stamp
+        if entry[:3] != [stat.st_size, stat.st_mtime_ns, stat.st_ino]:
+            entry[:3] = [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+            self.dirty = True
+
+    def put(self, key: str, stat: os.stat_result, digest: bytes | None, result: dict):
+        """Stores the extracted fields of result; values marshal cannot encode are not cached."""
+        try:
+            payload = zlib.compress(marshal.dumps({k: result[k] for k in CACHED_KEYS if k in result}), 1)
+        except ValueError:
+            self.entries.pop(key, None)
+            return
+        self.entries[key] = [stat.st_size, stat.st_mtime_ns, stat.st_ino, digest or NO_DIGEST, self.stamp, payload]
+        self.dirty = True
+
+    def save(self):
+        if not self.dirty: return
+        kept, total = [], HEADER.size
+        for key, entry in sorted(self.entries.items(), key=lambda item: -item[1][4]): # newest first
+            path = key.encode("utf-8", "surrogateescape")
+            total += RECORD.size + len(path) + len(entry[5])
+            if total > self.max_bytes: break
+            kept.append((path, entry))
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(tmp, "wb") as f:
+                f.write(HEADER.pack(MAGIC, VERSION, *sys.version_info[:2], self.stamp))
+                for path, (size, mtime_ns, inode, digest, stamp, payload) in kept:
+                    f.write(RECORD.pack(len(path), size, mtime_ns, inode, digest, stamp, len(payload)))
+                    f.write(path)
+                    f.write(payload)
+            os.replace(tmp, self.path)
+            self.dirty = False
+        except OSError as e:
+            print(f"[WARN] Could not write cache {self.path}: {e}")
+            try: os.remove(tmp)
+            except OSError: pass
+
+    def _load(self):
+        """Reads the cache file; a missing, foreign or damaged file is an empty cache."""
+        try:
+            with open(self.path, "rb") as f:
+                data = f.read()
+            magic, version, major, minor, stamp = HEADER.unpack_from(data)
+        except (OSError, struct.error):
+            return
+        if (magic, version, major, minor) != (MAGIC, VERSION, *sys.version_info[:2]): return
+        entries, offset = {}, HEADER.size
+        try:
+            while offset < len(data):
+                path_len, size, mtime_ns, inode, digest, entry_stamp, payload_len = RECORD.unpack_from(data, offset)
+                offset += RECORD.size
+                key = data[offset:offset + path_len].decode("utf-8", "surrogateescape")
+                offset += path_len
+                payload = data[offset:offset + payload_len]
+                offset += payload_len
+                if len(payload) != payload_len: return # truncated
+                entries[key] = [size, mtime_ns, inode, digest, entry_stamp, payload]
+        except struct.error:
+            return
+        self.entries, self.stamp = entries, stamp
+
+
+def content_digest(text: str) -> bytes:
+    return hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).digest()
@@ -2,13 +2,19 @@
 # lazykit:description: This is a utility function.
 # lazykit:author: Jane Doe
 import ast
-import fnmatch
+import contextlib
+import functools
 import json
 import mimetypes
+import os
 import pathlib
 import re
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
+from .cache import ExtractionCache, content_digest
 from .extractors import extract_content
+from .ignore import IgnoreRules, is_ignored
+from .snapshot import hash_tree
 
 # Use tomli for Python < 3.11, tomllib for 3.11+
 try:
@@ -17,15 +23,31 @@ except ImportError:
     import tomli as tomllib  # type: ignore
 
 # --- Constants ---
-DEFAULT_EXCLUDE_DIRS = {'.git', '__pycache__', '.venv', 'node_modules', '.mypy_cache', 'dist', 'build'}
+DEFAULT_EXCLUDE_DIRS = {'.git', '.lazykit', '__pycache__', '.venv', 'node_modules', '.mypy_cache', 'dist', 'build'}
 DEFAULT_EXCLUDE_FILES = {'.DS_Store'}
 MAGIC_COMMENT_REGEX = re.compile(r"(#|//|<!--)\s*lazykit:(\w+):\s*(.*?)(\s*-->)?")
 
 # --- Main Public Function ---
 def crawl_project_context(
     root_path: str,
-    extra_ignore_patterns: list[str] | None = None
+    extra_ignore_patterns: list[str] | None = None,
+    workers: int = 1,
+    processes: int = 0,
+    gitignore: bool = False,
+    cache: bool = False,
+    merkle: bool = False
 ) -> dict | None:
+    """Crawls root_path into a tree of directory and file nodes.
+
+    workers > 1 lists directories and reads files on a thread pool;
+    processes > 0 moves Python files (read + ast.parse) to a process pool.
+    Children keep their sorted slots, so the tree is identical to a serial crawl.
+    Ignore patterns follow .gitignore semantics; gitignore=True also applies the
+    .gitignore files found on the way down. An ignored directory is never listed.
+    cache=True reuses the results of earlier runs from root/.lazykit/cache for
+    files whose size, mtime and inode (or content) are unchanged.
+    merkle=True adds a "hash" to every node (see snapshot.hash_tree), for diffs.
+    """
     # Resolve the root_path to its absolute form right at the beginning
     # This 'root' will be the base for all relative paths in the tree structure
     root = pathlib.Path(root_path).resolve()
@@ -33,50 +55,43 @@ def crawl_project_context(
     if extra_ignore_patterns is None: extra_ignore_patterns = []
     full_exclude, content_only_exclude = _load_ignore_rules(root, extra_ignore_patterns)
 
-    def _crawl(path: pathlib.Path) -> dict | None:
-        # Calculate relative path from the root *once*
-        # This will be used for display and ignore pattern matching
-        try:
-            relative_to_root_str = str(path.relative_to(root)).replace("\\", "/").rstrip("/") #remove trailing slashes
-
-        except ValueError:
-            relative_to_root_str = str(path.relative_to(pathlib.Path.cwd())).replace("\\", "/").rstrip("/")
-
-        if any(fnmatch.fnmatch(relative_to_root_str, pattern) for pattern in full_exclude):
-            # print(f"[debug] Excluded: {relative_to_root_str}")  # debug - remove
-            return None
-
-        if path.name in DEFAULT_EXCLUDE_FILES: return None
-
-        if path.is_dir():
-            if path.name in DEFAULT_EXCLUDE_DIRS: return None
-
-            children = sorted(path.iterdir(), key=lambda p: (p.is_file(), p.name.lower()))
-            processed_children = filter(None, [_crawl(p) for p in children])
-            return {
-                "type": "directory",
-                "name": path.name,
-                "path": relative_to_root_str, # Store relative path for display
-                "absolute_path": str(path.resolve()), # Store absolute path (resolved)
-                "children": list(processed_children)
-            }
-        else: # It's a file
-            mime_type, _ = mimetypes.guess_type(path)
-            language = _infer_language(path.suffix, mime_type)
-
-            file_data = {
-                "type": "file",
-                "name": path.name,
-                "path": relative_to_root_str, # Store relative path for display
-                "absolute_path": str(path.resolve()), # Store absolute path (resolved)
-                "size": path.stat().st_size,
-                "language": language,
-            }
-            # Pass the absolute pathlib.Path object to _extract_file_context
-            return _extract_file_context(path, file_data, content_only_exclude)
-
-    # The very top-level dictionary should represent the root itself
-    crawled_tree = _crawl(root)
+    # --- 1. Walk: one directory level at a time, listings in parallel ---
+    crawled_tree, files = _walk(root, full_exclude, workers, gitignore)
+
+    # --- 2. Extract: cached results first, then file I/O on threads, Python parsing optionally in processes ---
+    extraction_cache = ExtractionCache(root) if cache and crawled_tree and crawled_tree["type"] == "directory" else None
+    missed = files
+    if extraction_cache is not None:
+        missed = _apply_cache(extraction_cache, files, content_only_exclude, workers)
+    extract = functools.partial(_extract_file_context, digest=extraction_cache is not None or merkle)
+    remote = [node for node, _ in missed if processes > 0 and node["language"] == "Python"]
+    local = [node for node, _ in missed if not (processes > 0 and node["language"] == "Python")]
+    with (ProcessPoolExecutor(processes) if remote else contextlib.nullcontext()) as process_pool, \
+            _thread_pool(workers) as pool:
+        parsed = []
+        if remote:  # submitted first: the processes fork before our threads start
+            parsed = process_pool.map(
+                extract, [node["absolute_path"] for node in remote], remote,
+                [content_only_exclude] * len(remote), chunksize=max(1, len(remote) // (processes * 4)))
+        _map(pool, lambda node: extract(node["absolute_path"], node, content_only_exclude), local)
+        for node, result in zip(remote, parsed):
+            node.update(result)  # results come back as copies
+
+    if extraction_cache is not None:
+        for node, stat in missed:
+            if not _content_ignored(node, content_only_exclude):
+                extraction_cache.put(node["path"], stat, node.get("digest"), node)
+        extraction_cache.save()
+
+    # --- 3. Hash: a file is its content digest where read, else its size and mtime ---
+    leaves = {}
+    for node, stat in files:
+        digest = node.pop("digest", None)
+        if merkle:
+            leaves[id(node)] = b"c" + digest if digest else f"s{stat.st_size}:{stat.st_mtime_ns}".encode()
+    if merkle and crawled_tree:
+        hash_tree(crawled_tree, leaves)
+
     # Ensure the root's 'path' is empty string and 'absolute_path' is its true resolved path
     if crawled_tree:
         crawled_tree["path"] = "" # The root directory's path relative to itself is empty
@@ -172,9 +187,121 @@ def get_metadata(project_tree: dict) -> dict:
 
 
 # --- Private Helper Functions ---
-def _load_ignore_rules(root: pathlib.Path, extra_patterns: list[str]) -> tuple[set[str], set[str]]:
-    # (This function is good, no changes needed)
-    full_exclude, content_only_exclude = set(), set()
+def _walk(root: pathlib.Path, full_exclude: IgnoreRules, workers: int = 1, gitignore: bool = False) -> tuple[dict | None, list[tuple[dict, os.stat_result]]]:
+    """Builds the tree without file contents; returns it and its (file node, stat) pairs in tree order."""
+    files: list[tuple[dict, os.stat_result]] = []
+    tree = _make_node(root, ".", ()) # the root itself is never matched
+    if tree is None: return None, files
+    if tree["type"] == "file": return tree, [(tree, root.stat())]
+    level = [("", tree, (full_exclude,))] # (relative path prefix, directory node, rules in force)
+    with _thread_pool(workers) as pool:
+        while level:
+            listings = _map(pool, lambda item: _list_dir(item[1]["absolute_path"], item[0], item[2], gitignore), level)
+            next_level = []
+            for (_, node, _), (children, rules) in zip(level, listings):
+                node["children"] = [child for child, _ in children]
+                for child, stat in children:
+                    if child["type"] == "directory":
+                        next_level.append((child["path"] + "/", child, rules))
+                    else:
+                        files.append((child, stat))
+            level = next_level
+    return tree, files
+
+
+def _make_node(entry: os.DirEntry | pathlib.Path, relative_to_root_str: str, rules: tuple[IgnoreRules, ...]) -> dict | None:
+    """Node for one entry, without children or extracted content; None if excluded.
+
+    A DirEntry answers is_dir()/is_symlink() from the directory listing and caches
+    its stat(), so a plain file costs one stat and a directory none.
+    """
+    name = entry.name
+    if name in DEFAULT_EXCLUDE_FILES: return None
+    is_dir = entry.is_dir()
+    if is_dir and name in DEFAULT_EXCLUDE_DIRS: return None
+    if is_ignored(rules, relative_to_root_str, is_dir): return None
+
+    path = os.fspath(entry) # already absolute: joined onto a resolved parent
+    absolute_path = os.path.realpath(path) if entry.is_symlink() else path # resolve only links
+    if is_dir:
+        return {
+            "type": "directory",
+            "name": name,
+            "path": relative_to_root_str, # Store relative path for display
+            "absolute_path": absolute_path, # Store absolute path (resolved)
+            "children": []
+        }
+    # It's a file
+    mime_type, _ = mimetypes.guess_type(path)
+    return {
+        "type": "file",
+        "name": name,
+        "path": relative_to_root_str, # Store relative path for display
+        "absolute_path": absolute_path, # Store absolute path (resolved)
+        "size": entry.stat().st_size,
+        "language": _infer_language(pathlib.PurePath(name).suffix, mime_type),
+    }
+
+
+def _list_dir(path: str, prefix: str, rules: tuple[IgnoreRules, ...], gitignore: bool = False) -> tuple[list[tuple[dict, os.stat_result | None]], tuple[IgnoreRules, ...]]:
+    """(node, stat) for the children of one directory, directories first, then by name,
+    and the rules in force below it (with its own .gitignore, if read).
+    Files come with the stat their DirEntry already cached; directories with None."""
+    with os.scandir(path) as it:
+        entries = sorted(it, key=lambda e: (e.is_file(), e.name.lower()))
+    if gitignore and any(entry.name == ".gitignore" and entry.is_file() for entry in entries):
+        rules = _with_gitignore(rules, os.path.join(path, ".gitignore"), prefix)
+    nodes = [(_make_node(entry, prefix + entry.name, rules), entry) for entry in entries]
+    return [(node, entry.stat() if node["type"] == "file" else None) for node, entry in nodes if node is not None], rules
+
+
+def _with_gitignore(rules: tuple[IgnoreRules, ...], path: str, prefix: str) -> tuple[IgnoreRules, ...]:
+    """Adds a .gitignore below the .lazykitignore rules (rules[0]) and above those of its parents."""
+    try:
+        with open(path, encoding="utf-8", errors="replace") as f:
+            gitignore_rules = IgnoreRules(f.read().splitlines(), base=prefix)
+    except OSError:
+        return rules
+    return (rules[0], gitignore_rules, *rules[1:]) if gitignore_rules else rules
+
+
+def _thread_pool(workers: int):
+    """ThreadPoolExecutor for workers > 1, else a context yielding None (run inline)."""
+    return ThreadPoolExecutor(workers) if workers > 1 else contextlib.nullcontext()
+
+
+def _map(pool: ThreadPoolExecutor | None, func, items) -> list:
+    """pool.map, or a plain serial map; results in input order either way."""
+    return list(pool.map(func, items) if pool is not None else map(func, items))
+
+
+def _apply_cache(
+    extraction_cache: ExtractionCache,
+    files: list[tuple[dict, os.stat_result]],
+    content_ignore: IgnoreRules,
+    workers: int = 1
+) -> list[tuple[dict, os.stat_result]]:
+    """Fills file nodes from the cache; returns the (node, stat) pairs left to extract."""
+    def lookup(item):
+        node, stat = item
+        if _content_ignored(node, content_ignore): return None
+        return extraction_cache.get(node["path"], stat, node["absolute_path"])
+
+    with _thread_pool(workers) as pool: # joined before a process pool forks
+        results = _map(pool, lookup, files)
+    missed = []
+    for (node, stat), result in zip(files, results):
+        if result is None:
+            missed.append((node, stat))
+        else:
+            node.update(result)
+            extraction_cache.keep(node["path"], stat)
+    return missed
+
+
+def _load_ignore_rules(root: pathlib.Path, extra_patterns: list[str]) -> tuple[IgnoreRules, IgnoreRules]:
+    # '!' marks content-only excludes here, so these patterns are never negations
+    full_exclude, content_only_exclude = [], []
     patterns = extra_patterns[:]
     ignore_file = root / ".lazykitignore"
     if ignore_file.exists():
@@ -186,18 +313,19 @@ def _load_ignore_rules(root: pathlib.Path, extra_patterns: list[str]) -> tuple[s
         pattern = pattern.strip()
         if not pattern or pattern.startswith("#"): continue
         if pattern.startswith("!"):
-            content_only_exclude.add(pattern[1:].strip())
+            content_only_exclude.append(pattern[1:].strip())
         else:
-            full_exclude.add(pattern)
-    return full_exclude, content_only_exclude
+            full_exclude.append(pattern)
+    return IgnoreRules(full_exclude, negation=False), IgnoreRules(content_only_exclude, negation=False)
 
 
-def _extract_file_context(path: pathlib.Path, file_data: dict, content_ignore_patterns: set[str], strategy: str = "trimmed") -> dict:
-    """Dispatcher to parse a file based on its type and enrich its metadata."""
+def _extract_file_context(path: str | pathlib.Path, file_data: dict, content_ignore: IgnoreRules, strategy: str = "trimmed", digest: bool = False) -> dict:
+    """Dispatcher to parse a file based on its type and enrich its metadata.
+    digest=True also stores a hash of the text read under 'digest', for the cache."""
     file_data['summary'] = None
     file_data['metadata'] = {}
 
-    if any(fnmatch.fnmatch(file_data['path'], pat) for pat in content_ignore_patterns):
+    if _content_ignored(file_data, content_ignore):
         file_data['summary'] = "Content ignored by .lazykitignore pattern."
         return file_data
     if file_data['size'] > 1_000_000:
@@ -205,10 +333,13 @@ def _extract_file_context(path: pathlib.Path, file_data: dict, content_ignore_pa
         return file_data
 
     try:
-        content = path.read_text(encoding='utf-8')
+        with open(path, encoding='utf-8') as f:
+            content = f.read()
     except (UnicodeDecodeError, IOError):
         file_data['summary'] = "File is binary or could not be read."
         return file_data
+    if digest:
+        file_data['digest'] = content_digest(content)
 
     if re.search(r"(#|//|<!--)\s*lazykit:ignore", content):
         file_data['summary'] = "File content parsing disabled by magic comment."
@@ -238,6 +369,10 @@ def _extract_file_context(path: pathlib.Path, file_data: dict, content_ignore_pa
     return file_data
 
 
+def _content_ignored(file_data: dict, content_ignore: IgnoreRules) -> bool:
+    return bool(content_ignore) and content_ignore.ignores(file_data['path'])
+
+
 def _infer_language(suffix: str, mime_type: str | None) -> str:
     # (This function is good, no changes needed)
     ext = suffix.lower()
@@ -0,0 +1,204 @@
+""" Compiled ignore rules with .gitignore semantics. """
+import re
+
+GLOB_CHARS = re.compile(r"[*?\[\\]")
+PREFIX_LEN = 3 # depth of the literal-prefix trie over glob patterns
+
+
+# --- Public API ---
+class IgnoreRules:
+    """The patterns of one ignore file, compiled once and matched per path.
+
+    Follows .gitignore: the last matching pattern wins and '!' re-includes
+    (when negation is on); a trailing '/' matches only directories; a pattern
+    with a '/' before its end is anchored to base, otherwise it matches a name
+    at any depth; '*' and '?' stop at '/', '**' crosses it.
+    Literal names, literal paths and '*.ext' patterns are dict lookups; other
+    patterns go in a trie on their literal prefix whose buckets are merged
+    into one regex each, so a path is matched against a few regexes however
+    many patterns there are.
+    """
+
+    def __init__(self, patterns: list[str], base: str = "", negation: bool = True):
+        self.base = base # directory of the ignore file, relative to the root, with a trailing '/'
+        self.negated: list[bool] = []
+        self.names: dict[str, list[tuple[int, bool]]] = {} # name -> [(index, dir_only)]
+        self.paths: dict[str, list[tuple[int, bool]]] = {}
+        self.suffixes: dict[str, list[tuple[int, bool]]] = {} # '*.tar.gz' -> '.tar.gz'
+        self.name_globs = _GlobTable() # matched against the last path component
+        self.path_globs = _GlobTable() # matched against the whole path below base
+        for line in patterns:
+            rule = _parse(line, negation)
+            if rule is None: continue
+            body, negated, dir_only, anchored = rule
+            index = len(self.negated)
+            self.negated.append(negated)
+            if not GLOB_CHARS.search(body):
+                (self.paths if anchored else self.names).setdefault(body, []).append((index, dir_only))
+            elif not anchored and body.startswith("*.") and not GLOB_CHARS.search(body, 1):
+                self.suffixes.setdefault(body[1:], []).append((index, dir_only))
+            elif anchored:
+                self.path_globs.add(index, dir_only, body, _translate(body))
+            else:
+                self.name_globs.add(index, dir_only, body, _translate_segment(body))
+        self.name_globs.compile()
+        self.path_globs.compile()
+
+    def __bool__(self) -> bool:
+        return bool(self.negated)
+
+    def match(self, path: str, is_dir: bool) -> bool | None:
+        """True if the last pattern matching path ignores it, False if it re-includes it, None if none match."""
+        if self.base:
+            if not path.startswith(self.base): return None
+            path = path[len(self.base):]
+        name = path.rpartition("/")[2]
+        best = max(_last(self.names.get(name), is_dir), _last(self.paths.get(path), is_dir),
+                   self.name_globs.last(name, is_dir), self.path_globs.last(path, is_dir))
+        if self.suffixes:
+            dot = name.find(".")
+            while dot != -1:
+                best = max(best, _last(self.suffixes.get(name[dot:]), is_dir))
+                dot = name.find(".", dot + 1)
+        return None if best < 0 else not self.negated[best]
+
+    def ignores(self, path: str) -> bool:
+        """Whether the file at path or any directory above it is matched."""
+        parts = path.split("/")
+        for depth in range(1, len(parts)):
+            if self.match("/".join(parts[:depth]), True): return True
+        return bool(self.match(path, False))
+
+
+def is_ignored(rules: tuple[IgnoreRules, ...], path: str, is_dir: bool) -> bool:
+    """Checks path against a stack of rules, highest precedence first; the first that matches decides."""
+    for rule_set in rules:
+        decision = rule_set.match(path, is_dir)
+        if decision is not None: return decision
+    return False
+
+
+# --- Private Helpers ---
+class _GlobTable:
+    """Glob patterns bucketed by up to PREFIX_LEN literal leading characters.
+
+    A text only visits the buckets of its own prefixes. Each bucket is tried
+    as one merged regex; only on a hit are its patterns scanned, latest first,
+    for the one that decides. (No capture groups: they stop re from factoring
+    common prefixes out of the alternation.)
+    """
+
+    def __init__(self):
+        self.pending: dict[str, list[tuple[int, bool, str]]] = {}
+        self.buckets: dict[str, tuple[re.Pattern | None, re.Pattern, list[tuple[int, bool, re.Pattern]]]] = {}
+
+    def add(self, index: int, dir_only: bool, body: str, regex: str):
+        glob = GLOB_CHARS.search(body)
+        prefix = body[:min(glob.start() if glob else len(body), PREFIX_LEN)]
+        self.pending.setdefault(prefix, []).append((index, dir_only, regex))
+
+    def compile(self):
+        for prefix, rules in self.pending.items():
+            files = [regex for _, dir_only, regex in rules if not dir_only]
+            self.buckets[prefix] = (
+                _compile("|".join(f"(?:{regex})" for regex in files)) if files else None,
+                _compile("|".join(f"(?:{regex})" for _, _, regex in rules)),
+                [(index, dir_only, _compile(regex)) for index, dir_only, regex in reversed(rules)],
+            )
+        self.pending = {}
+
+    def last(self, text: str, is_dir: bool) -> int:
+        """Index of the latest pattern matching text, else -1."""
+        best = -1
+        if not self.buckets: return best
+        for n in range(min(len(text), PREFIX_LEN) + 1):
+            bucket = self.buckets.get(text[:n])
+            if bucket is None: continue
+            merged = bucket[1] if is_dir else bucket[0]
+            if merged is None or not merged.fullmatch(text): continue
+            for index, dir_only, regex in bucket[2]:
+                if (is_dir or not dir_only) and regex.fullmatch(text):
+                    best = max(best, index)
+                    break
+        return best
+
+
+def _parse(line: str, negation: bool) -> tuple[str, bool, bool, bool] | None:
+    """(body, negated, dir_only, anchored) for one pattern line; None for blanks and comments.
+
+    A leading '/' only anchors and is dropped; a leading '**/' before a single
+    name is the same as the bare name.
+    """
+    line = line.rstrip("\n\r")
+    while line.endswith(" ") and not line.endswith("\\ "): # trailing spaces, unless escaped
+        line = line[:-1]
+    if not line or line.startswith("#"): return None
+    negated = negation and line.startswith("!")
+    if negated: line = line[1:]
+    dir_only = line.endswith("/") and not line.endswith("\\/")
+    if dir_only: line = line[:-1]
+    if line.startswith("**/") and "/" not in line[3:]:
+        line = line[3:]
+    anchored = "/" in line
+    line = line.removeprefix("/")
+    if not line: return None
+    return line, negated, dir_only, anchored
+
+
+def _translate(body: str) -> str:
+    """Regex for an anchored pattern, matched against the whole path below base."""
+    segments = body.split("/")
+    out = []
+    for i, segment in enumerate(segments):
+        last = i == len(segments) - 1
+        if segment == "**":
+            if last: # 'a/**': everything inside a
+                out.append(".+" if i else ".*")
+            else:    # '**/b', 'a/**/b': zero or more directories
+                out.append("(?:.*/)?")
+            continue
+        out.append(_translate_segment(segment))
+        if not last: out.append("/")
+    return "".join(out)
+
+
+def _translate_segment(segment: str) -> str:
+    """One path segment: '*' and '?' never match '/'; '[...]' classes; '\\' escapes."""
+    out, i, n = [], 0, len(segment)
+    while i < n:
+        char = segment[i]
+        i += 1
+        if char == "*":
+            while i < n and segment[i] == "*": i += 1 # 'a**b' is a plain '*'
+            out.append("[^/]*")
+        elif char == "?":
+            out.append("[^/]")
+        elif char == "\\" and i < n:
+            out.append(re.escape(segment[i]))
+            i += 1
+        elif char == "[":
+            end = i
+            if end < n and segment[end] in "!^": end += 1
+            if end < n and segment[end] == "]": end += 1
+            while end < n and segment[end] != "]": end += 1
+            if end >= n: # unterminated: a literal '['
+                out.append("\\[")
+                continue
+            chars = re.sub(r"([\\\[\]])", r"\\\1", segment[i:end]) # '\', '[', ']' are literal inside
+            if chars[0] in "!^": chars = "^/" + chars[1:] # negated classes still never match '/'
+            out.append(f"[{chars}]")
+            i = end + 1
+        else:
+            out.append(re.escape(char))
+    return "".join(out)
+
+
+def _compile(regex: str) -> re.Pattern:
+    return re.compile(regex, re.DOTALL)
+
+
+def _last(entries: list[tuple[int, bool]] | None, is_dir: bool) -> int:
+    """Index of the latest entry that applies to this node type, else -1."""
+    for index, dir_only in reversed(entries or ()):
+        if is_dir or not dir_only: return index
+    return -1
@@ -0,0 +1,78 @@
+""" Merkle hashes over the context tree; saving, loading and diffing snapshots. """
+import hashlib
+import json
+import os
+
+SNAPSHOT_VERSION = 1
+
+
+# --- Public API ---
+def hash_tree(tree: dict, leaves: dict[int, bytes]) -> str:
+    """Sets "hash" on every node, bottom-up, and returns the root's.
+
+    leaves maps id(file node) to its identity: a hash of its content, or its
+    size and mtime when the content was not read. A directory hashes the
+    type, name and hash of each child, so it changes iff something below it did.
+    """
+    if tree["type"] == "file":
+        digest = hashlib.blake2b(leaves.get(id(tree), b""), digest_size=16)
+    else:
+        digest = hashlib.blake2b(digest_size=16)
+        for child in tree["children"]:
+            digest.update(f"{child['type']}\0{child['name']}\0{hash_tree(child, leaves)}\n".encode("utf-8", "surrogateescape"))
+    tree["hash"] = digest.hexdigest()
+    return tree["hash"]
+
+
+def save(tree: dict, path: str | os.PathLike, ignore: list[str] = (), gitignore: bool = False):
+    """Writes tree with the ignore options it was crawled with, so a later
+    crawl to compare against can leave out the same files."""
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"lazykit_snapshot": SNAPSHOT_VERSION, "ignore": list(ignore), "gitignore": gitignore, "tree": tree}, f)
+
+
+def load(path: str | os.PathLike) -> tuple[dict, list[str], bool]:
+    """(tree, ignore, gitignore) of a snapshot written by save(); ValueError if it is not one."""
+    with open(path, encoding="utf-8") as f:
+        try:
+            data = json.load(f)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"{path} is not a lazykit snapshot ({e})") from None
+    if not isinstance(data, dict) or data.get("lazykit_snapshot") != SNAPSHOT_VERSION or "hash" not in (data.get("tree") or {}):
+        raise ValueError(f"{path} is not a lazykit snapshot (version {SNAPSHOT_VERSION})")
+    return data["tree"], data.get("ignore", []), data.get("gitignore", False)
+
+
+def diff(old: dict, new: dict) -> list[tuple[str, str]]:
+    """Changes from old to new as ('+' added | '-' removed | '~' changed, path).
+
+    Subtrees with equal hashes are skipped without being visited, so the
+    work is proportional to what changed. Directory paths end with '/';
+    an added or removed directory is reported once, not file by file.
+    """
+    changes: list[tuple[str, str]] = []
+    _diff(old, new, changes)
+    return changes
+
+
+# --- Private Helper Functions ---
+def _diff(old: dict, new: dict, changes: list[tuple[str, str]]):
+    if old["hash"] == new["hash"]: return
+    if old["type"] != new["type"]:
+        changes += [("-", _label(old)), ("+", _label(new))]
+        return
+    if old["type"] == "file":
+        changes.append(("~", _label(new)))
+        return
+    old_children = {child["name"]: child for child in old["children"]}
+    for child in new["children"]:
+        before = old_children.pop(child["name"], None)
+        if before is None:
+            changes.append(("+", _label(child)))
+        else:
+            _diff(before, child, changes)
+    changes += [("-", _label(child)) for child in old_children.values()]
+
+
+def _label(node: dict) -> str:
+    return node["path"] + "/" if node["type"] == "directory" and node["path"] else node["path"]
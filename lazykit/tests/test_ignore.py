@@ -0,0 +1,154 @@
+""" IgnoreRules against fixed .gitignore cases and against git itself. """
+# usage: `python -m unittest lazykit.tests.test_ignore` (or pytest) from the repo root
+import os
+import random
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from lazykit.core import context
+from lazykit.core.ignore import IgnoreRules, is_ignored
+
+# --- Fixed corpus ---
+# (patterns, file path, ignored): each file is checked with its directories,
+# as a crawl sees it. Every expectation was checked with `git ls-files -o --exclude-standard`.
+CASES = [
+    (["*.log"], "a.log", True),
+    (["*.log"], "d/e/a.log", True),
+    (["*.log"], "a.logx", False),
+    (["*.gz"], "a.tar.gz", True),
+    (["*.tar.gz"], "a.tar.gz", True),
+    (["*.tar.gz"], "a.gz", False),
+    (["build/"], "build/x", True),
+    (["build/"], "d/build/x", True),
+    (["build/"], "build", False),
+    (["/top"], "top", True),
+    (["/top"], "d/top", False),
+    (["a/b"], "a/b", True),
+    (["a/b"], "x/a/b", False),
+    (["doc/*.txt"], "doc/n.txt", True),
+    (["doc/*.txt"], "doc/s/n.txt", False),
+    (["doc/**/*.txt"], "doc/n.txt", True),
+    (["doc/**/*.txt"], "doc/s/t/n.txt", True),
+    (["**/foo"], "foo", True),
+    (["**/foo"], "x/y/foo", True),
+    (["a/**"], "a/x/y", True),
+    (["a/**"], "a", False),
+    (["a/**/b"], "a/b", True),
+    (["a/**/b"], "a/x/y/b", True),
+    (["d*/f"], "dx/f", True),
+    (["d*/f"], "dx/y/f", False),
+    (["f*"], "x/f1", True),
+    (["?x"], "ax", True),
+    (["?x"], "abx", False),
+    (["x[0-9]"], "x1", True),
+    (["x[0-9]"], "xa", False),
+    (["[!a]*"], "b", True),
+    (["[!a]*"], "a", False),
+    (["te\\[st]"], "te[st]", True),
+    (["te\\[st]"], "tes", False),
+    (["#c"], "#c", False),
+    (["\\#c"], "#c", True),
+    (["\\!b"], "!b", True),
+    (["sp\\ "], "sp ", True),
+    (["sp  "], "sp", True),
+    (["*.py", "!keep.py"], "keep.py", False),
+    (["*.py", "!keep.py"], "x.py", True),
+    (["!keep.py", "*.py"], "keep.py", True),
+    (["d/", "!d/k"], "d/k", True), # no re-including below an ignored directory
+    (["d/*", "!d/k"], "d/k", False),
+]
+
+
+class IgnoreRulesTest(unittest.TestCase):
+    def test_corpus(self):
+        for patterns, path, ignored in CASES:
+            with self.subTest(patterns=patterns, path=path):
+                self.assertEqual(IgnoreRules(patterns).ignores(path), ignored)
+
+    def test_base(self):
+        rules = IgnoreRules(["*.c", "/top"], base="sub/")
+        self.assertTrue(rules.match("sub/a.c", False))
+        self.assertTrue(rules.match("sub/top", False))
+        self.assertIsNone(rules.match("a.c", False))
+        self.assertIsNone(rules.match("sub/d/top", False))
+
+    def test_stack(self):
+        outer, inner = IgnoreRules(["*.c"]), IgnoreRules(["!x.c"], base="sub/")
+        self.assertFalse(is_ignored((inner, outer), "sub/x.c", False))
+        self.assertTrue(is_ignored((inner, outer), "sub/y.c", False))
+        self.assertTrue(is_ignored((inner, outer), "x.c", False))
+
+    def test_negation_off(self):
+        rules = IgnoreRules(["*.py", "!keep.py"], negation=False)
+        self.assertTrue(rules.match("keep.py", False))
+        self.assertTrue(rules.match("!keep.py", False))
+
+
+# --- Random trees against git ---
+NAMES = ["a", "b", "ab", "src", "lib", "doc", "x1", "x2", "foo", "te[st]", "sp ace", "d.o.t"]
+EXTS = ["", ".py", ".txt", ".log", ".tar.gz", ".pyc"]
+SEED, RUNS = 2610, 25
+
+
+def _name(r: random.Random) -> str:
+    return r.choice(NAMES) + r.choice(EXTS)
+
+
+def _segment(r: random.Random) -> str:
+    return r.choice([_name(r), "*", "*" + r.choice(EXTS[1:]), r.choice(NAMES) + "*", "?" + r.choice(["", "b", "1"]),
+                     "[ab]*", "[!a]*", "x[0-9]", "te\\[st]", "d.o.t*", "sp\\ ace"])
+
+
+def _pattern(r: random.Random) -> str:
+    kind = r.random()
+    if kind < .3: pattern = _segment(r)
+    elif kind < .5: pattern = "/".join(_segment(r) for _ in range(r.randint(2, 3)))
+    elif kind < .6: pattern = "**/" + _segment(r)
+    elif kind < .7: pattern = _segment(r) + "/**"
+    elif kind < .8: pattern = _segment(r) + "/**/" + _segment(r)
+    else: pattern = "/" + _segment(r)
+    if r.random() < .2: pattern += "/"
+    if r.random() < .2: pattern = "!" + pattern
+    return pattern
+
+
+def _make_tree(root: str, r: random.Random):
+    """Random files and directories, with a .gitignore in a few of the directories."""
+    dirs = [""]
+    for _ in range(r.randint(20, 120)):
+        parent = r.choice(dirs)
+        name = parent + _name(r)
+        path = os.path.join(root, name)
+        if parent.count("/") < 4 and r.random() < .35:
+            if not os.path.isfile(path):
+                os.makedirs(path, exist_ok=True)
+                dirs.append(name + "/")
+        elif not os.path.isdir(path):
+            with open(path, "w") as f: f.write("x")
+    for directory in r.sample(dirs, min(len(dirs), r.randint(1, 4))):
+        with open(os.path.join(root, directory, ".gitignore"), "w") as f:
+            f.write("\n".join(_pattern(r) for _ in range(r.randint(1, 12))) + "\n")
+
+
+def _files(node: dict) -> set[str]:
+    if node["type"] == "file": return {node["path"]}
+    return set().union(*(_files(child) for child in node.get("children", [])))
+
+
+@unittest.skipUnless(shutil.which("git"), "git is not installed")
+class GitComparisonTest(unittest.TestCase):
+    def test_random_trees(self):
+        for run in range(RUNS):
+            with self.subTest(seed=SEED + run), tempfile.TemporaryDirectory() as root:
+                _make_tree(root, random.Random(SEED + run))
+                subprocess.run(["git", "init", "-q", root], check=True)
+                listed = subprocess.run(["git", "-c", "core.quotePath=false", "ls-files", "-o", "--exclude-standard", "-z"],
+                                        cwd=root, capture_output=True, text=True, check=True).stdout
+                tree = context.crawl_project_context(root, gitignore=True)
+                self.assertEqual(_files(tree), set(listed.split("\0")) - {""})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,61 @@
+""" `lazykit tree --snapshot` followed by `lazykit diff`, as the docs use them. """
+# usage: `python -m unittest lazykit.tests.test_snapshot` (or pytest) from the repo root
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from lazykit.core import snapshot
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _lazykit(*args: str, cwd: str) -> str:
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, (REPO_ROOT, os.environ.get("PYTHONPATH")))))
+    done = subprocess.run([sys.executable, "-m", "lazykit", *args], cwd=cwd, env=env,
+                          capture_output=True, text=True, encoding="utf-8")
+    if done.returncode: raise AssertionError(f"lazykit {' '.join(args)} failed:\n{done.stderr}")
+    return done.stdout
+
+
+def _write(path: str, text: str):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f: f.write(text)
+
+
+class SnapshotDiffTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, True)
+        self.project = os.path.join(self.root, "proj")
+        _write(os.path.join(self.project, "src", "a.py"), '"""A module."""\n')
+        _write(os.path.join(self.project, "dist", "out.txt"), "build output\n")
+        _write(os.path.join(self.project, "notes.log"), "log\n")
+
+    def test_tree_writes_snapshot(self):
+        for long in ([], ["-l"]):
+            with self.subTest(long=long):
+                output = _lazykit("tree", *long, "-x", "dist", "-X", "*.log", "--snapshot", "before.json", cwd=self.project)
+                self.assertIn("[i] Saved snapshot to before.json", output)
+                tree, ignore, gitignore = snapshot.load(os.path.join(self.project, "before.json"))
+                self.assertEqual((ignore, gitignore), (["dist/", "*.log"], False))
+                self.assertNotIn("dist", [child["name"] for child in tree["children"]])
+                os.remove(os.path.join(self.project, "before.json"))
+
+    def test_diff_against_snapshot(self):
+        _lazykit("tree", "-x", "dist", "-X", "*.log", "--snapshot", os.path.join(self.root, "before.json"), cwd=self.project)
+        before = os.path.join(self.root, "before.json")
+        self.assertIn("[i] No changes.", _lazykit("diff", before, cwd=self.project))
+
+        _write(os.path.join(self.project, "src", "b.py"), "x = 1\n")
+        _write(os.path.join(self.project, "src", "a.py"), '"""Changed."""\n')
+        _write(os.path.join(self.project, "dist", "more.txt"), "excluded, not a change\n")
+        _write(os.path.join(self.project, "other.log"), "excluded, not a change\n")
+        lines = _lazykit("diff", before, cwd=self.project).splitlines()
+        self.assertEqual(lines, ["~ src/a.py", "+ src/b.py", "[i] 1 added, 0 removed, 1 changed"])
+
+
+if __name__ == "__main__":
+    unittest.main()
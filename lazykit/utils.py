@@ -13,6 +13,13 @@ class CustomFormatter(argparse.RawTextHelpFormatter):
             parts[-1] += f" {metavar}"
         return ', '.join(parts)
 
+
+def exclude_patterns(exclude_dir: list[str], exclude_file: list[str]) -> list[str]:
+    """Ignore patterns for the -x/-X options of tree and diff."""
+    # A trailing '/' matches directories only; a matched directory is pruned with everything inside.
+    return [pattern.rstrip("/") + "/" for pattern in exclude_dir] + list(exclude_file)
+
+
 def display_file_tree(
     tree: dict | None,
     indent: str = "",